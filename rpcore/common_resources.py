@@ -27,12 +27,13 @@ THE SOFTWARE.
 from __future__ import division
 
 from panda3d.core import CS_yup_right, CS_zup_right, invert, Vec3, Mat4, Vec4
-from panda3d.core import SamplerState
+from panda3d.core import SamplerState, LVecBase2i
 from direct.stdpy.file import open
 
 from rpcore.globals import Globals
 from rpcore.rpobject import RPObject
 from rpcore.loader import RPLoader
+from rpcore.render_target import RenderTarget
 
 from rpcore.util.shader_input_blocks import GroupedInputBlock
 
@@ -47,6 +48,15 @@ class CommonResources(RPObject):
         self._pipeline = pipeline
         self._showbase = Globals.base
         self._ptas = {}
+
+        # State of the camera, lens and screen at the last update, and the
+        # amount of consecutive updates in which it did not change
+        self._last_camera_state = None
+        self._num_static_frames = 0
+
+        # Amount of updates in which the camera dependent inputs were skipped
+        self.num_skipped_updates = 0
+
         self._load_fonts()
         self._load_textures()
         self._setup_inputs()
@@ -66,7 +76,8 @@ class CommonResources(RPObject):
         """ Creates commonly used shader inputs such as the current mvp and
         registers them to the stage manager so they can be used for rendering """
 
-        self._input_ubo = GroupedInputBlock("MainSceneData")
+        self._input_ubo = GroupedInputBlock(
+            "MainSceneData", packed=self._pipeline.settings["pipeline.packed_main_scene_data"])
         inputs = (
             ("camera_pos", "vec3"),
             ("view_proj_mat_no_jitter", "mat4"),
@@ -83,6 +94,7 @@ class CommonResources(RPObject):
             ("frame_index", "int"),
             ("screen_size", "ivec2"),
             ("native_screen_size", "ivec2"),
+            ("viewport_uv_scale", "vec2"),
             ("lc_tile_count", "ivec2"),
             ("ws_frustum_directions", "mat4"),
             ("vs_frustum_directions", "mat4"),
@@ -164,11 +176,42 @@ class CommonResources(RPObject):
         return skybox
 
     def update(self):
-        """ Updates the commonly used resources, mostly the shader inputs """
+        """ Updates the commonly used resources, mostly the shader inputs. The
+        camera dependent inputs are only recomputed if the camera transform, the
+        lens or the screen size changed. """
         update = self._input_ubo.update_input
 
         # Get the current transform matrix of the camera
         view_mat = Globals.render.get_transform(self._showbase.cam).get_mat()
+        proj_mat = Mat4(self._showbase.camLens.get_projection_mat())
+
+        camera_state = (Mat4(view_mat), proj_mat, LVecBase2i(Globals.resolution),
+                        LVecBase2i(Globals.native_resolution))
+        if camera_state == self._last_camera_state:
+            self._num_static_frames += 1
+        else:
+            self._num_static_frames = 0
+        self._last_camera_state = camera_state
+
+        # On the first frame without changes, the last frame matrices still
+        # have to be set to the (unchanged) current ones. From then on, all
+        # camera dependent inputs stay the same.
+        if self._num_static_frames >= 2:
+            self.num_skipped_updates += 1
+        else:
+            self._update_camera_inputs(view_mat, proj_mat)
+
+        # Store the frame delta
+        update("frame_delta", Globals.clock.get_dt())
+        update("smooth_frame_delta", 1.0 / max(1e-5, Globals.clock.get_average_frame_rate()))
+        update("frame_time", Globals.clock.get_frame_time())
+        update("frame_index", Globals.clock.get_frame_count())
+        self._input_ubo.flush()
+
+    def _update_camera_inputs(self, view_mat, proj_mat):
+        """ Internal method to update all inputs which depend on the camera,
+        the lens or the screen size """
+        update = self._input_ubo.update_input
 
         # Compute the view matrix, but with a z-up coordinate system
         zup_conversion = Mat4.convert_mat(CS_zup_right, CS_yup_right)
@@ -191,7 +234,7 @@ class CommonResources(RPObject):
         curr_inv_vp = curr_vp
         update("last_inv_view_proj_mat_no_jitter", curr_inv_vp)
 
-        proj_mat = Mat4(self._showbase.camLens.get_projection_mat())
+        proj_mat = Mat4(proj_mat)
 
         # Set the projection matrix as an input, but convert it to the correct
         # coordinate system before.
@@ -206,16 +249,10 @@ class CommonResources(RPObject):
         proj_mat.set_cell(1, 1, 0.0)
         update("view_proj_mat_no_jitter", view_mat * proj_mat)
 
-        # Store the frame delta
-        update("frame_delta", Globals.clock.get_dt())
-        update("smooth_frame_delta", 1.0 / max(1e-5, Globals.clock.get_average_frame_rate()))
-        update("frame_time", Globals.clock.get_frame_time())
-
         # Store the current film offset, we use this to compute the pixel-perfect
         # velocity, which is otherwise not possible. Usually this is always 0
         # except when SMAA and reprojection is enabled
         update("current_film_offset", self._showbase.camLens.get_film_offset())
-        update("frame_index", Globals.clock.get_frame_count())
 
         # Compute frustum corners in the order BL, BR, TL, TR
         ws_frustum_directions = Mat4()
@@ -236,4 +273,5 @@ class CommonResources(RPObject):
 
         update("screen_size", Globals.resolution)
         update("native_screen_size", Globals.native_resolution)
+        update("viewport_uv_scale", RenderTarget.get_viewport_uv_scale())
         update("lc_tile_count", self._pipeline.light_mgr.num_tiles)
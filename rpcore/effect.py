@@ -24,11 +24,13 @@ THE SOFTWARE.
 
 """
 
-from rplibs.six import iteritems, iterkeys
+import hashlib
+
+from rplibs.six import iteritems, iterkeys, itervalues
 from rplibs.yaml import load_yaml_file
 
-from panda3d.core import Filename
-from direct.stdpy.file import open
+from panda3d.core import VirtualFileSystem
+from direct.stdpy.file import open, isfile
 
 from rpcore.rpobject import RPObject
 from rpcore.loader import RPLoader
@@ -56,10 +58,21 @@ class Effect(RPObject):
     # TagStateManager class.
     _PASSES = ("gbuffer", "shadow", "voxelize", "envmap", "forward")
 
-    # Effects are cached based on their source filename and options, this is
-    # the cache where compiled are effects stored.
+    # Effects are cached based on the contents of their source file and the
+    # shader templates, and their options. This is the cache where compiled
+    # effects are stored.
     _GLOBAL_CACHE = {}
 
+    # Digests of the effect and template files read so far, so that loading an
+    # already cached effect does not have to read any files
+    _FILE_HASHES = {}
+
+    # Whether generated shaders are kept in the write path across runs. Since
+    # they are stored by content hash, a warm start can skip parsing and
+    # expanding the templates entirely. See enable_persistent_cache().
+    _PERSISTENT_CACHE = False
+    _PERSISTENT_CACHE_DIR = "/$$rptemp/effect-cache/"
+
     # Global counter to store the amount of generated effects, used to create
     # a unique id used for writing temporary files.
     _EFFECT_ID = 0
@@ -70,7 +83,12 @@ class Effect(RPObject):
         This lookups in the global effect cache, and checks if a similar effect
         (i.e. with the same hash) was already loaded, and in that case returns it.
         Otherwise a new effect with the given options is created. """
-        effect_hash = cls._generate_hash(filename, options)
+        try:
+            effect_hash = cls._generate_hash(filename, options)
+        except IOError as msg:
+            RPObject.global_error("Effect", "Could not read effect:", msg)
+            return None
+
         if effect_hash in cls._GLOBAL_CACHE:
             return cls._GLOBAL_CACHE[effect_hash]
         effect = cls()
@@ -78,31 +96,78 @@ class Effect(RPObject):
         if not effect.do_load(filename):
             RPObject.global_error("Effect", "Could not load effect!")
             return None
+        cls._GLOBAL_CACHE[effect_hash] = effect
         return effect
 
+    @classmethod
+    def get_shader_requests(cls):
+        """ Returns the arguments passed to RPLoader.load_shader for all shaders
+        of the currently loaded effects """
+        requests = set()
+        for effect in itervalues(cls._GLOBAL_CACHE):
+            requests |= effect.shader_requests
+        return requests
+
+    @classmethod
+    def clear_cache(cls):
+        """ Clears the in-memory effect cache, so that changed effect files and
+        templates are picked up again. This is called when reloading shaders.
+        The persistent cache does not need to be cleared, since it is keyed
+        by content. """
+        cls._GLOBAL_CACHE = {}
+        cls._FILE_HASHES = {}
+
+    @classmethod
+    def enable_persistent_cache(cls):
+        """ Makes generated shaders persist in the write path, so they can
+        be reused on later runs. This requires the write path to be an actual
+        directory, and not the default ramdisk. """
+        VirtualFileSystem.get_global_ptr().make_directory_full(cls._PERSISTENT_CACHE_DIR)
+        cls._PERSISTENT_CACHE = True
+
+    @classmethod
+    def _get_template_path(cls, pass_id, stage):
+        """ Returns the path to the shader template of a given pass and stage """
+        if stage == "vertex":
+            # Using a shared vertex shader
+            return "/$$rp/shader/templates/vertex.vert.glsl"
+        return "/$$rp/shader/templates/{}.frag.glsl".format(pass_id)
+
+    @classmethod
+    def _get_file_hash(cls, filename):
+        """ Returns the digest of the given file, reading it only the first time """
+        if filename not in cls._FILE_HASHES:
+            with open(filename, "rb") as handle:
+                cls._FILE_HASHES[filename] = hashlib.sha1(handle.read()).hexdigest()
+        return cls._FILE_HASHES[filename]
+
     @classmethod
     def _generate_hash(cls, filename, options):
         """ Generates an unique hash for the effect. The effect hash is based
-        on the filename and the configured options, and is ensured to make the
-        effect unique. This is important to make sure the caching works as
-        intended. All options not present in options are set to the default value"""
+        on the contents of the effect file and all shader templates, and the
+        configured options. This makes sure the effect is rebuilt whenever one
+        of its sources changes. All options not present in options are set to
+        the default value. Raises an IOError if a source can not be read. """
 
         # Set all options which are not present in the dict to its defaults
         options = {k: options.get(k, v) for k, v in iteritems(cls._DEFAULT_OPTIONS)}
 
-        # Hash filename, make sure it has the right format and also resolve
-        # it to an absolute path, to make sure that relative paths are cached
-        # correctly (otherwise, specifying a different path to the same file
-        # will cause a cache miss)
-        filename = Filename(filename)
-        filename.make_absolute()
-        file_hash = str(hash(filename.to_os_generic()))
-
         # Hash the options, that is, sort the keys to make sure the values
         # are always in the same order, and then convert the flags to strings using
         # '1' for a set flag, and '0' for a unset flag
         options_hash = "".join(["1" if options[key] else "0" for key in sorted(iterkeys(options))])
-        return file_hash + "-" + options_hash
+
+        sources = [filename]
+        for pass_id in cls._PASSES:
+            for stage in ("vertex", "fragment"):
+                template_src = cls._get_template_path(pass_id, stage)
+                if template_src not in sources:
+                    sources.append(template_src)
+
+        hasher = hashlib.sha1(options_hash.encode("ascii"))
+        for source in sources:
+            hasher.update(cls._get_file_hash(source).encode("ascii"))
+        return hasher.hexdigest()[:24] + "-" + options_hash
 
     def __init__(self):
         """ Constructs a new empty effect, this is a private constructor and
@@ -114,6 +179,7 @@ class Effect(RPObject):
         self._options = self._DEFAULT_OPTIONS.copy()
         self._generated_shader_paths = {}
         self._shader_objs = {}
+        self.shader_requests = set()
 
     def get_option(self, name):
         """ Returns a given option value by name """
@@ -134,15 +200,47 @@ class Effect(RPObject):
         self.effect_name = self._convert_filename_to_name(filename)
         self.effect_hash = self._generate_hash(filename, self._options)
 
-        # Load the YAML file
-        parsed_yaml = load_yaml_file(filename) or {}
-        self._parse_content(parsed_yaml)
+        # Reuse the shaders generated by an earlier run if possible, otherwise
+        # load the YAML file and generate them
+        if not self._load_from_persistent_cache():
+            parsed_yaml = load_yaml_file(filename) or {}
+            self._parse_content(parsed_yaml)
+            if self._PERSISTENT_CACHE:
+                with open(self._get_persistent_marker_path(), "w") as handle:
+                    handle.write(self.filename)
 
         # Construct a shader object for each pass
         for pass_id in self._PASSES:
             vertex_src = self._generated_shader_paths["vertex-" + pass_id]
             fragment_src = self._generated_shader_paths["fragment-" + pass_id]
             self._shader_objs[pass_id] = RPLoader.load_shader(vertex_src, fragment_src)
+            self.shader_requests.add((vertex_src, fragment_src))
+        return True
+
+    def _get_generated_shader_path(self, cache_key):
+        """ Returns the path where the shader with the given cache key gets
+        written to """
+        if self._PERSISTENT_CACHE:
+            return self._PERSISTENT_CACHE_DIR + "effect-" + cache_key + ".glsl"
+        return "/$$rptemp/$$effect-" + cache_key + ".glsl"
+
+    def _get_persistent_marker_path(self):
+        """ Returns the path of the file which marks that all shaders of this
+        effect were written to the persistent cache. It is written last, so
+        an interrupted run does not leave an incomplete cache entry. """
+        return self._PERSISTENT_CACHE_DIR + "effect-" + self.effect_hash + ".done"
+
+    def _load_from_persistent_cache(self):
+        """ Checks if the shaders of this effect were already generated by an
+        earlier run, and if so, uses them. Returns True on success. """
+        if not self._PERSISTENT_CACHE or not isfile(self._get_persistent_marker_path()):
+            return False
+        for pass_id in self._PASSES:
+            for stage in ("vertex", "fragment"):
+                path = self._get_generated_shader_path(self._get_cache_key(pass_id, stage))
+                if not isfile(path):
+                    return False
+                self._generated_shader_paths[stage + "-" + pass_id] = path
         return True
 
     def get_shader_obj(self, pass_id):
@@ -171,13 +269,7 @@ class Effect(RPObject):
     def _parse_shader_template(self, pass_id, stage, data):
         """ Parses a fragment template. This just finds the default template
         for the shader, and redirects that to construct_shader_from_data """
-        if stage == "fragment":
-            shader_ext = {"vertex": "vert", "fragment": "frag"}[stage]
-            template_src = "/$$rp/shader/templates/{}.{}.glsl".format(pass_id, shader_ext)
-        elif stage == "vertex":
-            # Using a shared vertex shader
-            template_src = "/$$rp/shader/templates/vertex.vert.glsl"
-
+        template_src = self._get_template_path(pass_id, stage)
         shader_path = self._construct_shader_from_data(pass_id, stage, template_src, data)
         self._generated_shader_paths[stage + "-" + pass_id] = shader_path
 
@@ -216,9 +308,14 @@ class Effect(RPObject):
                 continue
             injects[key] = injects.get(key, []) + [i for i in val.split("\n")]
 
-        cache_key = self.effect_name + "@" + stage + "-" + pass_id + "@" + self.effect_hash
+        cache_key = self._get_cache_key(pass_id, stage)
         return self._process_shader_template(template_src, cache_key, injects)
 
+    def _get_cache_key(self, pass_id, stage):
+        """ Returns the key identifying the generated shader of a given pass
+        and stage """
+        return self.effect_name + "@" + stage + "-" + pass_id + "@" + self.effect_hash
+
     def _process_shader_template(self, template_src, cache_key, injections):  # noqa # pylint: disable=too-many-branches
         """ Generates a compiled shader object from a given shader
         source location and code injection definitions. """
@@ -299,7 +396,7 @@ class Effect(RPObject):
 
         # Write the constructed shader and load it back
         shader_content = "\n".join(parsed_lines)
-        temp_path = "/$$rptemp/$$effect-" + cache_key + ".glsl"
+        temp_path = self._get_generated_shader_path(cache_key)
 
         with open(temp_path, "w") as handle:
             handle.write(shader_content)
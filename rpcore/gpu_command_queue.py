@@ -31,7 +31,8 @@ from rpcore.rpobject import RPObject
 from rpcore.loader import RPLoader
 from rpcore.render_target import RenderTarget
 
-from rpcore.native import GPUCommand, GPUCommandList
+from rpcore.native import GPUCommand, GPUCommandList, NATIVE_CXX_LOADED
+from rpcore.pynative.coalescing_command_list import CoalescingCommandList
 
 
 class GPUCommandQueue(RPObject):
@@ -43,8 +44,9 @@ class GPUCommandQueue(RPObject):
         RPObject.__init__(self)
         self._pipeline = pipeline
         self._commands_per_frame = 1024
-        self._command_list = GPUCommandList()
+        self._command_list = self._create_command_list()
         self._pta_num_commands = PTAInt.empty_array(1)
+        self._bytes_uploaded = 0
         self._create_data_storage()
         self._create_command_target()
         self._commands = []
@@ -73,12 +75,34 @@ class GPUCommandQueue(RPObject):
         command queue was updated """
         return self._pta_num_commands[0]
 
+    @property
+    def bytes_uploaded(self):
+        """ Returns the amount of command data in bytes which was uploaded
+        the last time when the command queue was updated """
+        return self._bytes_uploaded
+
     def process_queue(self):
         """ Processes the n first commands of the queue """
+        if self._command_list.num_commands == 0:
+            # Don't touch the ram image, otherwise the whole buffer would get
+            # uploaded again although no command gets executed
+            self._pta_num_commands[0] = 0
+            self._bytes_uploaded = 0
+            return
+
         pointer = self._data_texture.modify_ram_image()
         num_commands_exec = self._command_list.write_commands_to(
             pointer, self._commands_per_frame)
         self._pta_num_commands[0] = num_commands_exec
+        self._bytes_uploaded = num_commands_exec * 32 * 4
+
+    @property
+    def num_coalesced_commands(self):
+        """ Returns the total amount of commands which were merged into
+        other commands or dropped, or 0 if commands are not coalesced """
+        if isinstance(self._command_list, CoalescingCommandList):
+            return self._command_list.num_coalesced
+        return 0
 
     def reload_shaders(self):
         """ Reloads the command shader """
@@ -91,6 +115,16 @@ class GPUCommandQueue(RPObject):
         """ Registers an new shader input to the command target """
         self._command_target.set_shader_input(key, val)
 
+    def _create_command_list(self):
+        """ Creates the command list. When using the python modules, redundant
+        commands can get merged before they are uploaded, see CoalescingCommandList. """
+        settings = self._pipeline.settings
+        if NATIVE_CXX_LOADED or not settings["lighting.coalesce_gpu_commands"]:
+            return GPUCommandList()
+        self.debug("Coalescing gpu commands")
+        return CoalescingCommandList(
+            partial_updates=settings["lighting.partial_light_updates"])
+
     def _register_defines(self):
         """ Registers all the command types as defines so they can be used
         in a shader later on """
@@ -243,11 +243,12 @@ class Debugger(RPObject):
             return task.again if task else None
 
         text = "{:4d} states |  {:4d} transforms "
-        text += "|  {:4d} cmds |  {:4d} lights |  {:4d} shadows "
+        text += "|  {:4d} cmds ({:4.0f} KB) |  {:4d} lights |  {:4d} shadows "
         text += "|  {:5.1f}% atlas usage"
         self.debug_lines[1].text = text.format(
             RenderState.get_num_states(), TransformState.get_num_states(),
             self.pipeline.light_mgr.cmd_queue.num_processed_commands,
+            self.pipeline.light_mgr.cmd_queue.bytes_uploaded / 1024.0,
             self.pipeline.light_mgr.num_lights,
             self.pipeline.light_mgr.num_shadow_sources,
             self.pipeline.light_mgr.shadow_atlas_coverage)
@@ -274,7 +275,7 @@ class Debugger(RPObject):
             views, active_views)
 
         text = "Scene:   {:4.0f} MB VRAM |  {:3d} tex |  {:4d} geoms "
-        text += "|  {:4d} nodes |  {:7,.0f} vertices"
+        text += "|  {:4d} nodes |  {:7,.0f} vertices |  {:6d} static frames"
         scene_tex_size = 0
         for tex in TexturePool.find_all_textures():
             scene_tex_size += tex.estimate_texture_memory()
@@ -285,6 +286,7 @@ class Debugger(RPObject):
             self.analyzer.get_num_geoms(),
             self.analyzer.get_num_nodes(),
             self.analyzer.get_num_vertices(),
+            self.pipeline.common_resources.num_skipped_updates,
         )
 
         sun_vector = Vec3(0)
@@ -293,7 +295,7 @@ class Debugger(RPObject):
 
         text = "Time:  {} ({:1.3f}) |  Sun  {:0.2f} {:0.2f} {:0.2f}"
         text += " |  X {:3.1f}  Y {:3.1f}  Z {:3.1f}"
-        text += " |  {:2d} tasks |  scheduled: {:2d}"
+        text += " |  {:2d} tasks |  scheduled: {:2d} |  slipped: {:2d}"
         self.debug_lines[4].text = text.format(
             self.pipeline.daytime_mgr.formatted_time,
             self.pipeline.daytime_mgr.time,
@@ -302,7 +304,8 @@ class Debugger(RPObject):
             Globals.base.camera.get_y(Globals.base.render),
             Globals.base.camera.get_z(Globals.base.render),
             self.pipeline.task_scheduler.num_tasks,
-            self.pipeline.task_scheduler.num_scheduled_tasks,)
+            self.pipeline.task_scheduler.num_scheduled_tasks,
+            self.pipeline.task_scheduler.num_slipped_tasks,)
 
         text = "Scene shadows:  "
         if "pssm" in self.pipeline.plugin_mgr.enabled_plugins:
@@ -32,7 +32,9 @@ from rpcore.globals import Globals
 from rpcore.gpu_command_queue import GPUCommandQueue
 from rpcore.image import Image
 from rpcore.native import InternalLightManager, PointLight, ShadowManager
+from rpcore.native import NATIVE_CXX_LOADED
 from rpcore.rpobject import RPObject
+from rpcore.pynative.light_data_store import LightDataStore
 
 from rpcore.stages.apply_lights_stage import ApplyLightsStage
 from rpcore.stages.collect_used_cells_stage import CollectUsedCellsStage
@@ -130,6 +132,8 @@ class LightManager(RPObject):
         self.shadow_manager.set_scene(Globals.base.render)
         self.shadow_manager.set_tag_state_manager(self.pipeline.tag_mgr)
         self.shadow_manager.atlas_size = self.pipeline.settings["shadows.atlas_size"]
+        if not NATIVE_CXX_LOADED:
+            self.shadow_manager.atlas_backend = self.pipeline.settings["shadows.atlas_backend"]
         self.internal_mgr.shadow_manager = self.shadow_manager
 
     def init_shadows(self):
@@ -151,6 +155,16 @@ class LightManager(RPObject):
             "LightData", self.MAX_LIGHTS * per_light_vec4s, "RGBA16")
         self.img_light_data.clear_image()
 
+        # With the python implementation, lights can be written into the
+        # light data buffer directly instead of using the command queue
+        if not NATIVE_CXX_LOADED and self.pipeline.settings["lighting.bulk_light_updates"]:
+            if LightDataStore.is_available():
+                self.debug("Using numpy light store for bulk light updates")
+                self.internal_mgr.light_store = LightDataStore(
+                    self.MAX_LIGHTS, self.img_light_data)
+            else:
+                self.warn("bulk_light_updates requires numpy, falling back to the command queue")
+
         self.pta_max_light_index = PTAInt.empty_array(1)
         self.pta_max_light_index[0] = 0
 
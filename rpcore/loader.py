@@ -33,6 +33,7 @@ from panda3d.core import Shader
 
 from rpcore.globals import Globals
 from rpcore.rpobject import RPObject
+from rpcore.util.shader_cache import ShaderCache
 
 __all__ = ("RPLoader",)
 
@@ -69,6 +70,36 @@ class RPLoader(RPObject):
     """ Generic loader class used by the pipeline. All loading of assets happens
     here, which enables us to keep track of used resources """
 
+    # Optional ShaderCache instance, see enable_shader_cache()
+    SHADER_CACHE = None
+
+    # List of recorded shader requests while collecting, see
+    # collect_shader_requests()
+    _SHADER_REQUESTS = None
+    _PLACEHOLDER_SHADER = None
+
+    @classmethod
+    def enable_shader_cache(cls, cache_dir=None):
+        """ Makes all shaders get loaded through a shader cache. If a cache
+        directory is given, the cache persists across runs """
+        cls.SHADER_CACHE = ShaderCache(cache_dir)
+
+    @classmethod
+    def collect_shader_requests(cls, callback):
+        """ Calls the given callback while recording all shader requests
+        instead of loading them, and returns the list of requests. While
+        collecting, load_shader returns a placeholder shader, so the callback
+        has to be called again afterwards to actually set the shaders. """
+        if cls._PLACEHOLDER_SHADER is None:
+            cls._PLACEHOLDER_SHADER = Shader.make(
+                Shader.SL_GLSL, "void main() {}", "void main() {}")
+        cls._SHADER_REQUESTS = []
+        try:
+            callback()
+            return cls._SHADER_REQUESTS
+        finally:
+            cls._SHADER_REQUESTS = None
+
     @classmethod
     def load_texture(cls, filename):
         """ Loads a 2D-texture from disk """
@@ -96,7 +127,14 @@ class RPLoader(RPObject):
     @classmethod
     def load_shader(cls, *args):
         """ Loads a shader from disk """
+        if cls._SHADER_REQUESTS is not None:
+            cls._SHADER_REQUESTS.append(args)
+            return cls._PLACEHOLDER_SHADER
         with timed_loading_operation(args):
+            if cls.SHADER_CACHE is not None:
+                shader = cls.SHADER_CACHE.load(*args)
+                if shader is not None:
+                    return shader
             if len(args) == 1:
                 return Shader.load_compute(Shader.SL_GLSL, args[0])
             return Shader.load(Shader.SL_GLSL, *args)
@@ -26,12 +26,16 @@ THE SOFTWARE.
 
 from __future__ import division
 
+from array import array
+
 from rplibs.six import iteritems
+from rplibs.six.moves import range  # pylint: disable=import-error
 from direct.stdpy.file import open
 
 from rpcore.rpobject import RPObject
 from rpcore.util.shader_input_blocks import GroupedInputBlock
 from rpcore.pluginbase.day_setting_types import ColorType
+from rpcore.util.smooth_connected_curve import SmoothConnectedCurve
 
 
 class DayTimeManager(RPObject):
@@ -46,6 +50,14 @@ class DayTimeManager(RPObject):
         self._time = 0.5
         self._setting_handles = {}
 
+        # Baked curve values, see _bake_curves()
+        self._baked_resolution = 0
+        self._baked_table = None
+        self._baked_width = 0
+        self._baked_columns = []
+        self._baked_version = -1
+        self._last_lookup = None
+
     @property
     def time(self):
         """ Returns the current time of day as floating point number
@@ -87,8 +99,75 @@ class DayTimeManager(RPObject):
         with open("/$$rptemp/$$daytime_config.inc.glsl", "w") as handle:
             handle.write(shader_code)
 
+        resolution = self._pipeline.settings["pipeline.daytime_curve_resolution"]
+        if resolution > 0:
+            self._setup_baking(resolution)
+
+    def _setup_baking(self, resolution):
+        """ Prepares the table storing the values of all settings at each of
+        the given amount of steps over the day. Every setting occupies one
+        column per curve. """
+        self._baked_resolution = resolution
+        self._baked_columns = []
+        offset = 0
+        for setting_id, handle in sorted(iteritems(self._setting_handles)):
+            pta = self._input_ubo.ptas[setting_id]
+            self._baked_columns.append((handle, pta, offset, [-1] * len(handle.curves)))
+            offset += len(handle.curves)
+        self._baked_width = offset
+        self._baked_table = array("f", [0.0]) * (resolution * offset)
+        self._baked_version = -1
+        self.debug("Baking", offset, "curves with", resolution, "steps")
+
+    def _bake_curves(self):
+        """ Samples all curves which changed since they were baked last time
+        into the table. The stored values are exactly what update() would
+        pass to the shaders, including the scaling. """
+        table, width, resolution = self._baked_table, self._baked_width, self._baked_resolution
+        for handle, _, offset, versions in self._baked_columns:
+            for index, curve in enumerate(handle.curves):
+                if versions[index] == curve.version:
+                    continue
+                versions[index] = curve.version
+                for step in range(resolution):
+                    value = curve.get_value(step / resolution)
+                    if not isinstance(handle, ColorType):
+                        value = handle.get_scaled_value(value)
+                    table[step * width + offset + index] = value
+        self._baked_version = SmoothConnectedCurve.MODIFICATION_COUNT
+        self._last_lookup = None
+
+    def _update_baked(self):
+        """ Updates all day time settings from the baked table, by linearly
+        interpolating the two rows next to the current time """
+        if self._baked_version != SmoothConnectedCurve.MODIFICATION_COUNT:
+            self._bake_curves()
+
+        position = self._time * self._baked_resolution
+        step = int(position) % self._baked_resolution
+        lookup = (step, position - int(position))
+        if lookup == self._last_lookup:
+            return
+        self._last_lookup = lookup
+
+        table, width, weight = self._baked_table, self._baked_width, lookup[1]
+        start = step * width
+        end = ((step + 1) % self._baked_resolution) * width
+        row = [a + (b - a) * weight for a, b in zip(
+            table[start:start + width], table[end:end + width])]
+
+        for _, pta, offset, versions in self._baked_columns:
+            if len(versions) == 1:
+                pta[0] = row[offset]
+            else:
+                pta[0] = tuple(row[offset:offset + len(versions)])
+
     def update(self):
         """ Internal update method which updates all day time settings """
+        if self._baked_table is not None:
+            self._update_baked()
+            return
+
         for setting_id, handle in iteritems(self._setting_handles):
             # XXX: Find a better interface for this. Without this fix, colors
             # are in the range 0 .. 255 in the shader.
@@ -278,5 +278,10 @@ class PluginManager(RPObject):
 
         if setting.shader_runtime:
             self.init_defines()
-            self._pipeline.stage_mgr.write_autoconfig()
+            # Only reload the shaders using the changed define, if possible.
+            # The plugin might pick different shaders based on the setting,
+            # so its own stages get reloaded regardless, which is cheap since
+            # unchanged shaders come from the shader cache.
+            if not self._pipeline.reload_changed_shaders():
+                self._pipeline.stage_mgr.write_autoconfig()
             self.instances[plugin_id].reload_shaders()
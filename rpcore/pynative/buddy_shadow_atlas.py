@@ -0,0 +1,172 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from __future__ import print_function, division
+from rplibs.six.moves import range  # pylint: disable=import-error
+
+from panda3d.core import LVecBase4i
+
+from rpcore.pynative.shadow_atlas import ShadowAtlas
+
+
+class BuddyShadowAtlas(ShadowAtlas):
+
+    """ Quadtree buddy allocator backend for the shadow atlas. This has no
+    C++ counterpart. Instead of testing every tile position, regions are
+    rounded up to a power of two and taken from per-size free lists, splitting
+    larger blocks on demand and merging the four siblings of a block again
+    once they are all free. Reserving and freeing a region thus costs
+    O(log(num_tiles)) independent of the atlas fill rate. """
+
+    def init_tiles(self):
+        self._num_tiles = self._size // self._tile_size
+        if self._num_tiles & (self._num_tiles - 1) != 0:
+            print("BuddyShadowAtlas: Atlas size / tile size should be a power of 2!")
+            self._num_tiles = 1 << (self._num_tiles.bit_length() - 1)
+
+        # Free blocks per block size (in tiles), stored as sets of (x, y)
+        self._free_blocks = {}
+        size = self._num_tiles
+        while size >= 1:
+            self._free_blocks[size] = set()
+            size //= 2
+        self._free_blocks[self._num_tiles].add((0, 0))
+
+        # Maps (x, y) of every reserved region to the size of its block
+        self._allocated = {}
+        self._num_allocated_tiles = 0
+
+    def get_block_size(self, tile_width, tile_height):
+        size = 1
+        while size < max(tile_width, tile_height):
+            size *= 2
+        return size
+
+    def split_block(self, x, y, size, target_size, target_x=None, target_y=None):
+        # Splits the free block at (x, y) until a block of target_size remains,
+        # descending towards (target_x, target_y) if given. The block at (x, y)
+        # must already be removed from the free list.
+        while size > target_size:
+            size //= 2
+            children = [(x, y), (x + size, y), (x, y + size), (x + size, y + size)]
+            if target_x is None:
+                keep = children[0]
+            else:
+                keep = (x + (size if target_x >= x + size else 0),
+                        y + (size if target_y >= y + size else 0))
+            for child in children:
+                if child != keep:
+                    self._free_blocks[size].add(child)
+            x, y = keep
+        return x, y
+
+    def mark_reserved(self, x, y, tile_width, tile_height, block_size):
+        self._allocated[(x, y)] = block_size
+        self._num_allocated_tiles += block_size * block_size
+        self._num_used_tiles += tile_width * tile_height
+
+    def reserve_region(self, x, y, w, h):
+        block_size = self.get_block_size(w, h)
+        if x % block_size != 0 or y % block_size != 0:
+            print("BuddyShadowAtlas: Region is not aligned to its block size!")
+            return
+        size = block_size
+        while size <= self._num_tiles:
+            parent = (x - x % size, y - y % size)
+            if parent in self._free_blocks[size]:
+                self._free_blocks[size].remove(parent)
+                self.split_block(parent[0], parent[1], size, block_size, x, y)
+                self.mark_reserved(x, y, w, h, block_size)
+                return
+            size *= 2
+        print("BuddyShadowAtlas: Region", x, y, w, h, "is not free!")
+
+    def find_and_reserve_region(self, tile_width, tile_height):
+        block_size = self.get_block_size(tile_width, tile_height)
+        size = block_size
+        while size <= self._num_tiles:
+            if self._free_blocks[size]:
+                x, y = self._free_blocks[size].pop()
+                x, y = self.split_block(x, y, size, block_size)
+                self.mark_reserved(x, y, tile_width, tile_height, block_size)
+                return LVecBase4i(x, y, tile_width, tile_height)
+            size *= 2
+        print("Failed to find a free region of size", tile_width, "x", tile_height)
+        return LVecBase4i(-1)
+
+    def free_region(self, region):
+        key = (region.x, region.y)
+        if key not in self._allocated:
+            print("BuddyShadowAtlas: Region was not reserved!")
+            return
+        size = self._allocated.pop(key)
+        self._num_used_tiles -= region.z * region.w
+        self._num_allocated_tiles -= size * size
+
+        # Merge with the siblings as long as all of them are free
+        x, y = key
+        while size < self._num_tiles:
+            parent_x, parent_y = x - x % (2 * size), y - y % (2 * size)
+            siblings = [(parent_x + i * size, parent_y + j * size)
+                        for j in range(2) for i in range(2)]
+            siblings.remove((x, y))
+            free_list = self._free_blocks[size]
+            if not all(sibling in free_list for sibling in siblings):
+                break
+            for sibling in siblings:
+                free_list.remove(sibling)
+            x, y, size = parent_x, parent_y, size * 2
+        self._free_blocks[size].add((x, y))
+
+    def region_is_free(self, x, y, w, h):
+        for (rx, ry), size in self._allocated.items():
+            if rx < x + w and x < rx + size and ry < y + h and y < ry + size:
+                return False
+        return True
+
+    def get_largest_free_block(self):
+        size = self._num_tiles
+        while size >= 1:
+            if self._free_blocks[size]:
+                return size
+            size //= 2
+        return 0
+
+    def get_fragmentation(self):
+        # External fragmentation: share of the free area which is not part of
+        # the largest free block. 0 means all free space is one block.
+        free_tiles = self._num_tiles ** 2 - self._num_allocated_tiles
+        if free_tiles <= 0:
+            return 0.0
+        return 1.0 - self.get_largest_free_block() ** 2 / float(free_tiles)
+
+    fragmentation = property(get_fragmentation)
+
+    def get_wasted_tiles(self):
+        # Internal fragmentation: tiles lost due to rounding up to block sizes
+        return self._num_allocated_tiles - self._num_used_tiles
+
+    wasted_tiles = property(get_wasted_tiles)
@@ -0,0 +1,203 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+from array import array
+
+from rplibs.six.moves import range  # pylint: disable=import-error
+
+from rpcore.pynative.gpu_command import GPUCommand
+from rpcore.pynative.gpu_command_list import GPUCommandList
+
+
+class CoalescingCommandList(GPUCommandList):
+
+    """ Command list which merges redundant commands while they are still
+    queued. This has no C++ counterpart.
+
+    Repeated stores to the same light or shadow source slot overwrite the
+    queued store instead of adding a new command, and a store followed by a
+    remove drops the store (and the remove as well, if the slot was empty on
+    the gpu before). With partial updates enabled, a light store which only
+    changes one or two of the four vec4s of the light data is written as
+    CMD_store_light_vec4s entries, which pack the changed vec4s of multiple
+    lights into a single command. """
+
+    # Amount of (target, vec4) entries which fit into a CMD_store_light_vec4s
+    VEC4S_PER_COMMAND = 6
+
+    def __init__(self, capacity=1024, partial_updates=True):
+        GPUCommandList.__init__(self, capacity)
+        self._partial_updates = partial_updates
+        self._num_flushed = 0
+        self._num_coalesced = 0
+
+        # Sequence number of queued stores, keyed by (command type, slot)
+        self._pending_stores = {}
+
+        # Queued vec4 writes, keyed by (slot, vec4 index), the value is a tuple
+        # of the sequence number of the command and the index of the entry
+        self._pending_vec4s = {}
+        self._vec4_command = -1
+        self._vec4_command_fill = 0
+
+        # Light data per slot as it will be on the gpu once the queue is executed
+        self._light_data = {}
+        self._slot_was_empty = {}
+
+    @property
+    def num_coalesced(self):
+        return self._num_coalesced
+
+    def _is_queued(self, sequence):
+        return sequence is not None and sequence >= self._num_flushed
+
+    def _get_offset(self, sequence):
+        index = (self._head + sequence - self._num_flushed) % self._capacity
+        return index * self.COMMAND_SIZE
+
+    def _append(self, data):
+        sequence = self._num_flushed + self._num_commands
+        GPUCommandList._append(self, data)
+        return sequence
+
+    def _invalidate(self, sequence):
+        self._data[self._get_offset(sequence)] = GPUCommand.CMD_invalid
+
+    def add_command(self, cmd):
+        data = cmd.get_data()
+        cmd_type = int(data[0])
+        if cmd_type == GPUCommand.CMD_store_light:
+            self._add_light_store(data)
+        elif cmd_type == GPUCommand.CMD_remove_light:
+            self._add_light_remove(data)
+        elif cmd_type == GPUCommand.CMD_store_source:
+            self._add_source_store(data)
+        elif cmd_type == GPUCommand.CMD_remove_sources:
+            self._add_source_remove(data)
+        else:
+            self._append(data)
+
+    def _add_light_store(self, data):
+        slot = int(data[1])
+        values = tuple(data[2:18])
+        previous = self._light_data.get(slot)
+        self._light_data[slot] = values
+
+        sequence = self._pending_stores.get((GPUCommand.CMD_store_light, slot))
+        if self._is_queued(sequence):
+            offset = self._get_offset(sequence)
+            self._data[offset:offset + self.COMMAND_SIZE] = data
+            self._invalidate_vec4s(slot)
+            self._num_coalesced += 1
+            return
+
+        if previous == values:
+            self._num_coalesced += 1
+            return
+
+        if previous is not None and self._partial_updates:
+            changed = [i for i in range(4) if previous[i * 4:i * 4 + 4] != values[i * 4:i * 4 + 4]]
+            if len(changed) <= 2:
+                for index in changed:
+                    self._store_vec4(slot, index, values[index * 4:index * 4 + 4])
+                return
+
+        self._slot_was_empty[slot] = previous is None
+        self._pending_stores[(GPUCommand.CMD_store_light, slot)] = self._append(data)
+
+    def _store_vec4(self, slot, index, values):
+        entry = self._pending_vec4s.get((slot, index))
+        if entry is not None and self._is_queued(entry[0]):
+            offset = self._get_offset(entry[0]) + 2 + entry[1] * 5
+            self._data[offset + 1:offset + 5] = array("f", values)
+            self._num_coalesced += 1
+            return
+
+        if not self._is_queued(self._vec4_command) or \
+           self._vec4_command_fill >= self.VEC4S_PER_COMMAND:
+            command = array("f", [0.0]) * self.COMMAND_SIZE
+            command[0] = GPUCommand.CMD_store_light_vec4s
+            self._vec4_command = self._append(command)
+            self._vec4_command_fill = 0
+
+        entry_index = self._vec4_command_fill
+        offset = self._get_offset(self._vec4_command)
+        self._data[offset + 1] = entry_index + 1
+        offset += 2 + entry_index * 5
+        self._data[offset] = slot * 4 + index
+        self._data[offset + 1:offset + 5] = array("f", values)
+        self._vec4_command_fill += 1
+        self._pending_vec4s[(slot, index)] = (self._vec4_command, entry_index)
+
+    def _invalidate_vec4s(self, slot):
+        for index in range(4):
+            entry = self._pending_vec4s.pop((slot, index), None)
+            if entry is not None and self._is_queued(entry[0]):
+                # A negative target makes the shader skip the entry
+                self._data[self._get_offset(entry[0]) + 2 + entry[1] * 5] = -1
+
+    def _add_light_remove(self, data):
+        slot = int(data[1])
+        self._light_data.pop(slot, None)
+        self._invalidate_vec4s(slot)
+
+        sequence = self._pending_stores.pop((GPUCommand.CMD_store_light, slot), None)
+        if self._is_queued(sequence):
+            self._invalidate(sequence)
+            self._num_coalesced += 1
+            if self._slot_was_empty.get(slot, False):
+                self._num_coalesced += 1
+                return
+        self._append(data)
+
+    def _add_source_store(self, data):
+        slot = int(data[1])
+        sequence = self._pending_stores.get((GPUCommand.CMD_store_source, slot))
+        if self._is_queued(sequence):
+            offset = self._get_offset(sequence)
+            self._data[offset:offset + self.COMMAND_SIZE] = data
+            self._num_coalesced += 1
+            return
+        self._pending_stores[(GPUCommand.CMD_store_source, slot)] = self._append(data)
+
+    def _add_source_remove(self, data):
+        base_slot, num_slots = int(data[1]), int(data[2])
+        for slot in range(base_slot, base_slot + num_slots):
+            sequence = self._pending_stores.pop((GPUCommand.CMD_store_source, slot), None)
+            if self._is_queued(sequence):
+                self._invalidate(sequence)
+                self._num_coalesced += 1
+        self._append(data)
+
+    def write_commands_to(self, dest, limit=32):
+        num_commands = GPUCommandList.write_commands_to(self, dest, limit)
+        self._num_flushed += num_commands
+        if self._num_commands == 0:
+            self._pending_stores.clear()
+            self._pending_vec4s.clear()
+            self._slot_was_empty.clear()
+        return num_commands
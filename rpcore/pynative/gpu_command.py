@@ -28,6 +28,7 @@ from __future__ import print_function
 from rplibs.six.moves import range  # pylint: disable=import-error
 
 import struct
+from array import array
 
 
 class GPUCommand(object):
@@ -40,11 +41,12 @@ class GPUCommand(object):
     CMD_remove_light = 2
     CMD_store_source = 3
     CMD_remove_sources = 4
+    CMD_store_light_vec4s = 5
 
     def __init__(self, command_type):
         self._command_type = command_type
         self._current_index = 0
-        self._data = [0.0] * 32
+        self._data = array("f", [0.0]) * 32
         self.push_int(command_type)
 
     def push_int(self, value):
@@ -71,6 +73,9 @@ class GPUCommand(object):
             for j in range(4):
                 self.push_float(value.get_cell(i, j))
 
+    def get_data(self):
+        return self._data
+
     @staticmethod
     def get_uses_integer_packing():
         return False
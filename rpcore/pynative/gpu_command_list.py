@@ -23,6 +23,10 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 
 """
+from array import array
+
+# Python 2 memoryviews can neither wrap arrays nor be cast
+_HAS_MEMORYVIEW_CAST = hasattr(memoryview, "cast")
 
 
 class GPUCommandList(object):
@@ -30,21 +34,64 @@ class GPUCommandList(object):
     """ Please refer to the native C++ implementation for docstrings and comments.
     This is just the python implementation, which does not contain documentation! """
 
-    def __init__(self):
-        self._commands = []
+    # Floats per command, must match GPUCommand
+    COMMAND_SIZE = 32
+
+    def __init__(self, capacity=1024):
+        # Commands are stored in a preallocated ring buffer of floats, which
+        # grows when more commands are queued than fit into it
+        self._capacity = capacity
+        self._data = array("f", [0.0]) * (capacity * self.COMMAND_SIZE)
+        self._head = 0
+        self._num_commands = 0
 
     def add_command(self, cmd):
-        self._commands.append(cmd)
+        self._append(cmd.get_data())
+
+    def _append(self, data):
+        if self._num_commands == self._capacity:
+            self._grow()
+        slot = (self._head + self._num_commands) % self._capacity
+        offset = slot * self.COMMAND_SIZE
+        self._data[offset:offset + self.COMMAND_SIZE] = data
+        self._num_commands += 1
 
     @property
     def num_commands(self):
-        return len(self._commands)
+        return self._num_commands
+
+    def _grow(self):
+        # Unroll the ring so the queued commands start at index 0 again
+        start = self._head * self.COMMAND_SIZE
+        self._data = self._data[start:] + self._data[:start]
+        self._data.extend(array("f", [0.0]) * (self._capacity * self.COMMAND_SIZE))
+        self._head = 0
+        self._capacity *= 2
+
+    def _copy_range_to(self, dest, dest_offset, start, end):
+        first, last = start * self.COMMAND_SIZE, end * self.COMMAND_SIZE
+        num_bytes = (last - first) * self._data.itemsize
+        dest_offset *= self.COMMAND_SIZE * self._data.itemsize
+        if _HAS_MEMORYVIEW_CAST:
+            source = memoryview(self._data)[first:last].cast("B")
+            memoryview(dest)[dest_offset:dest_offset + num_bytes] = source
+        else:
+            dest.set_subdata(dest_offset, num_bytes, self._data[first:last].tostring())
 
     def write_commands_to(self, dest, limit=32):
-        num_commands_written = 0
+        num_commands = min(limit, self._num_commands)
+        if num_commands == 0:
+            return 0
 
-        while num_commands_written < limit and self._commands:
-            self._commands.pop(0).write_to(dest, num_commands_written)
-            num_commands_written += 1
+        # At most two copies are required, in case the commands wrap around
+        # the end of the ring buffer
+        end = self._head + num_commands
+        if end <= self._capacity:
+            self._copy_range_to(dest, 0, self._head, end)
+        else:
+            self._copy_range_to(dest, 0, self._head, self._capacity)
+            self._copy_range_to(dest, self._capacity - self._head, 0, end - self._capacity)
 
-        return num_commands_written
+        self._head = end % self._capacity
+        self._num_commands -= num_commands
+        return num_commands
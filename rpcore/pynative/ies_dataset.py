@@ -26,8 +26,14 @@ THE SOFTWARE.
 
 from rplibs.six.moves import range  # pylint: disable=import-error
 
+import sys
 import math
-from panda3d.core import PNMImage
+from panda3d.core import PNMImage, StringStream, Texture
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class IESDataset(object):
@@ -50,6 +56,12 @@ class IESDataset(object):
         self._candela_values = candela_values
 
     def generate_dataset_texture_into(self, dest_tex, layer_index):
+        if numpy is not None:
+            self.generate_dataset_texture_into_vectorized(dest_tex, layer_index)
+        else:
+            self.generate_dataset_texture_into_scalar(dest_tex, layer_index)
+
+    def generate_dataset_texture_into_scalar(self, dest_tex, layer_index):
         resolution_vertical = dest_tex.get_y_size()
         resolution_horizontal = dest_tex.get_x_size()
 
@@ -65,11 +77,107 @@ class IESDataset(object):
 
         dest_tex.load(dest, layer_index, 0)
 
-    def get_candela_value(self, vertical_angle, horizontal_angle):  # noqa # pylint: disable=unused-argument
-        # NOTICE: Since python is slower, we always only assume a dataset without
-        # horizontal angles. This still produces convincing results, but does
-        # generate much faster.
-        return self.get_vertical_candela_value(0, vertical_angle)
+    # Python only: Evaluates the whole LUT with numpy, matching the scalar
+    # evaluation, and copies it into the texture layer at once.
+    def generate_dataset_texture_into_vectorized(self, dest_tex, layer_index):
+        resolution_vertical = dest_tex.get_y_size()
+        resolution_horizontal = dest_tex.get_x_size()
+
+        vertical_angles = numpy.array(list(self._vertical_angles), dtype=numpy.float64)
+        horizontal_angles = numpy.array(list(self._horizontal_angles), dtype=numpy.float64)
+        candela_values = numpy.array(list(self._candela_values), dtype=numpy.float64)
+        candela_values = candela_values.reshape(len(horizontal_angles), len(vertical_angles))
+
+        vert_angle = numpy.arange(resolution_vertical) / (resolution_vertical - 1.0)
+        vert_angle = numpy.cos(vert_angle * math.pi) * 90.0 + 90.0
+        horiz_angle = numpy.arange(resolution_horizontal) / (resolution_horizontal - 1.0) * 360.0
+
+        # Vertical interpolation for every horizontal angle, shape (horizontal angles, x)
+        vertical_index = numpy.searchsorted(vertical_angles, vert_angle, side="right")
+        vertical_valid = (vert_angle >= 0.0) & (vertical_index < len(vertical_angles))
+        vertical_index = numpy.clip(vertical_index, 1, max(1, len(vertical_angles) - 1))
+        if len(vertical_angles) > 1:
+            prev_angle = vertical_angles[vertical_index - 1]
+            curr_angle = vertical_angles[vertical_index]
+            lerp = (vert_angle - prev_angle) / (curr_angle - prev_angle)
+            columns = (candela_values[:, vertical_index] * lerp +
+                       candela_values[:, vertical_index - 1] * (1.0 - lerp))
+        else:
+            columns = numpy.zeros((len(horizontal_angles), resolution_vertical))
+        columns *= vertical_valid
+
+        # Horizontal interpolation between the vertical columns, shape (y, x)
+        if len(horizontal_angles) == 1:
+            lut = numpy.repeat(columns, resolution_horizontal, axis=0)
+        else:
+            max_angle = horizontal_angles[-1]
+            horiz_angle = numpy.fmod(horiz_angle, 2.0 * max_angle)
+            horiz_angle = numpy.where(
+                horiz_angle > max_angle, 2.0 * max_angle - horiz_angle, horiz_angle)
+            horizontal_index = numpy.searchsorted(horizontal_angles, horiz_angle, side="left")
+            horizontal_valid = horizontal_index < len(horizontal_angles)
+            horizontal_index = numpy.clip(horizontal_index, 1, len(horizontal_angles) - 1)
+            prev_angle = horizontal_angles[horizontal_index - 1]
+            curr_angle = horizontal_angles[horizontal_index]
+            lerp = ((horiz_angle - prev_angle) / (curr_angle - prev_angle))[:, None]
+            lut = columns[horizontal_index] * lerp + columns[horizontal_index - 1] * (1.0 - lerp)
+            lut *= horizontal_valid[:, None]
+
+        # Quantize like the 16 bit PNMImage of the scalar path
+        lut = numpy.clip(numpy.floor(lut * 65535.0 + 0.5), 0, 65535).astype(numpy.uint16)
+        if not self._copy_layer_to_ram_image(lut, dest_tex, layer_index):
+            self._load_layer_from_pgm(lut, dest_tex, layer_index)
+
+    def _copy_layer_to_ram_image(self, lut, dest_tex, layer_index):
+        if not dest_tex.has_ram_image() or dest_tex.get_num_components() != 1:
+            return False
+
+        # Textures store their rows bottom to top
+        if dest_tex.get_component_type() == Texture.T_unsigned_short:
+            data = lut[::-1]
+        elif dest_tex.get_component_type() == Texture.T_float:
+            data = (lut[::-1] / 65535.0).astype(numpy.float32)
+        else:
+            return False
+
+        page_size = dest_tex.get_expected_ram_page_size()
+        if data.nbytes != page_size:
+            return False
+
+        ram_image = dest_tex.modify_ram_image()
+        offset = layer_index * page_size
+        if sys.version_info >= (3, 0):
+            memoryview(ram_image)[offset:offset + page_size] = data.tobytes()
+        else:
+            ram_image.set_subdata(offset, page_size, data.tostring())
+        return True
+
+    def _load_layer_from_pgm(self, lut, dest_tex, layer_index):
+        header = "P5 {} {} 65535\n".format(lut.shape[1], lut.shape[0]).encode("ascii")
+        dest = PNMImage()
+        dest.read(StringStream(header + lut.astype(">u2").tobytes()), "ies.pgm")
+        dest_tex.load(dest, layer_index, 0)
+
+    def get_candela_value(self, vertical_angle, horizontal_angle):
+        if len(self._horizontal_angles) == 1:
+            return self.get_vertical_candela_value(0, vertical_angle)
+
+        max_angle = self._horizontal_angles[len(self._horizontal_angles) - 1]
+
+        horizontal_angle = math.fmod(horizontal_angle, 2.0 * max_angle)
+        if horizontal_angle > max_angle:
+            horizontal_angle = 2.0 * max_angle - horizontal_angle
+
+        for horizontal_index in range(1, len(self._horizontal_angles)):
+            curr_angle = self._horizontal_angles[horizontal_index]
+
+            if curr_angle >= horizontal_angle:
+                prev_angle = self._horizontal_angles[horizontal_index - 1]
+                prev_value = self.get_vertical_candela_value(horizontal_index - 1, vertical_angle)
+                curr_value = self.get_vertical_candela_value(horizontal_index, vertical_angle)
+                lerp = (horizontal_angle - prev_angle) / (curr_angle - prev_angle)
+                return curr_value * lerp + prev_value * (1.0 - lerp)
+        return 0.0
 
     def get_candela_value_from_index(self, vertical_angle_idx, horizontal_angle_idx):
         index = vertical_angle_idx + horizontal_angle_idx * len(self._vertical_angles)
@@ -26,10 +26,13 @@ THE SOFTWARE.
 from __future__ import print_function
 from rplibs.six.moves import range  # pylint: disable=import-error
 
+import heapq
+
 from panda3d.core import Vec3
 
 from rpcore.pynative.pointer_slot_storage import PointerSlotStorage
 from rpcore.pynative.gpu_command import GPUCommand
+from rpcore.pynative.shadow_source_grid import ShadowSourceGrid
 
 MAX_LIGHT_COUNT = 65535
 MAX_SHADOW_SOURCES = 2048
@@ -47,6 +50,9 @@ class InternalLightManager(object):
         self._shadow_manager = None
         self._camera_pos = Vec3(0)
         self._shadow_update_distance = 100.0
+        self._light_store = None
+        self._source_grid = ShadowSourceGrid(self._shadow_update_distance)
+        self._sources_with_region = set()
 
     def get_max_light_index(self):
         return self._lights.get_max_index()
@@ -71,6 +77,14 @@ class InternalLightManager(object):
 
     shadow_manager = property(get_shadow_manager, set_shadow_manager)
 
+    def set_light_store(self, store):
+        self._light_store = store
+
+    def get_light_store(self):
+        return self._light_store
+
+    light_store = property(get_light_store, set_light_store)
+
     def set_command_list(self, cmd_list):
         self._cmd_list = cmd_list
 
@@ -79,6 +93,7 @@ class InternalLightManager(object):
 
     def set_shadow_update_distance(self, dist):
         self._shadow_update_distance = dist
+        self._source_grid.set_cell_size(dist)
 
     def add_light(self, light):
         if light.has_slot():
@@ -91,6 +106,7 @@ class InternalLightManager(object):
             return
 
         light.assign_slot(slot)
+        light.set_light_store(self._light_store)
         self._lights.reserve_slot(slot, light)
 
         if light.get_casts_shadows():
@@ -114,6 +130,17 @@ class InternalLightManager(object):
             slot = base_slot + i
             self._shadow_sources.reserve_slot(slot, source)
             source.set_slot(slot)
+            self._source_grid.update(source)
+
+    def update_light_shadow_sources(self, light):
+        light.update_shadow_sources()
+        for i in range(light.get_num_shadow_sources()):
+            self._source_grid.update(light.get_shadow_source(i))
+
+    def clear_source_region(self, source):
+        self._shadow_manager.get_atlas().free_region(source.get_region())
+        source.clear_region()
+        self._sources_with_region.discard(source)
 
     def remove_light(self, light):
         assert light is not None
@@ -123,6 +150,7 @@ class InternalLightManager(object):
 
         self._lights.free_slot(light.get_slot())
         self.gpu_remove_light(light)
+        light.set_light_store(None)
         light.remove_slot()
 
         if light.get_casts_shadows():
@@ -132,8 +160,8 @@ class InternalLightManager(object):
                 if source.has_slot():
                     self._shadow_sources.free_slot(source.get_slot())
                 if source.has_region():
-                    self._shadow_manager.get_atlas().free_region(source.get_region())
-                    source.clear_region()
+                    self.clear_source_region(source)
+                self._source_grid.remove(source)
 
             self.gpu_remove_consecutive_sources(
                 light.get_shadow_source(0), light.get_num_shadow_sources())
@@ -147,11 +175,20 @@ class InternalLightManager(object):
         self._cmd_list.add_command(cmd_remove)
 
     def gpu_remove_light(self, light):
+        if self._light_store is not None:
+            self._light_store.remove(light.get_slot())
+            return
+
         cmd_remove = GPUCommand(GPUCommand.CMD_remove_light)
         cmd_remove.push_int(light.get_slot())
         self._cmd_list.add_command(cmd_remove)
 
     def gpu_update_light(self, light):
+        if self._light_store is not None:
+            light.write_to_store(self._light_store)
+            light.set_needs_update(False)
+            return
+
         cmd_update = GPUCommand(GPUCommand.CMD_store_light)
         cmd_update.push_int(light.get_slot())
         light.write_to_command(cmd_update)
@@ -165,46 +202,63 @@ class InternalLightManager(object):
         self._cmd_list.add_command(cmd_update)
 
     def update_lights(self):
+        if self._light_store is not None:
+            self.update_lights_bulk()
+            return
+
         for light in self._lights.begin():
             if light.get_needs_update():
                 if light.casts_shadows:
-                    light.update_shadow_sources()
-            self.gpu_update_light(light)
+                    self.update_light_shadow_sources(light)
+                self.gpu_update_light(light)
+
+    def update_lights_bulk(self):
+        store = self._light_store
+        for slot in store.get_dirty_slots(self._lights.get_max_index()):
+            light = self._lights.get(slot)
+            if light is None:
+                # Removed light, the store already cleared its data
+                continue
+            if light.get_needs_update():
+                if light.casts_shadows:
+                    self.update_light_shadow_sources(light)
+                self.gpu_update_light(light)
+        store.upload()
+
+    def get_source_distance(self, source):
+        bounds = source.get_bounds()
+        return (self._camera_pos - bounds.get_center()).length() - bounds.get_radius()
 
     def update_shadow_sources(self):
-        sources_to_update = []
-
-        for source in self._shadow_sources.begin():
-            # if source and source.get_needs_update():
-                # sources_to_update.append(source)
-            if source:
-                bounds = source.get_bounds()
-                distance_to_camera = (self._camera_pos - bounds.get_center()) - bounds.get_radius()
-                if distance_to_camera < self._shadow_update_distance:
-                    sources_to_update.append(source)
-                else:
-                    if source.has_region():
-                        self._shadow_manager.get_atlas().free_region(source.get_region())
-                        source.clear_region()
-
-        def get_source_score(source):
-            dist = (source.get_bounds().get_center() - self._camera_pos).length()
-            return -dist + (10**10 if source.has_region() else 0)
-
-        sorted_sources = list(sorted(sources_to_update, key=get_source_score))
+        # Free regions of sources which are out of the update radius, to make
+        # space for other regions. Only sources with a region have to be checked.
+        for source in list(self._sources_with_region):
+            if self.get_source_distance(source) >= self._shadow_update_distance:
+                self.clear_source_region(source)
+
+        sources_to_update = [
+            source for source in self._source_grid.query(
+                self._camera_pos, self._shadow_update_distance)
+            if source.get_needs_update()]
+
+        # Sources without a region come first, then the closest ones. Only
+        # the sources which can get updated this frame are selected.
+        def get_source_priority(source):
+            dist = (source.get_bounds().get_center() - self._camera_pos).length_squared()
+            return (source.has_region(), dist)
 
-        atlas = self._shadow_manager.get_atlas()
         update_slots = min(
-            len(sorted_sources),
+            len(sources_to_update),
             self._shadow_manager.get_num_update_slots_left())
+        sorted_sources = heapq.nsmallest(
+            update_slots, sources_to_update, key=get_source_priority)
 
-        for i in range(update_slots):
-            if sorted_sources[i].has_region():
-                atlas.free_region(sorted_sources[i].get_region())
-
-        for i in range(update_slots):
-            source = sorted_sources[i]
+        atlas = self._shadow_manager.get_atlas()
+        for source in sorted_sources:
+            if source.has_region():
+                self.clear_source_region(source)
 
+        for source in sorted_sources:
             if not self._shadow_manager.add_update(source):
                 print("ERROR: Shadow manager ensured update slot, but slot is taken!")
                 break
@@ -213,6 +267,8 @@ class InternalLightManager(object):
             new_region = atlas.find_and_reserve_region(region_size, region_size)
             new_uv_region = atlas.region_to_uv(new_region)
             source.set_region(new_region, new_uv_region)
+            if source.has_region():
+                self._sources_with_region.add(source)
             source.set_needs_update(False)
             self.gpu_update_source(source)
 
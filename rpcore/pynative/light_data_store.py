@@ -0,0 +1,128 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+from __future__ import division
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class LightDataStore(object):
+
+    """ Structure-of-arrays storage of all light data, used by the python
+    InternalLightManager for bulk updates. This has no C++ counterpart.
+
+    Lights write their properties into the arrays whenever they are dirty.
+    The store then packs all dirty lights with vectorized operations into a
+    mirror of the LightData buffer, and uploads the range spanning all dirty
+    lights with a single copy into the textures ram image. Since the ram image
+    is the authoritative copy of the light data, lights must not be stored or
+    removed with GPU commands while a store is in use. """
+
+    # Amount of floats per light, must match the size of the LightData struct
+    FLOATS_PER_LIGHT = 16
+
+    @staticmethod
+    def is_available():
+        """ Returns whether numpy is available, which is required for the store """
+        return numpy is not None
+
+    def __init__(self, max_lights, light_data):
+        """ Constructs a new store for up to max_lights lights, which writes
+        into the given light data buffer texture """
+        self._image = light_data
+        self._max_lights = max_lights
+        self._num_uploaded_lights = 0
+
+        def zeros(*shape):
+            return numpy.zeros(shape, dtype=numpy.float32)
+
+        self.light_types = zeros(max_lights)
+        self.ies_profiles = zeros(max_lights)
+        self.shadow_sources = zeros(max_lights)
+        self.positions = zeros(max_lights, 3)
+        self.colors = zeros(max_lights, 3)
+        self.energies = zeros(max_lights)
+        self.radii = zeros(max_lights)
+        self.params = zeros(max_lights, 4)
+        self.dirty = numpy.zeros(max_lights, dtype=numpy.bool_)
+
+        # Mirror of the buffer contents. Panda3D stores 4-component ram images
+        # in BGRA order, so the mirror is swizzled the same way.
+        self._packed = zeros(max_lights, 4, 4)
+
+    @property
+    def num_uploaded_lights(self):
+        """ Returns the amount of light slots uploaded during the last update """
+        return self._num_uploaded_lights
+
+    def mark_dirty(self, slot):
+        """ Marks the light at the given slot to require an upload """
+        self.dirty[slot] = True
+
+    def remove(self, slot):
+        """ Clears the light at the given slot. An all-zero entry indicates
+        an empty slot to the shaders. """
+        for array in (self.light_types, self.ies_profiles, self.shadow_sources,
+                      self.positions, self.colors, self.energies, self.radii,
+                      self.params):
+            array[slot] = 0
+        self.dirty[slot] = True
+
+    def get_dirty_slots(self, max_index):
+        """ Returns the slots of all dirty lights up to the given index """
+        return numpy.flatnonzero(self.dirty[:max_index + 1])
+
+    def upload(self):
+        """ Packs all dirty lights and writes them into the light data buffer
+        as one contiguous block. Returns the amount of uploaded light slots. """
+        slots = numpy.flatnonzero(self.dirty)
+        if len(slots) == 0:
+            self._num_uploaded_lights = 0
+            return 0
+
+        # Layout has to match read_light_data in light_data.inc.glsl
+        rows = numpy.zeros((len(slots), self.FLOATS_PER_LIGHT), dtype=numpy.float32)
+        rows[:, 0] = self.light_types[slots]
+        rows[:, 1] = self.ies_profiles[slots]
+        rows[:, 2] = self.shadow_sources[slots]
+        rows[:, 3:6] = self.positions[slots]
+        rows[:, 6:9] = self.colors[slots] * (self.energies[slots] / 100.0)[:, None]
+        rows[:, 9] = self.radii[slots]
+        rows[:, 10:14] = self.params[slots]
+        self._packed[slots] = rows.reshape(-1, 4, 4)[:, :, (2, 1, 0, 3)]
+        self.dirty[slots] = False
+
+        first, last = slots[0], slots[-1] + 1
+        block = self._packed[first:last]
+        ram_image = self._image.modify_ram_image()
+        ram_image.set_subdata(int(first) * block.itemsize * self.FLOATS_PER_LIGHT,
+                              block.nbytes, block.tobytes())
+        self._num_uploaded_lights = int(last - first)
+        return self._num_uploaded_lights
@@ -32,10 +32,20 @@ class PointerSlotStorage(object):
     """ Please refer to the native C++ implementation for docstrings and comments.
     This is just the python implementation, which does not contain documentation! """
 
-    def __init__(self, max_size):
+    # Allocator modes. ALLOC_scan matches the C++ implementation and walks the
+    # storage from index 0. ALLOC_bitmap keeps an occupancy map plus a
+    # lowest-free hint, so finding a slot or a run of slots starts at the
+    # first free index and the run search itself is done by bytearray.find.
+    ALLOC_scan = 0
+    ALLOC_bitmap = 1
+
+    def __init__(self, max_size, allocator=ALLOC_bitmap):
         self._data = [None] * max_size
         self._max_index = 0
         self._num_entries = 0
+        self._allocator = allocator
+        self._occupied = bytearray(max_size)
+        self._lowest_free = 0
 
     def get_max_index(self):
         return self._max_index
@@ -43,9 +53,15 @@ class PointerSlotStorage(object):
     def get_num_entries(self):
         return self._num_entries
 
+    def get_allocator(self):
+        return self._allocator
+
     def find_slot(self):
         # Notice: returns None in case of no free slot, and the slot otherwise, this
         # is different to the C++ Module
+        if self._allocator == self.ALLOC_bitmap:
+            return self._lowest_free if self._lowest_free < len(self._data) else -1
+
         for i, value in enumerate(self._data):
             if not value:
                 return i
@@ -55,7 +71,10 @@ class PointerSlotStorage(object):
         if num_consecutive == 1:
             return self.find_slot()
 
-        for i in range(len(self._data)):
+        if self._allocator == self.ALLOC_bitmap:
+            return self._occupied.find(bytearray(num_consecutive), self._lowest_free)
+
+        for i in range(len(self._data) - num_consecutive + 1):
             any_taken = False
             for k in range(num_consecutive):
                 if self._data[i + k]:
@@ -67,10 +86,11 @@ class PointerSlotStorage(object):
 
     def free_slot(self, slot):
         self._data[slot] = None
+        self._occupied[slot] = 0
         self._num_entries -= 1
+        self._lowest_free = min(self._lowest_free, slot)
         if slot == self._max_index:
-            while self._max_index >= 0 and not self._data[self._max_index]:
-                self._max_index -= 1
+            self._max_index = self._occupied.rfind(b"\x01", 0, slot)
 
     def free_consecutive_slots(self, slot, num_consecutive):
         for i in range(num_consecutive):
@@ -79,7 +99,15 @@ class PointerSlotStorage(object):
     def reserve_slot(self, slot, ptr):
         self._max_index = max(self._max_index, slot)
         self._data[slot] = ptr
+        self._occupied[slot] = 1
         self._num_entries += 1
+        if slot == self._lowest_free:
+            self._lowest_free = self._occupied.find(b"\x00", slot)
+            if self._lowest_free < 0:
+                self._lowest_free = len(self._data)
+
+    def get(self, slot):
+        return self._data[slot]
 
     def begin(self):
         for i in range(self._max_index + 1):
@@ -81,6 +81,7 @@ class RPLight(object):
         self._near_plane = 0.5
         self._energy = 20
         self._shadow_sources = []
+        self._light_store = None
 
     def get_num_shadow_sources(self):
         return len(self._shadow_sources)
@@ -93,6 +94,11 @@ class RPLight(object):
 
     def set_needs_update(self, flag):
         self._needs_update = flag
+        if flag and self._light_store is not None:
+            self._light_store.mark_dirty(self._slot)
+
+    def set_light_store(self, store):
+        self._light_store = store
 
     def get_needs_update(self):
         return self._needs_update
@@ -140,6 +146,7 @@ class RPLight(object):
 
     def set_energy(self, energy):
         self._energy = energy
+        self.set_needs_update(True)
 
     def get_energy(self):
         return self._energy
@@ -206,3 +213,18 @@ class RPLight(object):
 
         cmd.push_vec3(self._position)
         cmd.push_vec3(self._color * self._energy / 100.0)
+
+    def write_to_store(self, store):
+        slot = self._slot
+        store.light_types[slot] = self._light_type
+        store.ies_profiles[slot] = self._ies_profile
+
+        if self._casts_shadows:
+            store.shadow_sources[slot] = self._shadow_sources[0].get_slot()
+        else:
+            store.shadow_sources[slot] = -1
+
+        store.positions[slot] = (self._position.x, self._position.y, self._position.z)
+        store.colors[slot] = (self._color.x, self._color.y, self._color.z)
+        store.energies[slot] = self._energy
+        store.mark_dirty(slot)
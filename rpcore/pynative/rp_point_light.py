@@ -47,6 +47,11 @@ class RPPointLight(RPLight):
         cmd.push_float(self._radius)
         cmd.push_float(self._inner_radius)
 
+    def write_to_store(self, store):
+        RPLight.write_to_store(self, store)
+        store.radii[self._slot] = self._radius
+        store.params[self._slot] = (self._inner_radius, 0.0, 0.0, 0.0)
+
     def set_radius(self, radius):
         self._radius = radius
         self.set_needs_update(True)
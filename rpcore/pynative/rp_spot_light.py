@@ -48,6 +48,13 @@ class RPSpotLight(RPLight):
         cmd.push_float(math.cos(self._fov / 360.0 * math.pi))
         cmd.push_vec3(self._direction)
 
+    def write_to_store(self, store):
+        RPLight.write_to_store(self, store)
+        store.radii[self._slot] = self._radius
+        store.params[self._slot] = (
+            math.cos(self._fov / 360.0 * math.pi),
+            self._direction.x, self._direction.y, self._direction.z)
+
     def set_radius(self, radius):
         self._radius = radius
         self.set_needs_update(True)
@@ -31,6 +31,7 @@ from rplibs.six.moves import range  # pylint: disable=import-error
 from panda3d.core import Camera, MatrixLens
 
 from rpcore.pynative.shadow_atlas import ShadowAtlas
+from rpcore.pynative.buddy_shadow_atlas import BuddyShadowAtlas
 
 
 class ShadowManager(object):
@@ -38,10 +39,16 @@ class ShadowManager(object):
     """ Please refer to the native C++ implementation for docstrings and comments.
     This is just the python implementation, which does not contain documentation! """
 
+    ATLAS_BACKENDS = {
+        "scan": ShadowAtlas,
+        "buddy": BuddyShadowAtlas,
+    }
+
     def __init__(self):
         self._max_updates = 10
         self._atlas = None
         self._atlas_size = 4096
+        self._atlas_backend = "scan"
         self._tag_state_mgr = None
         self._atlas_graphics_output = None
         self._display_regions = []
@@ -62,6 +69,17 @@ class ShadowManager(object):
 
     atlas_size = property(get_atlas_size, set_atlas_size)
 
+    def set_atlas_backend(self, backend):
+        if backend not in self.ATLAS_BACKENDS:
+            print("Warning: Unknown shadow atlas backend", backend, ", using scan")
+            backend = "scan"
+        self._atlas_backend = backend
+
+    def get_atlas_backend(self):
+        return self._atlas_backend
+
+    atlas_backend = property(get_atlas_backend, set_atlas_backend)
+
     def set_scene(self, scene_parent):
         self._scene_parent = scene_parent
 
@@ -100,7 +118,7 @@ class ShadowManager(object):
             region.set_active(False)
             self._display_regions.append(region)
 
-        self._atlas = ShadowAtlas(self._atlas_size)
+        self._atlas = self.ATLAS_BACKENDS[self._atlas_backend](self._atlas_size)
 
     def update(self):
         for i in range(len(self._queued_updates), self._max_updates):
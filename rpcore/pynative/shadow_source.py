@@ -24,7 +24,7 @@ THE SOFTWARE.
 
 """
 
-from panda3d.core import Mat4, PerspectiveLens, LVector3, LVecBase2i, LVecBase2f
+from panda3d.core import Mat4, PerspectiveLens, LVector3, LVecBase4i, LVecBase4f
 from panda3d.core import BoundingSphere
 
 
@@ -38,8 +38,8 @@ class ShadowSource(object):
         self._needs_update = True
         self._resolution = 512
         self._mvp = 0.0
-        self._region = LVecBase2i(-1)
-        self._region_uv = LVecBase2f(0.0)
+        self._region = LVecBase4i(-1)
+        self._region_uv = LVecBase4f(0.0)
         self._bounds = BoundingSphere()
 
     def set_resolution(self, resolution):
@@ -56,8 +56,8 @@ class ShadowSource(object):
         self._region_uv = region_uv
 
     def clear_region(self):
-        self._region = LVecBase2i(-1)
-        self._region_uv = LVecBase2f(0.0)
+        self._region = LVecBase4i(-1)
+        self._region_uv = LVecBase4f(0.0)
 
     def get_bounds(self):
         return self._bounds
@@ -89,7 +89,7 @@ class ShadowSource(object):
         return self._slot
 
     def get_needs_update(self):
-        return not self.has_region or self._needs_update
+        return not self.has_region() or self._needs_update
 
     def get_resolution(self):
         return self._resolution
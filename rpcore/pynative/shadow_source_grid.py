@@ -0,0 +1,124 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+from __future__ import division
+
+import math
+
+from rplibs.six.moves import range  # pylint: disable=import-error
+
+
+class ShadowSourceGrid(object):
+
+    """ Uniform grid over the bounding spheres of all shadow sources, used by
+    the python InternalLightManager to find the sources near the camera without
+    testing every source. This has no C++ counterpart.
+
+    Sources are bucketed by the cell containing their bounds center. Since the
+    grid keeps track of the largest bounds radius, a query only has to visit the
+    cells within the query distance plus that radius. """
+
+    def __init__(self, cell_size=100.0):
+        self._cell_size = float(cell_size)
+        self._cells = {}
+        self._source_cells = {}
+        self._max_radius = 0.0
+
+    def get_num_sources(self):
+        return len(self._source_cells)
+
+    num_sources = property(get_num_sources)
+
+    def set_cell_size(self, cell_size):
+        sources = list(self._source_cells.keys())
+        self._cell_size = float(cell_size)
+        self._cells = {}
+        self._source_cells = {}
+        for source in sources:
+            self.update(source)
+
+    def get_cell_size(self):
+        return self._cell_size
+
+    cell_size = property(get_cell_size, set_cell_size)
+
+    def _get_cell(self, pos):
+        return (int(math.floor(pos.x / self._cell_size)),
+                int(math.floor(pos.y / self._cell_size)),
+                int(math.floor(pos.z / self._cell_size)))
+
+    def update(self, source):
+        """ Inserts the source, or moves it to its new cell in case its bounds
+        changed since it was last inserted """
+        bounds = source.get_bounds()
+        self._max_radius = max(self._max_radius, bounds.get_radius())
+        cell = self._get_cell(bounds.get_center())
+        old_cell = self._source_cells.get(source)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._remove_from_cell(source, old_cell)
+        self._source_cells[source] = cell
+        self._cells.setdefault(cell, set()).add(source)
+
+    def remove(self, source):
+        """ Removes the source from the grid """
+        cell = self._source_cells.pop(source, None)
+        if cell is not None:
+            self._remove_from_cell(source, cell)
+
+    def _remove_from_cell(self, source, cell):
+        sources = self._cells[cell]
+        sources.discard(source)
+        if not sources:
+            del self._cells[cell]
+
+    def query(self, pos, distance):
+        """ Returns all sources whose bounds are closer than distance to pos """
+        reach = int(math.ceil((distance + self._max_radius) / self._cell_size))
+        cx, cy, cz = self._get_cell(pos)
+
+        # In case the query covers more cells than there are occupied cells,
+        # visiting the occupied cells is cheaper
+        if (2 * reach + 1) ** 3 > len(self._cells):
+            cells = [sources for (x, y, z), sources in self._cells.items()
+                     if abs(x - cx) <= reach and abs(y - cy) <= reach and abs(z - cz) <= reach]
+        else:
+            cells = [self._cells.get((x, y, z))
+                     for x in range(cx - reach, cx + reach + 1)
+                     for y in range(cy - reach, cy + reach + 1)
+                     for z in range(cz - reach, cz + reach + 1)]
+
+        result = []
+        for sources in cells:
+            if not sources:
+                continue
+            for source in sources:
+                bounds = source.get_bounds()
+                if (pos - bounds.get_center()).length() - bounds.get_radius() < distance:
+                    result.append(source)
+        return result
@@ -27,24 +27,22 @@ THE SOFTWARE.
 from __future__ import division
 
 import sys
-import math
 import time
 
 from panda3d.core import LVecBase2i, TransformState, RenderState, load_prc_file
-from panda3d.core import PandaSystem, MaterialAttrib, WindowProperties
-from panda3d.core import GeomTristrips, Vec4
+from panda3d.core import PandaSystem, WindowProperties, VirtualFileSystem
 
 from direct.showbase.ShowBase import ShowBase
 from direct.stdpy.file import isfile
 
-from rplibs.yaml import load_yaml_file_flat
-from rplibs.six.moves import range  # pylint: disable=import-error
+from rplibs.yaml import load_yaml_file_flat, enable_yaml_disk_cache
 
 from rpcore.globals import Globals
 from rpcore.effect import Effect
 from rpcore.rpobject import RPObject
+from rpcore.loader import RPLoader
 from rpcore.common_resources import CommonResources
-from rpcore.native import TagStateManager, PointLight, SpotLight
+from rpcore.native import TagStateManager
 from rpcore.render_target import RenderTarget
 from rpcore.pluginbase.manager import PluginManager
 from rpcore.pluginbase.day_manager import DayTimeManager
@@ -52,6 +50,9 @@ from rpcore.pluginbase.day_manager import DayTimeManager
 from rpcore.util.task_scheduler import TaskScheduler
 from rpcore.util.network_communication import NetworkCommunication
 from rpcore.util.ies_profile_loader import IESProfileLoader
+from rpcore.util.ies_profile_library import IESProfileLibrary
+from rpcore.util.scene_preparer import ScenePreparer
+from rpcore.util.material_registry import MaterialRegistry
 
 from rpcore.gui.debugger import Debugger
 from rpcore.gui.loading_screen import LoadingScreen
@@ -109,14 +110,44 @@ class RenderPipeline(RPObject):
             self._showbase.graphicsEngine.render_frame()
             self._showbase.graphicsEngine.render_frame()
         self.tag_mgr.cleanup_states()
+        if RPLoader.SHADER_CACHE is not None:
+            RPLoader.SHADER_CACHE.invalidate()
         self.stage_mgr.reload_shaders()
         self.light_mgr.reload_shaders()
+        Effect.clear_cache()
         self._set_default_effect()
         self.plugin_mgr.trigger_hook("shader_reload")
         if self.settings["pipeline.display_debugger"]:
             self.debugger.set_reload_hint_visible(False)
         self._apply_custom_shaders()
 
+    def reload_changed_shaders(self):
+        """ Rewrites the shader auto config, and only reloads the stages and
+        effects using one of the defines which changed. This is used when
+        changing settings at runtime, and requires the shader cache. Returns
+        False if the shader cache is disabled, in which case the shaders have
+        to be reloaded by other means. """
+        if RPLoader.SHADER_CACHE is None:
+            return False
+        start = time.time()
+        shader_keys = self.stage_mgr.write_autoconfig()
+        if not shader_keys:
+            return True
+        stages = self.stage_mgr.reload_affected_stages(shader_keys)
+
+        get_key = RPLoader.SHADER_CACHE.get_key
+        reload_effects = any(get_key(args) in shader_keys for args in Effect.get_shader_requests())
+        if reload_effects:
+            # The default effect is part of the applied effects as well
+            self.tag_mgr.cleanup_states()
+            Effect.clear_cache()
+            self._apply_custom_shaders()
+
+        self.debug("Reloaded {} shaders of {} stages{} in {:3.1f} ms".format(
+            len(shader_keys), len(stages), " and all effects" if reload_effects else "",
+            (time.time() - start) * 1000.0))
+        return True
+
     def _apply_custom_shaders(self):
         """ Re-applies all custom shaders the user applied, to avoid them getting
         removed when the shaders are reloaded """
@@ -134,6 +165,11 @@ class RenderPipeline(RPObject):
             self.debug("Mount manager was not mounted, mounting now ...")
             self.mount_mgr.mount()
 
+        # Keep parsed configuration files in the write path, if there is one
+        if self.mount_mgr.write_path is not None:
+            VirtualFileSystem.get_global_ptr().make_directory_full("/$$rptemp/yaml-cache/")
+            enable_yaml_disk_cache("/$$rptemp/yaml-cache/")
+
         if not self.settings:
             self.debug("No settings loaded, loading from default location")
             self.load_settings("/$$rpconfig/pipeline.yaml")
@@ -207,6 +243,8 @@ class RenderPipeline(RPObject):
     def remove_light(self, light):
         """ Removes a previously attached light, check out the LightManager
         remove_light documentation for further information. """
+        if isinstance(self.ies_loader, IESProfileLibrary):
+            self.ies_loader.release(light)
         self.light_mgr.remove_light(light)
 
     def load_ies_profile(self, filename):
@@ -214,6 +252,16 @@ class RenderPipeline(RPObject):
         can be used to set an ies profile on a light """
         return self.ies_loader.load(filename)
 
+    def assign_ies_profile(self, light, filename):
+        """ Assigns an ies profile to a light, given by its filename or, if the
+        profile library is used, its name. Unlike load_ies_profile, this allows
+        the profile library to evict the profile while the light is not visible,
+        so that more profiles than fit into the storage can be used. """
+        if isinstance(self.ies_loader, IESProfileLibrary):
+            self.ies_loader.assign(light, filename)
+        else:
+            light.ies_profile = self.ies_loader.load(filename)
+
     def _internal_set_effect(self, nodepath, effect_src, options=None, sort=30):
         """ Sets an effect to the given object, using the specified options.
         Check out the effect documentation for more information about possible
@@ -279,103 +327,33 @@ class RenderPipeline(RPObject):
         This method also returns a dictionary with handles to all created
         objects, that is lights, environment probes, and transparent objects.
         This can be used to store them and process them later on, or delete
-        them when a newer scene is loaded."""
-        lights = []
-        for light in scene.find_all_matches("**/+PointLight"):
-            light_node = light.node()
-            rp_light = PointLight()
-            rp_light.pos = light.get_pos(Globals.base.render)
-            rp_light.radius = light_node.max_distance
-            rp_light.energy = 20.0 * light_node.color.w
-            rp_light.color = light_node.color.xyz
-            rp_light.casts_shadows = light_node.shadow_caster
-            rp_light.shadow_map_resolution = light_node.shadow_buffer_size.x
-            rp_light.inner_radius = 0.4
-
-            self.add_light(rp_light)
-            light.remove_node()
-            lights.append(rp_light)
-
-        for light in scene.find_all_matches("**/+Spotlight"):
-            light_node = light.node()
-            rp_light = SpotLight()
-            rp_light.pos = light.get_pos(Globals.base.render)
-            rp_light.radius = light_node.max_distance
-            rp_light.energy = 20.0 * light_node.color.w
-            rp_light.color = light_node.color.xyz
-            rp_light.casts_shadows = light_node.shadow_caster
-            rp_light.shadow_map_resolution = light_node.shadow_buffer_size.x
-            rp_light.fov = light_node.exponent / math.pi * 180.0
-            lpoint = light.get_mat(Globals.base.render).xform_vec((0, 0, -1))
-            rp_light.direction = lpoint
-            self.add_light(rp_light)
-            light.remove_node()
-            lights.append(rp_light)
-
-        envprobes = []
-        for np in scene.find_all_matches("**/ENVPROBE*"):
-            probe = self.add_environment_probe()
-            probe.set_mat(np.get_mat())
-            probe.border_smoothness = 0.0001
-            probe.parallax_correction = True
-            np.remove_node()
-            envprobes.append(probe)
-
-        tristrips_warning_emitted = False
-        transparent_objects = []
-        for geom_np in scene.find_all_matches("**/+GeomNode"):
-            geom_node = geom_np.node()
-            geom_count = geom_node.get_num_geoms()
-            for i in range(geom_count):
-                state = geom_node.get_geom_state(i)
-                geom = geom_node.get_geom(i)
-
-                needs_conversion = False
-                for prim in geom.get_primitives():
-                    if isinstance(prim, GeomTristrips):
-                        needs_conversion = True
-                        if not tristrips_warning_emitted:
-                            self.warn("At least one GeomNode (", geom_node.get_name(), "and possible more..) contains tristrips.")
-                            self.warn("Due to a NVIDIA Driver bug, we have to convert them to triangles now.")
-                            self.warn("Consider exporting your models with the Bam Exporter to avoid this.")
-                            tristrips_warning_emitted = True
-                            break
-
-                if needs_conversion:
-                    geom_node.modify_geom(i).decompose_in_place()
-
-                if not state.has_attrib(MaterialAttrib):
-                    self.warn("Geom", geom_node, "has no material! Please fix this.")
-                    continue
-
-                material = state.get_attrib(MaterialAttrib).get_material()
-                shading_model = material.emission.x
-
-                # SHADING_MODEL_TRANSPARENT
-                if shading_model == 3:
-                    if geom_count > 1:
-                        self.error("Transparent materials must be on their own geom!\n"
-                                   "If you are exporting from blender, split them into\n"
-                                   "seperate meshes, then re-export your scene. The\n"
-                                   "problematic mesh is: " + geom_np.get_name())
-                        continue
-                    self.set_effect(geom_np, "effects/default.yaml",
-                                    {"render_forward": True, "render_gbuffer": False}, 100)
-
-        return {"lights": lights, "envprobes": envprobes,
-                "transparent_objects": transparent_objects}
+        them when a newer scene is loaded. The "report" entry contains the
+        amount of processed objects and the time spent per phase.
+
+        The scene is traversed only once, and already prepared geometry is
+        skipped, so this can be called again on a root where new chunks of
+        a streamed world got attached. """
+        return self.scene_preparer.prepare(scene)
 
     def _create_managers(self):
         """ Internal method to create all managers and instances. This also
         initializes the commonly used render stages, which are always required,
         independently of which plugins are enabled. """
         self.task_scheduler = TaskScheduler(self)
+        self.scene_preparer = ScenePreparer(self)
+        self.material_registry = MaterialRegistry()
         self.tag_mgr = TagStateManager(Globals.base.cam)
         self.plugin_mgr = PluginManager(self)
         self.stage_mgr = StageManager(self)
         self.light_mgr = LightManager(self)
         self.daytime_mgr = DayTimeManager(self)
-        self.ies_loader = IESProfileLoader(self)
+        if self.settings["lighting.ies_profile_library"]:
+            cache_dir = None
+            if self.mount_mgr.write_path is not None:
+                cache_dir = "/$$rptemp/ies-cache/"
+            self.ies_loader = IESProfileLibrary(self, cache_dir)
+        else:
+            self.ies_loader = IESProfileLoader(self)
         self.common_resources = CommonResources(self)
         self._init_common_stages()
 
@@ -434,6 +412,25 @@ class RenderPipeline(RPObject):
         RenderTarget.RT_OUTPUT_FUNC = lambda *args: RPObject.global_warn(
             "RenderTarget", *args[1:])
         RenderTarget.USE_R11G11B10 = self.settings["pipeline.use_r11_g11_b10"]
+        RenderTarget.SIZE_CLASS_STEP = self.settings["pipeline.render_target_size_class"]
+
+        # Generated effect shaders can only persist if there is an actual write path
+        if self.settings["pipeline.persistent_effect_cache"]:
+            if self.mount_mgr.write_path is not None:
+                Effect.enable_persistent_cache()
+            else:
+                self.debug("No write path set, not persisting the effect cache")
+
+        if self.settings["pipeline.persistent_shader_cache"]:
+            if self.mount_mgr.write_path is not None:
+                RPLoader.enable_shader_cache("/$$rptemp/shader-cache/")
+            else:
+                self.debug("No write path set, not persisting the shader cache")
+
+        # Parallel preprocessing also works with an in-memory shader cache
+        if RPLoader.SHADER_CACHE is None and \
+                self.settings["pipeline.shader_preprocessing_threads"] > 0:
+            RPLoader.enable_shader_cache()
 
     def _set_default_effect(self):
         """ Sets the default effect used for all objects if not overridden, this
@@ -500,6 +497,12 @@ class RenderPipeline(RPObject):
         """ Checks for window events. This mainly handles incoming resizes,
         and calls the required handlers """
         self._showbase.windowEvent(event)
+        self.handle_window_resize()
+
+    def handle_window_resize(self):
+        """ Checks whether the window size changed, and if so, resizes all
+        render targets. This gets called on window events, offscreen buffers
+        send no events, so this has to be called manually after resizing them. """
         window_dims = LVecBase2i(self._showbase.win.get_x_size(), self._showbase.win.get_y_size())
         if window_dims != self._last_window_dims and window_dims != Globals.native_resolution:
             self._last_window_dims = LVecBase2i(window_dims)
@@ -538,6 +541,7 @@ class RenderPipeline(RPObject):
         self._listener.update()
         self.debugger.update()
         self.daytime_mgr.update()
+        self.ies_loader.update()
         self.light_mgr.update()
 
         if Globals.clock.get_frame_count() == 10:
@@ -640,49 +644,16 @@ class RenderPipeline(RPObject):
             self._upscale_stage = UpscaleStage(self)
             add_stage(self._upscale_stage)
 
-    def _get_serialized_material_name(self, material, index=0):
-        """ Returns a serializable material name """
-        return str(index) + "-" + (material.get_name().replace(" ", "").strip() or "unnamed")
-
     def export_materials(self, pth):
         """ Exports a list of all materials found in the current scene in a
-        serialized format to the given path """
-
-        with open(pth, "w") as handle:
-            for i, material in enumerate(Globals.render.find_all_materials()):
-                if not material.has_base_color() or not material.has_roughness() or not material.has_refractive_index():
-                    print("Skipping non-pbr material:", material.name)
-                    continue
-
-                handle.write(("{} " * 11).format(
-                    self._get_serialized_material_name(material, i),
-                    material.base_color.x,
-                    material.base_color.y,
-                    material.base_color.z,
-                    material.roughness,
-                    material.refractive_index,
-                    material.metallic,
-                    material.emission.x, # shading model
-                    material.emission.y, # normal strength
-                    material.emission.z, # arbitrary 0
-                    material.emission.w, # arbitrary 1
-                ) + "\n")
+        serialized format to the given path, see MaterialRegistry """
+        self.material_registry.export(pth)
 
     def update_serialized_material(self, data):
         """ Internal method to update a material from a given serialized material """
-        name = data[0]
-
-        for i, material in enumerate(Globals.render.find_all_materials()):
-            if self._get_serialized_material_name(material, i) == name:
-                material.set_base_color(Vec4(float(data[1]), float(data[2]), float(data[3]), 1.0))
-                material.set_roughness(float(data[4]))
-                material.set_refractive_index(float(data[5]))
-                material.set_metallic(float(data[6]))
-                material.set_emission(Vec4(
-                    float(data[7]),
-                    float(data[8]),
-                    float(data[9]),
-                    float(data[10]),
-                ))
+        self.material_registry.update([data])
 
-        RenderState.clear_cache()
+    def update_serialized_materials(self, entries):
+        """ Internal method to update multiple materials at once, given a list
+        of serialized materials """
+        return self.material_registry.update(entries)
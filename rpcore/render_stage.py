@@ -51,6 +51,16 @@ class RenderStage(RPObject):
 
     disabled = False
 
+    # Whether the render targets of the stage may share their memory with the
+    # targets of other stages (see RenderTargetPool). Stages which do not render
+    # every frame and keep their results have to disable this.
+    allow_target_aliasing = True
+
+    # Whether the shaders of the stage work with screen textures which are
+    # larger than the rendered area (see RenderTarget.SIZE_CLASS_STEP), that is
+    # they sample them using get_texcoord() or apply VIEWPORT_UV_SCALE otherwise.
+    supports_size_classes = False
+
     def __init__(self, pipeline):
         """ Creates a new render stage """
         RPObject.__init__(self)
@@ -59,6 +69,10 @@ class RenderStage(RPObject):
         self._active = True
         self._targets = {}
 
+        # All shaders loaded by this stage, which is used to find out which
+        # stages have to be reloaded when a shader changes
+        self.shader_requests = set()
+
     def create(self):
         """ This method should setup the stage and create the pipes """
         raise NotImplementedError()
@@ -121,6 +135,11 @@ class RenderStage(RPObject):
                 break
         del self._targets[target_key]
 
+    @property
+    def targets(self):
+        """ Returns the dictionary of all render targets of this stage """
+        return self._targets
+
     def _get_shader_handle(self, path, *args):
         """ Returns a handle to a Shader object, containing all sources passed
         as arguments. The path argument will be used to locate shaders if no
@@ -141,6 +160,7 @@ class RenderStage(RPObject):
         # and use the default vertex shader
         if len(args) == 1:
             path_args = ["/$$rp/shader/default_post_process.vert.glsl"] + path_args
+        self.shader_requests.add(tuple(path_args))
         return RPLoader.load_shader(*path_args)
 
     def _get_plugin_id(self):
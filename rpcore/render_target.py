@@ -29,10 +29,10 @@ from __future__ import print_function, division
 from panda3d.core import GraphicsOutput, Texture, AuxBitplaneAttrib, NodePath
 from panda3d.core import Vec4, TransparencyAttrib, ColorWriteAttrib, SamplerState
 from panda3d.core import WindowProperties, FrameBufferProperties, GraphicsPipe
-from panda3d.core import LVecBase2i
+from panda3d.core import LVecBase2i, Vec2
 
 from rplibs.six.moves import range  # pylint: disable=import-error
-from rplibs.six import iterkeys, itervalues
+from rplibs.six import iterkeys, itervalues, iteritems
 
 from rpcore.globals import Globals
 from rpcore.rpobject import RPObject
@@ -62,6 +62,12 @@ class RenderTarget(RPObject):
     REGISTERED_TARGETS = []
     CURRENT_SORT = -300
 
+    # If greater than zero, targets with a size relative to the screen get
+    # allocated with the resolution rounded up to a multiple of this value,
+    # and render into a sub-rectangle of it. Resizing the window then only
+    # reallocates the targets when the resolution crosses a multiple.
+    SIZE_CLASS_STEP = 0
+
     def __init__(self, name="target"):
         RPObject.__init__(self, name)
         self._targets = {}
@@ -70,6 +76,7 @@ class RenderTarget(RPObject):
         self._aux_count = 0
         self._depth_bits = 0
         self._size = LVecBase2i(-1)
+        self._allocated_size = LVecBase2i(-1)
         self._size_constraint = LVecBase2i(-1)
         self._source_window = Globals.base.win
         self._source_region = None
@@ -125,6 +132,24 @@ class RenderTarget(RPObject):
         (the default). """
         self._size_constraint = LVecBase2i(*args)
 
+    @staticmethod
+    def get_allocated_resolution():
+        """ Returns the resolution which is allocated for full screen targets,
+        which is the render resolution rounded up to the size class """
+        step = RenderTarget.SIZE_CLASS_STEP
+        if step <= 0:
+            return LVecBase2i(Globals.resolution)
+        return LVecBase2i((Globals.resolution.x + step - 1) // step * step,
+                          (Globals.resolution.y + step - 1) // step * step)
+
+    @staticmethod
+    def get_viewport_uv_scale():
+        """ Returns the factor to convert texcoords in the range 0 .. 1 of the
+        rendered area to texcoords of the allocated screen textures """
+        allocated = RenderTarget.get_allocated_resolution()
+        return Vec2(float(Globals.resolution.x) / allocated.x,
+                    float(Globals.resolution.y) / allocated.y)
+
     @property
     def active(self):
         """ Returns whether the target is currently active """
@@ -224,6 +249,7 @@ class RenderTarget(RPObject):
         # Reenable depth-clear, usually desireable
         self._source_region.set_clear_depth_active(True)
         self._source_region.set_clear_depth(1.0)
+        self._update_viewport()
         self._active = True
 
     def prepare_buffer(self):
@@ -268,6 +294,7 @@ class RenderTarget(RPObject):
 
             if max(self._color_bits) == 0:
                 self._source_region.set_attrib(ColorWriteAttrib.make(ColorWriteAttrib.M_none), 1000)
+        self._update_viewport()
 
     def _compute_size_from_constraint(self):
         """ Computes the actual size in pixels from the targets size constraint """
@@ -278,6 +305,29 @@ class RenderTarget(RPObject):
         if self._size_constraint.y < 0:
             self._size.y = (h - self._size_constraint.y - 1) // (-self._size_constraint.y)
 
+        # Compute the allocated size the same way, but from the allocated
+        # resolution, so that all relative targets share the same uv scale
+        allocated = RenderTarget.get_allocated_resolution()
+        self._allocated_size = LVecBase2i(self._size)
+        if self._size_constraint.x < 0:
+            self._allocated_size.x = (allocated.x - self._size_constraint.x - 1) // (
+                -self._size_constraint.x)
+        if self._size_constraint.y < 0:
+            self._allocated_size.y = (allocated.y - self._size_constraint.y - 1) // (
+                -self._size_constraint.y)
+
+    def _update_viewport(self):
+        """ Restricts all display regions to the rendered sub-rectangle of the
+        allocated size. Only required for targets with a relative size. """
+        if RenderTarget.SIZE_CLASS_STEP <= 0 or not self._internal_buffer:
+            return
+        if self._size_constraint.x >= 0 and self._size_constraint.y >= 0:
+            return
+        right = float(self._size.x) / self._allocated_size.x
+        top = float(self._size.y) / self._allocated_size.y
+        for region in self._internal_buffer.get_display_regions():
+            region.set_dimensions(0, right, 0, top)
+
     def _setup_textures(self):
         """ Prepares all bound textures """
         for i in range(self._aux_count):
@@ -287,14 +337,14 @@ class RenderTarget(RPObject):
             tex.set_wrap_u(SamplerState.WM_clamp)
             tex.set_wrap_v(SamplerState.WM_clamp)
             tex.set_anisotropic_degree(0)
-            tex.set_x_size(self._size.x)
-            tex.set_y_size(self._size.y)
+            tex.set_x_size(self._allocated_size.x)
+            tex.set_y_size(self._allocated_size.y)
             tex.set_minfilter(SamplerState.FT_linear)
             tex.set_magfilter(SamplerState.FT_linear)
 
     def _make_properties(self):
         """ Creates the window and buffer properties """
-        window_props = WindowProperties.size(self._size.x, self._size.y)
+        window_props = WindowProperties.size(self._allocated_size.x, self._allocated_size.y)
         buffer_props = FrameBufferProperties()
 
         if self._size_constraint.x == 0 or self._size_constraint.y == 0:
@@ -354,6 +404,24 @@ class RenderTarget(RPObject):
             self.error("Failed to create buffer")
             return
 
+        self._add_render_textures()
+
+        if not self.sort:
+            RenderTarget.CURRENT_SORT += 20
+            self.sort = RenderTarget.CURRENT_SORT
+
+        RenderTarget.NUM_ALLOCATED_BUFFERS += 1
+        self._internal_buffer.set_sort(self.sort)
+        self._internal_buffer.disable_clears()
+        self._internal_buffer.get_display_region(0).disable_clears()
+        self._internal_buffer.get_overlay_display_region().disable_clears()
+        self._internal_buffer.get_overlay_display_region().set_active(False)
+
+        RenderTarget.REGISTERED_TARGETS.append(self)
+        return True
+
+    def _add_render_textures(self):
+        """ Internal method to bind all attachments to the buffer """
         if self._depth_bits:
             self._internal_buffer.add_render_texture(
                 self.depth_tex, GraphicsOutput.RTM_bind_or_copy,
@@ -375,26 +443,46 @@ class RenderTarget(RPObject):
             self._internal_buffer.add_render_texture(
                 self.aux_tex[i], GraphicsOutput.RTM_bind_or_copy, target_mode)
 
-        if not self.sort:
-            RenderTarget.CURRENT_SORT += 20
-            self.sort = RenderTarget.CURRENT_SORT
-
-        RenderTarget.NUM_ALLOCATED_BUFFERS += 1
-        self._internal_buffer.set_sort(self.sort)
-        self._internal_buffer.disable_clears()
-        self._internal_buffer.get_display_region(0).disable_clears()
-        self._internal_buffer.get_overlay_display_region().disable_clears()
-        self._internal_buffer.get_overlay_display_region().set_active(False)
-
-        RenderTarget.REGISTERED_TARGETS.append(self)
-        return True
+    def get_attachment_formats(self):
+        """ Returns a list of (texture, format) tuples for all attachments. Two
+        attachments with the same format always have the same size and pixel
+        layout, and can share their memory if they are never used at the same
+        time, see RenderTargetPool. """
+        formats = []
+        size = (self._size_constraint.x, self._size_constraint.y,
+                self._allocated_size.x, self._allocated_size.y)
+        for name, tex in sorted(iteritems(self._targets)):
+            if name == "color":
+                bits = self._color_bits
+                if bits == (16, 16, 16, 0) and RenderTarget.USE_R11G11B10:
+                    bits = (11, 11, 10, 0)
+            elif name == "depth":
+                bits = self._depth_bits
+            else:
+                bits = self._aux_bits
+            formats.append((tex, (name.split("_")[0], bits) + size))
+        return formats
+
+    def replace_texture(self, old_tex, new_tex):
+        """ Makes the target render into new_tex instead of old_tex. This is
+        used by the RenderTargetPool to alias attachments of different targets,
+        new_tex should have the same format as old_tex. """
+        for name, tex in list(iteritems(self._targets)):
+            if tex is old_tex:
+                self._targets[name] = new_tex
+        self._internal_buffer.clear_render_textures()
+        self._add_render_textures()
 
     def consider_resize(self):
         """ Checks if the target has to get resized, and if this is the case,
         performs the resize. This should be called when the window resolution
-        changed. """
+        changed. With size classes, the buffer only gets resized when the
+        allocated size changes, otherwise only the viewport gets adjusted. """
         current_size = LVecBase2i(self._size)
+        current_allocated_size = LVecBase2i(self._allocated_size)
         self._compute_size_from_constraint()
-        if current_size != self._size:
+        if current_allocated_size != self._allocated_size:
             if self._internal_buffer:
-                self._internal_buffer.set_size(self._size.x, self._size.y)
+                self._internal_buffer.set_size(self._allocated_size.x, self._allocated_size.y)
+        if current_size != self._size or current_allocated_size != self._allocated_size:
+            self._update_viewport()
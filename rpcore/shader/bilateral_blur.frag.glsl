@@ -55,7 +55,7 @@ out VALUE_TYPE result;
 
 void main() {
     vec2 texcoord = get_texcoord();
-    vec2 pixel_size = 1.0 * pixel_stretch / SCREEN_SIZE;
+    vec2 pixel_size = 1.0 * pixel_stretch / SCREEN_TEXTURE_SIZE;
 
     // Store accumulated color
     VALUE_TYPE accum = VALUE_TYPE(0);
@@ -70,7 +70,8 @@ void main() {
 
     // Blur to the right and left
     for (int i = -blur_size + 1; i < blur_size; ++i) {
-        vec2 offcoord = texcoord + pixel_size * i * blur_direction;
+        vec2 offcoord = clamp_screen_texcoord(
+            texcoord + pixel_size * i * blur_direction, 1.0 / SCREEN_TEXTURE_SIZE);
         VALUE_TYPE sampled = textureLod(SourceTex, offcoord, 0) SWIZLLE;
         vec3 nrm = get_gbuffer_normal(GBuffer, offcoord);
         float depth = textureLod(DownscaledDepth, offcoord, 0).x;
@@ -46,7 +46,7 @@ float get_lin_z(vec2 ccoord) {
 
 void main() {
     vec2 texcoord = get_half_native_texcoord();
-    vec2 pixel_size = 2.0 / SCREEN_SIZE;
+    vec2 pixel_size = 2.0 / SCREEN_TEXTURE_SIZE;
 
     // Store accumulated color
     vec4 accum = vec4(0);
@@ -61,7 +61,8 @@ void main() {
 
     // Blur to the right
     for (int i = -blur_size + 1; i < blur_size; ++i) {
-        vec2 offcoord = texcoord + pixel_size * i * blur_direction;
+        vec2 offcoord = clamp_screen_texcoord(
+            texcoord + pixel_size * i * blur_direction, 2.0 / SCREEN_TEXTURE_SIZE);
         vec4 sampled = textureLod(SourceTex, offcoord, 0);
         vec3 nrm = get_gbuffer_normal(GBuffer, offcoord);
         float depth = get_lin_z(offcoord);
@@ -48,7 +48,8 @@ void main() {
     for (int i = -filter_size; i <= filter_size; ++i) {
         for (int j = -filter_size; j <= filter_size; ++j) {
             if ((i == 0 && j == 0) || (abs(i) == 2 && abs(j) == 2)) {
-                vec2 offcoord = texcoord + vec2(i, j) / SCREEN_SIZE;
+                vec2 offcoord = clamp_screen_texcoord(
+                    texcoord + vec2(i, j) / SCREEN_TEXTURE_SIZE, 1.0 / SCREEN_TEXTURE_SIZE);
                 float depth = get_depth_at(offcoord);
                 if (depth < closest.z) {
                     closest = vec3(offcoord, depth);
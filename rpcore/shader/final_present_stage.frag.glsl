@@ -35,7 +35,7 @@ out vec4 result;
 // This shader just passes through the input texture
 
 void main() {
-    vec2 texcoord = (ivec2(gl_FragCoord.xy) + 0.5) / NATIVE_SCREEN_SIZE;
+    vec2 texcoord = screen_to_texcoord((ivec2(gl_FragCoord.xy) + 0.5) / NATIVE_SCREEN_SIZE);
     result = vec4(textureLod(SourceTex, texcoord, 0).xyz, 1);
 
     #if SPECIAL_MODE_ACTIVE(LUMINANCE)
@@ -248,13 +248,13 @@ float blend_ior(float material_specular, float sampled_specular) {
 // not available in compute shaders
 
 // Regular texcoord
-#define get_texcoord() (gl_FragCoord.xy / SCREEN_SIZE)
+#define get_texcoord() screen_to_texcoord(gl_FragCoord.xy / SCREEN_SIZE)
 
 // Texcoord for half-res targets sampling full-res targets
-#define get_half_texcoord() vec2((ivec2(gl_FragCoord.xy) * 2 + 0.5) / SCREEN_SIZE)
+#define get_half_texcoord() screen_to_texcoord(vec2((ivec2(gl_FragCoord.xy) * 2 + 0.5) / SCREEN_SIZE))
 
 // Texcoord for half-res targets sampling half-res targets
-#define get_half_native_texcoord() ((vec2(gl_FragCoord.xy) + 0.5) / ivec2(SCREEN_SIZE / 2))
+#define get_half_native_texcoord() screen_to_texcoord((vec2(gl_FragCoord.xy) + 0.5) / ivec2(SCREEN_SIZE / 2))
 
 // Converts degree (0 .. 360) to radians (0 .. 2 PI)
 float degree_to_radians(float degree) {
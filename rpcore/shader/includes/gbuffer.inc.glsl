@@ -45,11 +45,12 @@ uniform mat4 p3d_ProjectionMatrix;
     layout(location = 2) out vec4 gbuffer_out_2;
 
     vec2 compute_velocity() {
-        // Compute velocity based on this and last frames mvp matrix
+        // Compute velocity based on this and last frames mvp matrix. The
+        // velocity is stored in texcoords of the screen textures.
         vec4 last_proj_pos = vOutput.last_proj_position;
         vec2 last_texcoord = fma(last_proj_pos.xy / last_proj_pos.w, vec2(0.5), vec2(0.5));
         vec2 curr_texcoord = gl_FragCoord.xy / SCREEN_SIZE;
-        return (curr_texcoord - last_texcoord);
+        return screen_to_texcoord(curr_texcoord - last_texcoord);
     }
 
     // Lean mapping
@@ -261,7 +262,7 @@ uniform mat4 p3d_ProjectionMatrix;
                 return world_normal_to_view(world_normal);
             #endif
 
-            vec2 pixel_size = 1.0 / SCREEN_SIZE;
+            vec2 pixel_size = 1.0 / SCREEN_TEXTURE_SIZE;
             vec3 view_pos = get_view_pos_at(coord);
 
             // Do some work to find a good view normal
@@ -285,7 +286,7 @@ uniform mat4 p3d_ProjectionMatrix;
         // the depth buffer as source.
         vec3 get_view_normal_approx(vec2 coord) {
             vec3 view_pos = get_view_pos_at(coord);
-            vec2 pixel_size = 1.0 / SCREEN_SIZE;
+            vec2 pixel_size = 1.0 / SCREEN_TEXTURE_SIZE;
             vec3 dx_x = view_pos - get_view_pos_at(coord + pixel_size * vec2(1, 0));
             vec3 dx_y = view_pos - get_view_pos_at(coord + pixel_size * vec2(0, 1));
             return normalize(cross(dx_x, dx_y));
@@ -294,12 +295,12 @@ uniform mat4 p3d_ProjectionMatrix;
 
         // Returns the cameras velocity
         vec2 get_camera_velocity(vec2 texcoord) {
-            vec2 film_offset_bias = MainSceneData.current_film_offset *
-            vec2(1.0, 1.0 / ASPECT_RATIO);
+            vec2 film_offset_bias = screen_to_texcoord(MainSceneData.current_film_offset *
+            vec2(1.0, 1.0 / ASPECT_RATIO));
             vec3 pos = get_world_pos_at(texcoord - film_offset_bias);
             vec4 last_proj = MainSceneData.last_view_proj_mat_no_jitter * vec4(pos, 1);
             vec2 last_coord = fma(last_proj.xy / last_proj.w, vec2(0.5), vec2(0.5));
-            return last_coord - texcoord;
+            return screen_to_texcoord(last_coord) - texcoord;
         }
 
     #endif
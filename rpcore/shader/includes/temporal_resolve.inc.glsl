@@ -120,11 +120,11 @@ vec4 clip_aabb(vec3 aabb_min, vec3 aabb_max, vec4 p, vec4 q)
 
 
 vec4 resolve_temporal(sampler2D current_tex, sampler2D last_tex, vec2 curr_coord, vec2 last_coord) {
-    vec2 one_pixel = 1.0 / SCREEN_SIZE;
+    vec2 one_pixel = 1.0 / SCREEN_TEXTURE_SIZE;
     vec4 curr_m = textureLod(current_tex, curr_coord, 0);
 
     // Out of screen, can early out
-    if (out_of_screen(last_coord)) {
+    if (out_of_screen(texcoord_to_screen(last_coord))) {
         return max(vec4(0.0), curr_m);
     }
 
@@ -137,7 +137,8 @@ vec4 resolve_temporal(sampler2D current_tex, sampler2D last_tex, vec2 curr_coord
 
             float last_z = textureLod(Previous_SceneDepth, last_coord, 0).x;
             vec3 last_pos = calculate_surface_pos(
-                last_z, last_coord, MainSceneData.last_inv_view_proj_mat_no_jitter);
+                last_z, texcoord_to_screen(last_coord),
+                MainSceneData.last_inv_view_proj_mat_no_jitter);
 
             // Weight by distance
             float max_distance = RS_DISTANCE_SCALE;
@@ -164,8 +165,8 @@ vec4 resolve_temporal(sampler2D current_tex, sampler2D last_tex, vec2 curr_coord
             float subpixel_motion = saturate(subpixel_threshold / (1e-8 + texel_vel_mag));
             float min_max_support = gather_base + gather_subpixel_motion * subpixel_motion;
 
-            vec2 ss_offset01 = min_max_support * vec2(1, 0) / SCREEN_SIZE;
-            vec2 ss_offset11 = min_max_support * vec2(0, 1) / SCREEN_SIZE;
+            vec2 ss_offset01 = min_max_support * vec2(1, 0) / SCREEN_TEXTURE_SIZE;
+            vec2 ss_offset11 = min_max_support * vec2(0, 1) / SCREEN_TEXTURE_SIZE;
 
             vec4 c00 = textureLod(current_tex, curr_coord - ss_offset11, 0);
             vec4 c10 = textureLod(current_tex, curr_coord - ss_offset01, 0);
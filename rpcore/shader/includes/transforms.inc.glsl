@@ -59,8 +59,10 @@ vec3 calculate_surface_pos(float z, vec2 tcoord, mat4 inverse_mvp) {
     return proj.xyz / proj.w;
 }
 
-// Computes the surface position based on a given Z and a texcoord
+// Computes the surface position based on a given Z and a texcoord of the
+// screen textures
 vec3 calculate_surface_pos(float z, vec2 tcoord) {
+    tcoord = texcoord_to_screen(tcoord);
     #if 0
     return calculate_surface_pos(z, tcoord, trans_clip_of_mainCam_to_mainRender);
     #else
@@ -84,18 +86,20 @@ vec3 calculate_surface_pos_ortho(float z, vec2 tcoord, float near, float far, ma
     return result.xyz / result.w;
 }
 
-// Computes the view position from a given Z value and texcoord
+// Computes the view position from a given Z value and texcoord of the screen
+// textures
 vec3 calculate_view_pos(float z, vec2 tcoord) {
     vec4 view_pos = MainSceneData.inv_proj_mat *
-    vec4(fma(tcoord.xy, vec2(2.0), vec2(-1.0)), z, 1.0);
+    vec4(fma(texcoord_to_screen(tcoord.xy), vec2(2.0), vec2(-1.0)), z, 1.0);
     return view_pos.xyz / view_pos.w;
 }
 
-// Computes the NDC position from a given view position
+// Computes the NDC position from a given view position, with xy being a
+// texcoord of the screen textures
 vec3 view_to_screen(vec3 view_pos) {
     vec4 projected = MainSceneData.proj_mat * vec4(view_pos, 1);
     projected.xyz /= projected.w;
-    projected.xy = fma(projected.xy, vec2(0.5), vec2(0.5));
+    projected.xy = screen_to_texcoord(fma(projected.xy, vec2(0.5), vec2(0.5)));
     return projected.xyz;
 }
 
@@ -107,11 +111,13 @@ vec3 view_normal_to_world(vec3 view_normal) {
     return normalize((vec4(view_normal, 0) * trans_mainRender_to_view_of_mainCam).xyz);
 }
 
-// Converts a world space position to screen space position (NDC)
+// Converts a world space position to screen space position (NDC), with xy
+// being a texcoord of the screen textures
 vec3 world_to_screen(vec3 world_pos) {
     vec4 proj = trans_mainRender_to_clip_of_mainCam * vec4(world_pos, 1);
     proj.xyz /= proj.w;
     proj.xyz = fma(proj.xyz, vec3(0.5), vec3(0.5));
+    proj.xy = screen_to_texcoord(proj.xy);
     return proj.xyz;
 }
 
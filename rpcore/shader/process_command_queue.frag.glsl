@@ -131,6 +131,26 @@ void main() {
 
 
 
+            #ifdef CMD_store_light_vec4s
+
+            // Store parts of the data of multiple lights
+            case CMD_store_light_vec4s: {
+                int num_entries = read_int(stack_ptr);
+
+                for (int i = 0; i < num_entries; ++i) {
+
+                    // Target is slot * 4 + vec4 index, negative for dropped entries
+                    int target = read_int(stack_ptr);
+                    vec4 data = read_vec4(stack_ptr);
+                    if (target >= 0) {
+                        imageStore(LightData, target, data);
+                    }
+                }
+                break;
+            }
+
+            #endif
+
             // .. further commands will follow here
 
         }
@@ -65,6 +65,23 @@
 #define ASPECT_RATIO float(float(WINDOW_HEIGHT) / float(WINDOW_WIDTH))
 #define NATIVE_SCREEN_SIZE vec2(NATIVE_WINDOW_WIDTH, NATIVE_WINDOW_HEIGHT)
 
+// Screen textures might be larger than the rendered area, if render target
+// size classes are used (see pipeline.render_target_size_class). Coordinates
+// of the rendered area (0 .. 1) have to be multiplied by VIEWPORT_UV_SCALE to
+// get texcoords of the screen textures. All texcoords returned by the common
+// functions, like get_texcoord(), are already scaled. Texcoords of neighbour
+// pixels should be clamped to the rendered area, given the size of a texel.
+#if USE_VIEWPORT_UV_SCALE
+    #define VIEWPORT_UV_SCALE MainSceneData.viewport_uv_scale
+    #define clamp_screen_texcoord(coord, texel_size) min(coord, VIEWPORT_UV_SCALE - 0.5 * (texel_size))
+#else
+    #define VIEWPORT_UV_SCALE vec2(1.0)
+    #define clamp_screen_texcoord(coord, texel_size) (coord)
+#endif
+#define SCREEN_TEXTURE_SIZE (SCREEN_SIZE / VIEWPORT_UV_SCALE)
+#define screen_to_texcoord(coord) ((coord) * VIEWPORT_UV_SCALE)
+#define texcoord_to_screen(coord) ((coord) / VIEWPORT_UV_SCALE)
+
 // Plugin functions
 #define HAVE_PLUGIN(PLUGIN_NAME) (HAVE_PLUGIN_ ## PLUGIN_NAME)
 #define GET_SETTING(PLUGIN_NAME, SETTING_NAME) (PLUGIN_NAME ## _ ## SETTING_NAME)
@@ -24,15 +24,19 @@ THE SOFTWARE.
 
 """
 
-from rplibs.six import iteritems
+from rplibs.six import iteritems, itervalues
 from rplibs.yaml import load_yaml_file
 
 from direct.stdpy.file import open
 
+from rpcore.globals import Globals
 from rpcore.rpobject import RPObject
+from rpcore.loader import RPLoader
 from rpcore.gui.pipe_viewer import PipeViewer
 from rpcore.image import Image
+from rpcore.render_target import RenderTarget
 from rpcore.util.shader_input_blocks import SimpleInputBlock, GroupedInputBlock
+from rpcore.util.render_target_pool import RenderTargetPool
 from rpcore.stages.update_previous_pipes_stage import UpdatePreviousPipesStage
 
 
@@ -53,6 +57,8 @@ class StageManager(RPObject):
         self.defines = {}
         self.pipeline = pipeline
         self.created = False
+        self._written_defines = None
+        self.target_pool = RenderTargetPool()
 
         self._load_stage_order()
 
@@ -145,6 +151,7 @@ class StageManager(RPObject):
                 return False
 
             pipe_value = self.pipes[pipe]
+            self.target_pool.add_use(self.stages.index(stage), stage, pipe, pipe_value)
             if isinstance(pipe_value, list) or isinstance(pipe_value, tuple):
                 stage.set_shader_input(pipe, *pipe_value)
             else:
@@ -206,6 +213,7 @@ class StageManager(RPObject):
 
                 # Tell the stage to transfer the data from the current pipe to
                 # the current texture
+                self.target_pool.pin(self.pipes[prev_pipe])
                 self._prev_stage.add_transfer(self.pipes[prev_pipe], prev_tex)
             self._prev_stage.create()
             self._prev_stage.set_dimensions()
@@ -218,6 +226,7 @@ class StageManager(RPObject):
             if pipe not in self.pipes:
                 self.error("Could not bind future pipe:", pipe, "not present!")
                 continue
+            self.target_pool.pin(self.pipes[pipe])
             stage.set_shader_input(pipe, self.pipes[pipe])
         self.future_bindings = []
 
@@ -229,8 +238,9 @@ class StageManager(RPObject):
         # Convert input blocks so we can access them in a better way
         self.input_blocks = {block.name: block for block in self.input_blocks}
         self._prepare_stages()
+        self._check_size_class_support()
 
-        for stage in self.stages:
+        for index, stage in enumerate(self.stages):
             stage.create()
             stage.handle_window_resize()
 
@@ -241,16 +251,77 @@ class StageManager(RPObject):
                 continue
 
             self._register_stage_result(stage)
+            self.target_pool.register_stage(index, stage)
         self._create_previous_pipes()
         self._apply_future_bindings()
+        self._alias_render_targets()
+
+    def _check_size_class_support(self):
+        """ Disables the allocation of render targets in size classes if any
+        of the active stages does not support it, and tells the shaders whether
+        they have to apply the viewport uv scale """
+        if RenderTarget.SIZE_CLASS_STEP > 0:
+            unsupported = [stage.stage_id for stage in self.stages
+                           if not stage.supports_size_classes]
+            if unsupported:
+                self.warn("Render target size classes are not supported by",
+                          ", ".join(unsupported), "- disabling them")
+                RenderTarget.SIZE_CLASS_STEP = 0
+            elif RenderTarget.SIZE_CLASS_STEP % 16 != 0:
+                self.warn("The render target size class should be a multiple of 16")
+        self.defines["USE_VIEWPORT_UV_SCALE"] = RenderTarget.SIZE_CLASS_STEP > 0
+
+    def _alias_render_targets(self):
+        """ Computes which render targets can share their memory, based on the
+        pipes used by each stage, and applies it if enabled """
+        self.target_pool.compute_aliases()
+        enabled = self.pipeline.settings["pipeline.render_target_aliasing"]
+        if enabled:
+            self.target_pool.apply_aliases(self.pipes)
+
+        report = self.target_pool.get_report()
+        total_saved = sum(entry[3] for entry in itervalues(report))
+        self.debug("Render target aliasing {} {:3.1f} MB".format(
+            "saved" if enabled else "could save", total_saved / (1024.0 ** 2)))
+        for (width, height), (count, allocations, total, saved) in sorted(iteritems(report)):
+            self.debug("  {:>5}x{:<5} {:3d} textures in {:3d} allocations, "
+                       "{:6.1f} MB, saved {:6.1f} MB".format(
+                           width, height, count, allocations,
+                           total / (1024.0 ** 2), saved / (1024.0 ** 2)))
 
     def reload_shaders(self):
         """ This pass sets the shaders to all passes and also generates the
         shader configuration """
         self.write_autoconfig()
+        self._preload_shaders()
         for stage in self.stages:
             stage.reload_shaders()
 
+    def _preload_shaders(self):
+        """ Collects the shaders of all stages, and preprocesses them in
+        parallel, so that reloading the stages afterwards does not have to
+        touch any files. This requires the shader cache to be enabled. """
+        num_threads = self.pipeline.settings["pipeline.shader_preprocessing_threads"]
+        if RPLoader.SHADER_CACHE is None or num_threads < 1:
+            return
+
+        def collect():
+            for stage in self.stages:
+                stage.reload_shaders()
+
+        requests = RPLoader.collect_shader_requests(collect)
+        report = RPLoader.SHADER_CACHE.preload(
+            requests, num_threads, Globals.base.win.gsg)
+        if not report:
+            return
+        total_serial = sum(entry[1] for entry in itervalues(report))
+        total_saved = sum(entry[2] for entry in itervalues(report))
+        self.debug("Preprocessed", len(requests), "shaders on", num_threads,
+                   "threads, saved {:3.1f} of {:3.1f} ms".format(total_saved, total_serial))
+        for owner, (count, serial_time, saved) in sorted(iteritems(report)):
+            self.debug("  {:<28} {:3d} shaders, {:6.1f} ms, saved {:6.1f} ms".format(
+                owner, count, serial_time, saved))
+
     def update(self):
         """ Calls the update method for each registered stage. Inactive stages
         are skipped. """
@@ -264,9 +335,23 @@ class StageManager(RPObject):
         for stage in self.stages:
             stage.handle_window_resize()
 
+    def reload_affected_stages(self, shader_keys):
+        """ Reloads the shaders of all stages which use one of the shaders with
+        the given shader cache keys. Returns the list of reloaded stages. """
+        reloaded = []
+        for stage in self.stages:
+            for args in stage.shader_requests:
+                if RPLoader.SHADER_CACHE.get_key(args) in shader_keys:
+                    stage.reload_shaders()
+                    reloaded.append(stage)
+                    break
+        return reloaded
+
     def write_autoconfig(self):
         """ Writes the shader auto config, based on the defines specified by the
-        different stages """
+        different stages. If the shader cache is enabled, this returns the set of
+        keys of all cached shaders which use one of the changed defines and thus
+        have to be reloaded, otherwise None. """
         self.debug("Writing shader config")
 
         # Generate autoconfig as string
@@ -284,3 +369,16 @@ class StageManager(RPObject):
                 handle.write(output)
         except IOError as msg:
             self.error("Error writing shader autoconfig:", msg)
+
+        defines = dict(self.defines)
+        if self._written_defines is None:
+            changed = set(defines)
+        else:
+            changed = set(key for key in set(defines) | set(self._written_defines)
+                          if defines.get(key) != self._written_defines.get(key))
+        self._written_defines = defines
+
+        if RPLoader.SHADER_CACHE is not None:
+            return RPLoader.SHADER_CACHE.invalidate_defines(
+                "/$$rptemp/$$pipeline_shader_config.inc.glsl", changed)
+        return None
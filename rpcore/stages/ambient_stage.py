@@ -34,6 +34,7 @@ class AmbientStage(RenderStage):
     required_inputs = ["DefaultEnvmap", "PrefilteredBRDF", "PrefilteredMetalBRDF",
                        "PrefilteredCoatBRDF"]
     required_pipes = ["ShadedScene", "GBuffer"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
@@ -34,6 +34,7 @@ class ApplyLightsStage(RenderStage):
     required_inputs = ["AllLightsData", "IESDatasetTex", "ShadowSourceData"]
     required_pipes = ["GBuffer", "CellIndices", "PerCellLights", "ShadowAtlas",
                       "ShadowAtlasPCF", "CombinedVelocity", "PerCellLightsCounts"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
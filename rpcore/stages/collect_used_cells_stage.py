@@ -34,6 +34,7 @@ class CollectUsedCellsStage(RenderStage):
     makes a list of them """
 
     required_pipes = ["FlaggedCells"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
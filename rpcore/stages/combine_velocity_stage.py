@@ -33,6 +33,7 @@ class CombineVelocityStage(RenderStage):
     camera velocity """
 
     required_pipes = ["GBuffer"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
@@ -37,6 +37,7 @@ class CullLightsStage(RenderStage):
 
     required_pipes = ["CellListBuffer"]
     required_inputs = ["AllLightsData", "maxLightIndex"]
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
@@ -34,6 +34,7 @@ class DownscaleZStage(RenderStage):
     """ This stage downscales the depth buffer """
 
     required_pipes = ["GBuffer"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
@@ -33,6 +33,7 @@ class FinalStage(RenderStage):
     screen """
 
     required_pipes = ["ShadedScene"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
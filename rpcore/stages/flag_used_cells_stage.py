@@ -34,6 +34,7 @@ class FlagUsedCellsStage(RenderStage):
 
     required_pipes = ["GBuffer"]
     required_inputs = []
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
@@ -36,6 +36,7 @@ class GBufferStage(RenderStage):
 
     required_inputs = ["DefaultEnvmap"]
     required_pipes = []
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
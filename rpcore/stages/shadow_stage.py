@@ -34,6 +34,8 @@ class ShadowStage(RenderStage):
 
     """ This is the stage which renders all shadows """
     required_inputs = []
+    allow_target_aliasing = False
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
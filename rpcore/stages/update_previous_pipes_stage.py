@@ -27,7 +27,7 @@ THE SOFTWARE.
 from direct.stdpy.file import open
 
 from rpcore.render_stage import RenderStage
-from rpcore.globals import Globals
+from rpcore.render_target import RenderTarget
 
 
 class UpdatePreviousPipesStage(RenderStage):
@@ -63,9 +63,10 @@ class UpdatePreviousPipesStage(RenderStage):
 
     def set_dimensions(self):
         """ Sets the dimensions on all targets. See RenderTarget::set_dimensions """
+        allocated = RenderTarget.get_allocated_resolution()
         for from_tex, to_tex in self._transfers:  # pylint: disable=unused-variable
-            to_tex.set_x_size(Globals.resolution.x)
-            to_tex.set_y_size(Globals.resolution.y)
+            to_tex.set_x_size(allocated.x)
+            to_tex.set_y_size(allocated.y)
 
     def reload_shaders(self):
         """ This method augo-generates a shader which copies all textures specified
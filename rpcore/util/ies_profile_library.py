@@ -0,0 +1,238 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+import sys
+import hashlib
+from collections import OrderedDict
+
+from panda3d.core import BoundingSphere, Point3, VirtualFileSystem
+from direct.stdpy.file import open, listdir, join, isfile
+
+from rplibs.six import iteritems
+
+from rpcore.globals import Globals
+from rpcore.util.ies_profile_loader import IESProfileLoader
+
+
+class IESProfileLibrary(IESProfileLoader):
+
+    """ Profile loader which supports more profiles than fit into the storage
+    at once. It indexes directories of .ies files, and only keeps the profiles
+    used by visible lights resident, evicting the least recently used profile
+    when a new one has to be loaded. Generated LUTs are cached in the write
+    path, so a profile which got evicted can be restored without parsing it.
+
+    Lights should get their profile with assign(), so the library can track
+    which profiles they use, and update them when a profile gets evicted or
+    restored. Profiles loaded with load() stay resident, since the library
+    cannot know which lights use them.
+
+    If the visible lights use more profiles than fit into the storage, the
+    profiles of the lights closest to the camera are kept, and the remaining
+    lights render without a profile. """
+
+    # Amount of frames between two visibility checks of the lights
+    UPDATE_INTERVAL = 5
+
+    def __init__(self, pipeline, cache_dir=None):
+        IESProfileLoader.__init__(self, pipeline)
+        self._profiles = {}
+        self._resident = OrderedDict()
+        self._pinned = set()
+        self._light_profiles = {}
+        self._visible_profiles = set()
+        self._digests = {}
+        self._overflow_warned = False
+        self._frame_index = 0
+        self._cache_dir = cache_dir
+        if cache_dir is not None:
+            VirtualFileSystem.get_global_ptr().make_directory_full(cache_dir)
+        self.index_directory("/$$rp/data/ies_profiles/")
+
+    def index_directory(self, directory):
+        """ Adds all .ies files of the given directory to the library, so they
+        can be referenced by their name without extension. Returns the amount
+        of indexed profiles. No profile gets parsed here. """
+        count = 0
+        for entry in listdir(directory):
+            if entry.lower().endswith(".ies"):
+                self._profiles[entry[:-4]] = join(directory, entry)
+                count += 1
+        self.debug("Indexed", count, "profiles in", directory)
+        return count
+
+    @property
+    def profile_names(self):
+        """ Returns the names of all indexed profiles """
+        return sorted(self._profiles)
+
+    @property
+    def num_resident_profiles(self):
+        """ Returns the amount of profiles currently stored in the texture """
+        return len(self._resident)
+
+    def load(self, filename):
+        """ Loads a profile by its name or filename and returns the layer it
+        is stored in. The profile will never get evicted. """
+        fname = self._resolve_profile(self._profiles.get(filename, filename))
+        if fname is None:
+            return -1
+        self._pinned.add(fname)
+        return self._acquire(fname)
+
+    def assign(self, light, filename):
+        """ Assigns a profile, given by its name or filename, to the light.
+        The profile gets loaded if required, and the light is updated whenever
+        the profile gets evicted or restored. """
+        fname = self._resolve_profile(self._profiles.get(filename, filename))
+        if fname is None:
+            return
+        self._light_profiles[light] = fname
+        light.ies_profile = self._acquire(fname)
+
+    def release(self, light):
+        """ Removes the profile from the light, and stops tracking it """
+        if self._light_profiles.pop(light, None) is not None:
+            light.clear_ies_profile()
+
+    def update(self):
+        """ Makes sure all visible lights have their profile resident. This
+        checks the lights against the camera frustum every few frames. """
+        self._frame_index += 1
+        if not self._light_profiles or self._frame_index % self.UPDATE_INTERVAL != 0:
+            return
+
+        bounds = Globals.base.camLens.make_bounds()
+        bounds.xform(Globals.base.cam.get_transform(Globals.render).get_mat())
+        cam_pos = Globals.base.cam.get_pos(Globals.render)
+
+        visible_lights = []
+        for light, fname in iteritems(self._light_profiles):
+            pos = Point3(light.get_pos())
+            radius = light.get_radius() if hasattr(light, "get_radius") else 1e10
+            if bounds.contains(BoundingSphere(pos, radius)):
+                visible_lights.append(((pos - cam_pos).length_squared(), light, fname))
+
+        # Process the closest lights first, so their profiles get loaded in
+        # case not all profiles fit. Profiles acquired in this pass are never
+        # evicted, which would clear them on lights which are still visible.
+        visible_lights.sort(key=lambda entry: entry[0])
+        self._visible_profiles = set()
+        for _, light, fname in visible_lights:
+            layer = self._acquire(fname)
+            if layer >= 0:
+                self._visible_profiles.add(fname)
+            if light.ies_profile != layer:
+                light.ies_profile = layer
+
+    def _acquire(self, fname):
+        """ Returns the layer of the given profile, loading it into a free
+        layer or the layer of the least recently used profile if required.
+        Returns -1 if the profile could not be loaded. """
+        if fname in self._resident:
+            layer = self._resident.pop(fname)
+            self._resident[fname] = layer
+            return layer
+
+        if len(self._resident) < self._max_entries:
+            used_layers = set(self._resident.values())
+            layer = min(i for i in range(self._max_entries) if i not in used_layers)
+        else:
+            layer = self._evict()
+            if layer < 0:
+                if not self._overflow_warned:
+                    self.warn("Visible lights and pinned profiles use more IES profiles",
+                              "than fit into the storage, the lights furthest away are",
+                              "rendered without a profile")
+                    self._overflow_warned = True
+                return -1
+
+        if not self._load_into(fname, layer):
+            return -1
+        self._resident[fname] = layer
+        return layer
+
+    def _evict(self):
+        """ Evicts the least recently used profile which is neither pinned nor
+        used by visible lights, and returns its layer, or -1 if there is no
+        such profile """
+        for fname, layer in iteritems(self._resident):
+            if fname not in self._pinned and fname not in self._visible_profiles:
+                break
+        else:
+            return -1
+
+        self.debug("Evicting", fname, "from layer", layer)
+        del self._resident[fname]
+        for light, light_fname in iteritems(self._light_profiles):
+            if light_fname == fname:
+                light.clear_ies_profile()
+        return layer
+
+    def _get_cache_path(self, fname):
+        """ Returns the path of the cached LUT of the given profile, which
+        depends on its contents and on the format of the storage. The digest
+        of the contents is computed once per profile. """
+        digest = self._digests.get(fname)
+        if digest is None:
+            with open(fname, "rb") as handle:
+                digest = hashlib.sha1(handle.read()).hexdigest()
+            self._digests[fname] = digest
+        tex = self._storage_tex
+        return "{}{}-{}x{}-{}.bin".format(
+            self._cache_dir, digest, tex.get_x_size(), tex.get_y_size(),
+            tex.get_expected_ram_page_size())
+
+    def _load_into(self, fname, layer):
+        """ Stores the LUT of a profile in the given layer, either from the
+        cache or by generating it """
+        tex = self._storage_tex
+        page_size = tex.get_expected_ram_page_size()
+        offset = layer * page_size
+        cache_path = self._get_cache_path(fname) if self._cache_dir is not None else None
+
+        if cache_path is not None and tex.has_ram_image() and isfile(cache_path):
+            with open(cache_path, "rb") as handle:
+                data = handle.read()
+            if len(data) == page_size:
+                if sys.version_info >= (3, 0):
+                    memoryview(tex.modify_ram_image())[offset:offset + page_size] = data
+                else:
+                    tex.modify_ram_image().set_subdata(offset, page_size, data)
+                return True
+
+        if not self._generate_into(fname, layer):
+            return False
+
+        if cache_path is not None and tex.has_ram_image():
+            if sys.version_info >= (3, 0):
+                data = bytes(memoryview(tex.get_ram_image())[offset:offset + page_size])
+            else:
+                data = tex.get_ram_image().get_subdata(offset, page_size)
+            with open(cache_path, "wb") as handle:
+                handle.write(data)
+        return True
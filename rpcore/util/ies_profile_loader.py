@@ -90,6 +90,34 @@ class IESProfileLoader(RPObject):
     def load(self, filename):
         """ Loads a profile from a given filename and returns the internal
         used index which can be assigned to a light."""
+        fname = self._resolve_profile(filename)
+        if fname is None:
+            return -1
+
+        # Check for cache entries
+        if fname in self._entries:
+            return self._entries.index(fname)
+
+        # Check for out of bounds
+        if len(self._entries) >= self._max_entries:
+            # See the IESProfileLibrary for a loader which evicts unused profiles
+            self.warn("Cannot load IES Profile, too many loaded! (Maximum: 32)")
+            return -1
+
+        if not self._generate_into(fname, len(self._entries)):
+            return -1
+        self._entries.append(fname)
+
+        return len(self._entries) - 1
+
+    def update(self):
+        """ Gets called every frame. The loader keeps all profiles resident,
+        so there is nothing to do here """
+        pass
+
+    def _resolve_profile(self, filename):
+        """ Returns the unique full path of a profile, or None if the file
+        could not be found """
 
         # Make sure the user can load profiles directly from the ies profile folder
         data_path = join("/$$rp/data/ies_profiles/", filename)
@@ -101,33 +129,26 @@ class IESProfileLoader(RPObject):
         if not VirtualFileSystem.get_global_ptr().resolve_filename(
                 fname, get_model_path().get_value(), "ies"):
             self.error("Could not resolve", filename)
-            return -1
-        fname = fname.get_fullpath()
-
-        # Check for cache entries
-        if fname in self._entries:
-            return self._entries.index(fname)
+            return None
+        return fname.get_fullpath()
 
-        # Check for out of bounds
-        if len(self._entries) >= self._max_entries:
-            # TODO: Could remove unused profiles here or regenerate texture
-            self.warn("Cannot load IES Profile, too many loaded! (Maximum: 32)")
+    def _generate_into(self, fname, layer):
+        """ Parses the profile at the given path, and generates its LUT into
+        the given layer of the storage. Returns whether this succeeded """
 
         # Try loading the dataset, and see what happes
         try:
             dataset = self._load_and_parse_file(fname)
         except InvalidIESProfileException as msg:
-            self.warn("Failed to load profile from", filename, ":", msg)
-            return -1
+            self.warn("Failed to load profile from", fname, ":", msg)
+            return False
 
         if not dataset:
-            return -1
+            return False
 
         # Dataset was loaded successfully, now copy it
-        dataset.generate_dataset_texture_into(self._storage_tex, len(self._entries))
-        self._entries.append(fname)
-
-        return len(self._entries) - 1
+        dataset.generate_dataset_texture_into(self._storage_tex, layer)
+        return True
 
     def _load_and_parse_file(self, pth):
         """ Loads a .IES file from a given filename, returns an IESDataset
@@ -142,26 +163,35 @@ class IESProfileLoader(RPObject):
             return None
 
         lines = [i.strip() for i in lines]
+        if not lines:
+            raise InvalidIESProfileException("Empty file!")
 
         # Parse version header
-        self._check_version_header(lines.pop(0))
+        self._check_version_header(lines[0])
 
         # Parse arbitrary amount of keywords
-        keywords = self._extract_keywords(lines)  # noqa
+        keywords, line_index = self._extract_keywords(lines, 1)  # noqa
 
         # Next line should be TILT=NONE according to the spec
-        if lines.pop(0) != "TILT=NONE":
+        if line_index >= len(lines) or lines[line_index] != "TILT=NONE":
             raise InvalidIESProfileException("Expected TILT=NONE line, but none found!")
 
         # From now on, lines do not matter anymore, instead everything is
-        # space seperated
-        new_parts = (' '.join(lines)).replace(",", " ").split()
+        # space seperated. Consume the parts with an iterator, to keep the
+        # parsing linear in the file size
+        new_parts = iter((' '.join(lines[line_index + 1:])).replace(",", " ").split())
+
+        def read_part():
+            try:
+                return next(new_parts)
+            except StopIteration:
+                raise InvalidIESProfileException("Unexpected end of file!")
 
         def read_int():
-            return int(new_parts.pop(0))
+            return int(read_part())
 
         def read_float():
-            return float(new_parts.pop(0))
+            return float(read_part())
 
         # Amount of Lamps
         if read_int() != 1:
@@ -205,6 +235,7 @@ class IESProfileLoader(RPObject):
         # Rescale values, divide by maximum
         candela_values = [i / candela_scale for i in candela_values]
 
+        new_parts = list(new_parts)
         if len(new_parts) != 0:
             self.warn("Unhandled data at file-end left:", new_parts)
 
@@ -239,23 +270,23 @@ class IESProfileLoader(RPObject):
         if first_line not in self.PROFILES:
             raise InvalidIESProfileException("Unsupported Profile: " + first_line)
 
-    def _extract_keywords(self, lines):
-        """ Extracts the keywords from a list of lines, and removes all lines
-        containing keywords """
+    def _extract_keywords(self, lines, line_index):
+        """ Extracts the keywords from a list of lines, starting at the given
+        index. Returns the keywords and the index of the first line after
+        the keywords """
         keywords = {}
-        while lines:
-            line = lines.pop(0)
+        while line_index < len(lines):
+            line = lines[line_index]
             if not line.startswith("["):
 
                 # Special format used by some IES files, indicates end of properties
                 # By just checking for the tilt keyword instead of validating each line,
                 # we can read even malformed lines, like those from ERCO Leuchten GmbH
                 if line != "TILT=NONE":
+                    line_index += 1
                     continue
 
-                # No keyword, we popped the line already tho, so append it again
-                lines.insert(0, line)
-                return keywords
+                return keywords, line_index
             else:
 
                 # Try matching the keywords
@@ -265,5 +296,6 @@ class IESProfileLoader(RPObject):
                     keywords[key.strip()] = val.strip()
                 else:
                     raise InvalidIESProfileException("Invalid keyword line: " + line)
+                line_index += 1
 
-        return keywords
+        return keywords, line_index
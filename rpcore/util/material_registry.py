@@ -0,0 +1,133 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from panda3d.core import Vec4, RenderState
+
+from rpcore.globals import Globals
+from rpcore.rpobject import RPObject
+
+
+class MaterialRegistry(RPObject):
+
+    """ Keeps an index of all materials in the scene, keyed by their serialized
+    name and their id, which is used by the material editor. The index is built
+    with a single scene traversal, and rebuilt when a material can not be
+    found, e.g. because a new model was loaded.
+
+    Each material is serialized as one line of 11 space separated values: The
+    serialized name ("<id>-<name>"), the base color, roughness, specular ior,
+    metallic and the four emission components, which store the shading model
+    and its parameters. """
+
+    def __init__(self):
+        """ Constructs a new registry """
+        RPObject.__init__(self)
+        self._materials = []
+        self._by_name = {}
+
+    def rebuild(self):
+        """ Rebuilds the index from the current scene """
+        self._materials = list(Globals.render.find_all_materials())
+        self._by_name = {}
+        for material_id, material in enumerate(self._materials):
+            self._by_name[self.get_serialized_name(material, material_id)] = material
+
+    def get_serialized_name(self, material, material_id):
+        """ Returns a serializable name of a material """
+        return str(material_id) + "-" + (material.get_name().replace(" ", "").strip() or "unnamed")
+
+    def find(self, key):
+        """ Returns the material with the given serialized name or id, or None
+        if there is no such material. Rebuilds the index once if the material is
+        not found. """
+        for attempt in range(2):
+            material = self._by_name.get(key)
+            if material is None and str(key).isdigit() and int(key) < len(self._materials):
+                material = self._materials[int(key)]
+            if material is not None or attempt == 1:
+                return material
+            self.rebuild()
+
+    def serialize(self):
+        """ Returns the serialized lines of all pbr materials. The values are
+        formatted with six significant digits, which is below the precision
+        the editor displays. """
+        lines = []
+        for material_id, material in enumerate(self._materials):
+            if (not material.has_base_color() or not material.has_roughness() or
+                    not material.has_refractive_index()):
+                self.debug("Skipping non-pbr material:", material.name)
+                continue
+            values = (
+                material.base_color.x,
+                material.base_color.y,
+                material.base_color.z,
+                material.roughness,
+                material.refractive_index,
+                material.metallic,
+                material.emission.x,  # shading model
+                material.emission.y,  # normal strength
+                material.emission.z,  # arbitrary 0
+                material.emission.w,  # arbitrary 1
+            )
+            lines.append(self.get_serialized_name(material, material_id) + " " +
+                         " ".join("{:.6g}".format(value) for value in values))
+        return lines
+
+    def export(self, path):
+        """ Rebuilds the index and writes all serialized materials to a file """
+        self.rebuild()
+        with open(path, "w") as handle:
+            handle.write("\n".join(self.serialize()) + "\n")
+
+    def update(self, entries):
+        """ Updates materials from a list of serialized materials, each given
+        as list of its 11 values. The render state cache only gets cleared once.
+        Returns the amount of updated materials. """
+        num_updated = 0
+        for data in entries:
+            if len(data) != 11:
+                self.warn("Invalid serialized material:", " ".join(data))
+                continue
+            material = self.find(data[0])
+            if material is None:
+                self.warn("Material not found:", data[0])
+                continue
+            material.set_base_color(Vec4(float(data[1]), float(data[2]), float(data[3]), 1.0))
+            material.set_roughness(float(data[4]))
+            material.set_refractive_index(float(data[5]))
+            material.set_metallic(float(data[6]))
+            material.set_emission(Vec4(
+                float(data[7]),
+                float(data[8]),
+                float(data[9]),
+                float(data[10]),
+            ))
+            num_updated += 1
+
+        if num_updated:
+            RenderState.clear_cache()
+        return num_updated
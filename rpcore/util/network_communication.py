@@ -24,25 +24,253 @@ THE SOFTWARE.
 
 """
 
+import time
 import socket
-from threading import Thread
+import struct
+import random
+from threading import Thread, Lock
+from collections import OrderedDict
 
 from rpcore.rpobject import RPObject
 
 
+class CommandQueue(object):
+
+    """ Thread safe queue of received commands. Each command has a key, and a
+    newer command replaces a queued command with the same key (last write
+    wins), e.g. when a slider gets dragged only the last value is kept. The
+    queue is bounded, if it is full the oldest command gets dropped. Malformed
+    datagrams get dropped as well. Also keeps statistics about the received,
+    coalesced, dropped and lost commands. """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._last_sequences = {}
+        self.num_received = 0
+        self.num_coalesced = 0
+        self.num_dropped = 0
+        self.num_stale = 0
+        self.num_lost_datagrams = 0
+
+    def receive(self, data):
+        """ Decodes a datagram and queues its commands """
+        try:
+            sender, sequence, entries = NetworkCommunication.decode_datagram(data)
+        except (struct.error, UnicodeDecodeError, ValueError):
+            with self._lock:
+                self.num_dropped += 1
+            return
+        with self._lock:
+            if sender is not None:
+                last_sequence = self._last_sequences.get(sender)
+                if last_sequence is not None:
+                    # Sequence numbers wrap around, so compare the distance
+                    delta = (sequence - last_sequence) & 0xFFFFFFFF
+                    if delta == 0 or delta >= 0x80000000:
+                        # Older than an already applied datagram, applying it
+                        # would revert newer values
+                        self.num_stale += len(entries)
+                        return
+                    self.num_lost_datagrams += delta - 1
+                self._last_sequences[sender] = sequence
+            for key, command in entries:
+                self._put(key, command)
+
+    def put(self, key, command):
+        """ Queues a command with the given key """
+        with self._lock:
+            self._put(key, command)
+
+    def _put(self, key, command):
+        """ Internal method to queue a command, the lock has to be held """
+        self.num_received += 1
+        if key in self._entries:
+            del self._entries[key]
+            self.num_coalesced += 1
+        elif len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+            self.num_dropped += 1
+        self._entries[key] = command
+
+    def pop_all(self):
+        """ Removes and returns all queued commands, in the order in which
+        they were last written """
+        with self._lock:
+            commands = list(self._entries.values())
+            self._entries.clear()
+        return commands
+
+
+class CommandBatcher(object):
+
+    """ Collects commands for a port and sends them in batches from a
+    background thread. Commands with the same key replace each other until
+    they get sent. This is meant for tools which send commands at a high rate,
+    like editors sending updates while a slider gets dragged. """
+
+    def __init__(self, port, interval=0.02, max_pending=1024):
+        self._port = port
+        self._interval = interval
+        self._max_pending = max_pending
+        self._pending = OrderedDict()
+        self._lock = Lock()
+        self._thread = Thread(target=self._send_forever, name="NC-CommandBatcher")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def send(self, command):
+        """ Queues a command, which gets sent with the next batch """
+        key = NetworkCommunication.get_command_key(command)
+        with self._lock:
+            self._pending.pop(key, None)
+            if len(self._pending) >= self._max_pending:
+                self._pending.popitem(last=False)
+            self._pending[key] = command
+
+    def flush(self):
+        """ Sends all queued commands immediately """
+        with self._lock:
+            commands = list(self._pending.values())
+            self._pending.clear()
+        if commands:
+            NetworkCommunication.send_batch(self._port, commands)
+
+    def _send_forever(self):
+        """ Internal method which periodically sends the queued commands """
+        while True:
+            time.sleep(self._interval)
+            self.flush()
+
+
 class NetworkCommunication(RPObject):
 
     """ Listener which accepts messages on several ports to detect incoming updates.
-    Also provides functionality to send updates. """
+    Also provides functionality to send updates.
+
+    Commands are sent as framed datagrams: A header with the protocol magic,
+    version, entry count, a random sender id and a per port sequence number,
+    followed by the entries, each consisting of the key and the command.
+    Several commands can be batched into one datagram, and the sequence number
+    is used to detect lost and outdated datagrams. Plain text datagrams of
+    older tools are still accepted as a single command. """
 
     CONFIG_PORT = 63324
     DAYTIME_PORT = 63325
     MATERIAL_PORT = 63326
 
+    PROTOCOL_MAGIC = b"RPNC"
+    PROTOCOL_VERSION = 1
+    HEADER = struct.Struct("<4sBBHII")
+    ENTRY_HEADER = struct.Struct("<HH")
+
+    # Maximum payload of an UDP datagram
+    MAX_DATAGRAM_SIZE = 65507
+
+    # Maximum amount of queued commands per port
+    MAX_QUEUE_SIZE = 1024
+
+    # Requested size of the socket receive buffer of the listeners
+    RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+    SENDER_ID = random.randint(0, 2**32 - 1)
+    _sequences = {}
+    _send_lock = Lock()
+
+    @staticmethod
+    def get_command_key(command):
+        """ Returns the key of a command. Commands with the same key overwrite
+        each other, e.g. all updates of the same setting or material. """
+        parts = command.split(None, 2)
+        if not parts:
+            return command
+        if parts[0] in ("setval", "update_material") and len(parts) > 1:
+            return parts[0] + " " + parts[1]
+        if parts[0] == "settime":
+            return parts[0]
+        return command
+
+    @classmethod
+    def _next_sequence(cls, port):
+        """ Internal method to get the next sequence number for a port """
+        sequence = (cls._sequences.get(port, 0) + 1) & 0xFFFFFFFF
+        cls._sequences[port] = sequence
+        return sequence
+
+    @classmethod
+    def encode_batch(cls, port, commands):
+        """ Encodes a list of commands into as few datagrams as possible.
+        Commands with the same key are coalesced, keeping the last one. This
+        consumes sequence numbers of the port, use send_batch to send them. """
+        entries = OrderedDict()
+        for command in commands:
+            key = cls.get_command_key(command)
+            entries.pop(key, None)
+            entries[key] = command
+
+        datagrams, current, size = [], [], cls.HEADER.size
+        for key, command in entries.items():
+            key_bytes, command_bytes = key.encode("utf-8"), command.encode("utf-8")
+            entry = (cls.ENTRY_HEADER.pack(len(key_bytes), len(command_bytes)) +
+                     key_bytes + command_bytes)
+            if current and (size + len(entry) > cls.MAX_DATAGRAM_SIZE or len(current) >= 65535):
+                datagrams.append(current)
+                current, size = [], cls.HEADER.size
+            current.append(entry)
+            size += len(entry)
+        if current:
+            datagrams.append(current)
+
+        return [cls.HEADER.pack(cls.PROTOCOL_MAGIC, cls.PROTOCOL_VERSION, 0, len(batch),
+                                cls.SENDER_ID, cls._next_sequence(port)) + b"".join(batch)
+                for batch in datagrams]
+
+    @classmethod
+    def decode_datagram(cls, data):
+        """ Decodes a datagram, returns the sender id, the sequence number and
+        the list of (key, command) entries. Sender id and sequence number are
+        None for plain text datagrams. Raises struct.error, UnicodeDecodeError
+        or ValueError if the datagram is malformed. """
+        if not data.startswith(cls.PROTOCOL_MAGIC):
+            command = data.decode("utf-8")
+            return None, None, [(cls.get_command_key(command), command)]
+
+        _, version, _, count, sender, sequence = cls.HEADER.unpack_from(data)
+        if version != cls.PROTOCOL_VERSION:
+            RPObject.global_warn("NetworkCommunication", "Unsupported protocol version", version)
+            return None, None, []
+
+        entries, offset = [], cls.HEADER.size
+        for _ in range(count):
+            key_len, command_len = cls.ENTRY_HEADER.unpack_from(data, offset)
+            offset += cls.ENTRY_HEADER.size
+            if offset + key_len + command_len > len(data):
+                raise ValueError("Entry exceeds the datagram")
+            key = data[offset:offset + key_len].decode("utf-8")
+            offset += key_len
+            command = data[offset:offset + command_len].decode("utf-8")
+            offset += command_len
+            entries.append((key, command))
+        return sender, sequence, entries
+
+    @classmethod
+    def send_batch(cls, port, commands):
+        """ Sends a list of commands to a port, batched into as few datagrams
+        as possible. Encoding and sending happens under a lock, so datagrams
+        are sent in the order of their sequence numbers. """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            with cls._send_lock:
+                for datagram in cls.encode_batch(port, commands):
+                    sock.sendto(datagram, ("127.0.0.1", port))
+        finally:
+            sock.close()
+
     @classmethod
     def send_async(cls, port, message):
         """ Starts a new thread which sends a given message to a port """
-        thread = Thread(target=cls.__send_message_async, args=(port, message),
+        thread = Thread(target=cls.send_batch, args=(port, [message]),
                         name="NC-SendAsync")
         thread.setDaemon(True)
         thread.start()
@@ -50,34 +278,32 @@ class NetworkCommunication(RPObject):
 
     @classmethod
     def listen_threaded(cls, port, callback):
-        """ Starts a new thread listening to the given port """
+        """ Starts a new thread listening to the given port, callback gets
+        called with each received datagram """
         thread = Thread(target=cls.__listen_forever, args=(port, callback),
                         name="NC-ListenForever")
         thread.setDaemon(True)
         thread.start()
         return thread
 
-    @staticmethod
-    def __send_message_async(port, message=""):
-        """ Sends a given message to a given port and immediately returns. """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            sock.sendto(message.encode("utf-8"), ("127.0.0.1", port))
-        finally:
-            sock.close()
-
-    @staticmethod
-    def __listen_forever(port, callback):
+    @classmethod
+    def __listen_forever(cls, port, callback):
         """ Listens to a given port, and calls callback in case a message
         arrives. This method never returns, except when the connection closed or
         could not be established. """
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            # A larger receive buffer avoids losing datagrams when a tool
+            # sends a burst of updates. The os might limit the size.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, cls.RECEIVE_BUFFER_SIZE)
+        except socket.error:
+            pass
         try:
             sock.bind(("127.0.0.1", port))
             while True:
-                data, addr = sock.recvfrom(1024)  # pylint: disable=unused-variable
-                callback(data.decode("utf-8"))
+                data, addr = sock.recvfrom(cls.MAX_DATAGRAM_SIZE)  # pylint: disable=unused-variable
+                callback(data)
         finally:
             sock.close()
 
@@ -86,29 +312,33 @@ class NetworkCommunication(RPObject):
         ports for updates """
         RPObject.__init__(self)
         self._pipeline = pipeline
-        self._config_updates = set()
-        self._daytime_updates = set()
-        self._material_updates = set()
+        self.config_queue = CommandQueue(self.MAX_QUEUE_SIZE)
+        self.daytime_queue = CommandQueue(self.MAX_QUEUE_SIZE)
+        self.material_queue = CommandQueue(self.MAX_QUEUE_SIZE)
         self._config_thread = self.listen_threaded(
-            self.CONFIG_PORT, self._config_updates.add)
+            self.CONFIG_PORT, self.config_queue.receive)
         self._daytime_thread = self.listen_threaded(
-            self.DAYTIME_PORT, self._daytime_updates.add)
+            self.DAYTIME_PORT, self.daytime_queue.receive)
         self._material_thread = self.listen_threaded(
-            self.MATERIAL_PORT, self._material_updates.add)
-
+            self.MATERIAL_PORT, self.material_queue.receive)
 
     def update(self):
         """ Update task which gets called every frame and executes the changes.
-        This takes the incoming scheduled commands and processes one at a time."""
-        while self._config_updates:
-            cmd = self._config_updates.pop()
+        This takes the incoming scheduled commands and processes them in the
+        order they were sent. Multiple material updates get applied in one pass. """
+        for cmd in self.config_queue.pop_all():
             self._handle_config_command(cmd)
-        while self._daytime_updates:
-            cmd = self._daytime_updates.pop()
+        for cmd in self.daytime_queue.pop_all():
             self._handle_daytime_command(cmd)
-        while self._material_updates:
-            cmd = self._material_updates.pop()
-            self._handle_material_command(cmd)
+
+        material_updates = []
+        for cmd in self.material_queue.pop_all():
+            if cmd.startswith("update_material "):
+                material_updates.append(cmd[len("update_material "):].split())
+            else:
+                self._handle_material_command(cmd)
+        if material_updates:
+            self._pipeline.update_serialized_materials(material_updates)
 
     def _handle_daytime_command(self, cmd):
         """ Handles a daytime command. This could either be a command to set
@@ -140,8 +370,13 @@ class NetworkCommunication(RPObject):
             self.debug("Writing materials to", path)
             self._pipeline.export_materials(path)
 
+        elif cmd.startswith("update_materials"):
+            # Multiple serialized materials, separated by a semicolon
+            data = cmd[len("update_materials "):].strip()
+            entries = [entry.split() for entry in data.split(";") if entry.strip()]
+            self._pipeline.update_serialized_materials(entries)
+
         elif cmd.startswith("update_material"):
-            
             data = cmd[len("update_material "):].strip()
             parts = data.split()
             self._pipeline.update_serialized_material(parts)
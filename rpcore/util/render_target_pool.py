@@ -0,0 +1,169 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from __future__ import division
+
+import heapq
+
+from rplibs.six import iteritems, itervalues
+
+from rpcore.rpobject import RPObject
+
+
+class RenderTargetPool(RPObject):
+
+    """ Computes the lifetime of the render target attachments within a frame,
+    based on the pipe graph of the stage manager, and lets attachments with
+    the same format and disjoint lifetimes share one allocation.
+
+    The lifetime of an attachment starts at the stage producing it as a pipe,
+    and ends at the last stage which had the pipe bound. Attachments which
+    are not exposed as pipes, which are used from the previous or next frame,
+    or whose stage keeps its results over multiple frames are never shared. """
+
+    def __init__(self):
+        """ Constructs a new pool """
+        RPObject.__init__(self)
+        self._formats = {}
+        self._owners = {}
+        self._lifetimes = {}
+        self._bindings = {}
+        self._pinned = set()
+        self._aliases = {}
+
+    def register_stage(self, index, stage):
+        """ Registers all attachments of the targets of a stage, and the pipes
+        the stage produced. Has to be called after the stage was created. """
+        attachments = {}
+        for target in itervalues(stage.targets):
+            if not target.internal_buffer:
+                continue
+            for tex, tex_format in target.get_attachment_formats():
+                attachments[tex] = target
+                self._formats[tex] = tex_format
+
+        for pipe_data in itervalues(stage.produced_pipes):
+            tex = self._get_texture(pipe_data)
+            if tex in attachments and tex not in self._lifetimes:
+                self._owners[tex] = attachments[tex]
+                self._lifetimes[tex] = [index, index]
+                if not stage.allow_target_aliasing:
+                    self._pinned.add(tex)
+
+        # Attachments which are also exposed as regular inputs can be accessed
+        # at any time
+        for input_data in itervalues(stage.produced_inputs):
+            tex = self._get_texture(input_data)
+            for attachment in attachments:
+                if attachment is tex:
+                    self._pinned.add(attachment)
+
+    def add_use(self, index, stage, pipe_name, pipe_data):
+        """ Registers that a stage reads the given pipe """
+        tex = self._get_texture(pipe_data)
+        if tex in self._lifetimes:
+            self._lifetimes[tex][1] = max(self._lifetimes[tex][1], index)
+            self._bindings.setdefault(tex, []).append((stage, pipe_name, pipe_data))
+
+    def pin(self, pipe_data):
+        """ Prevents the texture of a pipe from sharing its memory, this is
+        used for textures which get accessed outside of the pipe graph """
+        self._pinned.add(self._get_texture(pipe_data))
+
+    def _get_texture(self, pipe_data):
+        """ Internal method to extract the texture of a pipe, which might also
+        be stored with a sampler state """
+        if isinstance(pipe_data, (list, tuple)):
+            return pipe_data[0]
+        return pipe_data
+
+    def compute_aliases(self):
+        """ Assigns all attachments to allocations. For each format, the
+        attachments are sorted by the start of their lifetime, and each one
+        takes over the allocation which got free the earliest, if any.
+        Returns a dictionary mapping each shared attachment to the attachment
+        which owns the allocation. """
+        by_format = {}
+        for tex, (first, last) in iteritems(self._lifetimes):
+            if tex not in self._pinned:
+                by_format.setdefault(self._formats[tex], []).append((first, last, tex))
+
+        self._aliases = {}
+        for candidates in itervalues(by_format):
+            candidates.sort(key=lambda entry: entry[:2])
+            free_at = []
+            for counter, (first, last, tex) in enumerate(candidates):
+                if free_at and free_at[0][0] < first:
+                    _, _, owner = heapq.heappop(free_at)
+                    self._aliases[tex] = owner
+                else:
+                    owner = tex
+                heapq.heappush(free_at, (last, counter, owner))
+        return self._aliases
+
+    def apply_aliases(self, pipes):
+        """ Makes all shared attachments use the memory of their owner. The
+        producing targets render into the owners texture, and all stages which
+        had the attachment bound as pipe get the owners texture instead. The
+        given pipe dictionary of the stage manager gets updated too. """
+        for tex, owner in iteritems(self._aliases):
+            self._owners[tex].replace_texture(tex, owner)
+            for stage, pipe_name, pipe_data in self._bindings.get(tex, []):
+                if isinstance(pipe_data, (list, tuple)):
+                    stage.set_shader_input(pipe_name, owner, *pipe_data[1:])
+                else:
+                    stage.set_shader_input(pipe_name, owner)
+            for pipe_name, pipe_data in list(iteritems(pipes)):
+                if self._get_texture(pipe_data) is tex:
+                    if isinstance(pipe_data, (list, tuple)):
+                        pipes[pipe_name] = (owner,) + tuple(pipe_data[1:])
+                    else:
+                        pipes[pipe_name] = owner
+
+    def get_bytes_per_pixel(self, tex_format):
+        """ Returns the approximate amount of bytes per pixel of a format """
+        kind, bits = tex_format[:2]
+        if kind == "color":
+            return max(1, sum(bits) // 8)
+        if kind == "depth":
+            return 4 if bits > 16 else 2
+        return 4 * bits // 8
+
+    def get_report(self):
+        """ Returns a dictionary mapping each resolution to a tuple of the
+        amount of attachments, the amount of allocations, the bytes which
+        would be used without sharing and the bytes which are saved """
+        report = {}
+        for tex in self._lifetimes:
+            tex_format = self._formats[tex]
+            resolution = tex_format[-2:]
+            size = resolution[0] * resolution[1] * self.get_bytes_per_pixel(tex_format)
+            count, allocations, total, saved = report.get(resolution, (0, 0, 0, 0))
+            if tex in self._aliases:
+                report[resolution] = (count + 1, allocations, total + size, saved + size)
+            else:
+                report[resolution] = (count + 1, allocations + 1, total + size, saved)
+        return report
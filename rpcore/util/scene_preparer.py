@@ -0,0 +1,235 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from __future__ import division
+
+import math
+import time
+
+from panda3d.core import PointLight as PandaPointLight, Spotlight as PandaSpotlight
+from panda3d.core import GeomNode, GeomTristrips, MaterialAttrib
+
+from rplibs.six.moves import range  # pylint: disable=import-error
+
+from rpcore.globals import Globals
+from rpcore.rpobject import RPObject
+from rpcore.native import PointLight, SpotLight
+
+
+class ScenePreparer(RPObject):
+
+    """ Prepares scenes for the pipeline in a single traversal, see
+    RenderPipeline.prepare_scene. Prepared GeomNodes get tagged with their
+    amount of geoms, so preparing a scene again (e.g. when streaming in a new
+    chunk below an existing root) only processes new or changed geometry. """
+
+    # Tag which is set on all prepared GeomNodes
+    PREPARED_TAG = "RP_PREPARED"
+
+    def __init__(self, pipeline):
+        """ Constructs a new scene preparer """
+        RPObject.__init__(self)
+        self._pipeline = pipeline
+        self._tristrips_warning_emitted = False
+
+    def prepare(self, scene):
+        """ Prepares the given scene, returns a dictionary with the created
+        lights, environment probes and transparent objects, as well as a report
+        with the amount of processed objects and the time spent per phase in
+        milliseconds. """
+        report = {
+            "nodes_visited": 0,
+            "geom_nodes": 0,
+            "geom_nodes_skipped": 0,
+            "geoms": 0,
+            "geom_nodes_decomposed": 0,
+            "geoms_without_material": 0,
+            "point_lights": 0,
+            "spot_lights": 0,
+            "envprobes": 0,
+            "transparent_objects": 0,
+            "timings": {},
+        }
+        timings = report["timings"]
+
+        start = time.time()
+        point_lights, spot_lights, probe_nps, geom_nps = self._collect(scene, report)
+        timings["traverse"] = (time.time() - start) * 1000.0
+
+        start = time.time()
+        lights = [self._convert_point_light(light_np) for light_np in point_lights]
+        lights += [self._convert_spot_light(light_np) for light_np in spot_lights]
+        report["point_lights"] = len(point_lights)
+        report["spot_lights"] = len(spot_lights)
+        timings["lights"] = (time.time() - start) * 1000.0
+
+        start = time.time()
+        envprobes = [self._convert_envprobe(probe_np) for probe_np in probe_nps]
+        report["envprobes"] = len(envprobes)
+        timings["envprobes"] = (time.time() - start) * 1000.0
+
+        start = time.time()
+        report["geom_nodes_decomposed"] = self._decompose_tristrips(geom_nps)
+        timings["decompose"] = (time.time() - start) * 1000.0
+
+        start = time.time()
+        transparent_objects = self._apply_materials(geom_nps, report)
+        report["transparent_objects"] = len(transparent_objects)
+        timings["materials"] = (time.time() - start) * 1000.0
+
+        return {"lights": lights, "envprobes": envprobes,
+                "transparent_objects": transparent_objects, "report": report}
+
+    def _collect(self, scene, report):
+        """ Internal method to traverse the scene once, and collect all lights,
+        probe markers and unprepared GeomNodes. Lights and probes are removed
+        later on, so their children are not visited. """
+        point_lights, spot_lights, probe_nps, geom_nps = [], [], [], []
+        point_light_type = PandaPointLight.get_class_type()
+        spot_light_type = PandaSpotlight.get_class_type()
+        geom_node_type = GeomNode.get_class_type()
+
+        stack = [scene]
+        while stack:
+            node_path = stack.pop()
+            node = node_path.node()
+            report["nodes_visited"] += 1
+
+            if node.is_of_type(point_light_type):
+                point_lights.append(node_path)
+                continue
+            if node.is_of_type(spot_light_type):
+                spot_lights.append(node_path)
+                continue
+            if node.get_name().startswith("ENVPROBE"):
+                probe_nps.append(node_path)
+                continue
+
+            if node.is_of_type(geom_node_type):
+                report["geom_nodes"] += 1
+                if node.get_tag(self.PREPARED_TAG) == str(node.get_num_geoms()):
+                    report["geom_nodes_skipped"] += 1
+                else:
+                    geom_nps.append(node_path)
+                    report["geoms"] += node.get_num_geoms()
+
+            stack.extend(node_path.get_children())
+        return point_lights, spot_lights, probe_nps, geom_nps
+
+    def _convert_point_light(self, light_np):
+        """ Internal method to replace a panda point light by a pipeline light """
+        light_node = light_np.node()
+        rp_light = PointLight()
+        rp_light.pos = light_np.get_pos(Globals.base.render)
+        rp_light.radius = light_node.max_distance
+        rp_light.energy = 20.0 * light_node.color.w
+        rp_light.color = light_node.color.xyz
+        rp_light.casts_shadows = light_node.shadow_caster
+        rp_light.shadow_map_resolution = light_node.shadow_buffer_size.x
+        rp_light.inner_radius = 0.4
+        self._pipeline.add_light(rp_light)
+        light_np.remove_node()
+        return rp_light
+
+    def _convert_spot_light(self, light_np):
+        """ Internal method to replace a panda spot light by a pipeline light """
+        light_node = light_np.node()
+        rp_light = SpotLight()
+        rp_light.pos = light_np.get_pos(Globals.base.render)
+        rp_light.radius = light_node.max_distance
+        rp_light.energy = 20.0 * light_node.color.w
+        rp_light.color = light_node.color.xyz
+        rp_light.casts_shadows = light_node.shadow_caster
+        rp_light.shadow_map_resolution = light_node.shadow_buffer_size.x
+        rp_light.fov = light_node.exponent / math.pi * 180.0
+        rp_light.direction = light_np.get_mat(Globals.base.render).xform_vec((0, 0, -1))
+        self._pipeline.add_light(rp_light)
+        light_np.remove_node()
+        return rp_light
+
+    def _convert_envprobe(self, probe_np):
+        """ Internal method to replace a probe marker by an environment probe """
+        probe = self._pipeline.add_environment_probe()
+        probe.set_mat(probe_np.get_mat())
+        probe.border_smoothness = 0.0001
+        probe.parallax_correction = True
+        probe_np.remove_node()
+        return probe
+
+    def _decompose_tristrips(self, geom_nps):
+        """ Internal method to convert tristrips to triangles, due to a NVIDIA
+        driver bug. GeomNodes containing tristrips get decomposed as a whole.
+        Returns the amount of decomposed GeomNodes. """
+        num_decomposed = 0
+        for geom_np in geom_nps:
+            geom_node = geom_np.node()
+            has_tristrips = any(
+                isinstance(prim, GeomTristrips)
+                for geom in geom_node.get_geoms() for prim in geom.get_primitives())
+            if not has_tristrips:
+                continue
+            if not self._tristrips_warning_emitted:
+                self.warn("At least one GeomNode (", geom_node.get_name(),
+                          "and possible more..) contains tristrips.")
+                self.warn("Due to a NVIDIA Driver bug, we have to convert them to triangles now.")
+                self.warn("Consider exporting your models with the Bam Exporter to avoid this.")
+                self._tristrips_warning_emitted = True
+            geom_node.decompose()
+            num_decomposed += 1
+        return num_decomposed
+
+    def _apply_materials(self, geom_nps, report):
+        """ Internal method to check the materials of all geoms, setting the
+        forward effect on transparent ones. Tags the GeomNodes as prepared.
+        Returns the list of transparent objects. """
+        transparent_objects = []
+        for geom_np in geom_nps:
+            geom_node = geom_np.node()
+            geom_count = geom_node.get_num_geoms()
+            geom_node.set_tag(self.PREPARED_TAG, str(geom_count))
+            for i in range(geom_count):
+                state = geom_node.get_geom_state(i)
+                if not state.has_attrib(MaterialAttrib):
+                    self.warn("Geom", geom_node, "has no material! Please fix this.")
+                    report["geoms_without_material"] += 1
+                    continue
+
+                material = state.get_attrib(MaterialAttrib).get_material()
+                shading_model = material.emission.x
+
+                # SHADING_MODEL_TRANSPARENT
+                if shading_model == 3:
+                    if geom_count > 1:
+                        self.error("Transparent materials must be on their own geom!\n"
+                                   "If you are exporting from blender, split them into\n"
+                                   "seperate meshes, then re-export your scene. The\n"
+                                   "problematic mesh is: " + geom_np.get_name())
+                        continue
+                    self._pipeline.set_effect(
+                        geom_np, "effects/default.yaml",
+                        {"render_forward": True, "render_gbuffer": False}, 100)
+                    transparent_objects.append(geom_np)
+        return transparent_objects
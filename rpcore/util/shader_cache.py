@@ -0,0 +1,356 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+import re
+import json
+import time
+import hashlib
+
+from multiprocessing.pool import ThreadPool
+
+from rplibs.six import iteritems, itervalues
+
+from panda3d.core import Filename, VirtualFileSystem, Shader, get_model_path
+from direct.stdpy.file import open, isfile
+
+from rpcore.rpobject import RPObject
+
+__all__ = ("ShaderCache",)
+
+
+class ShaderCache(RPObject):
+
+    """ Cache for shader programs, which optionally persists across runs when
+    a cache directory is passed. Each shader is stored in its preprocessed
+    form, with all includes inlined, together with a manifest storing the
+    digests of all files it was built from.
+
+    Panda3D does not expose the linked program binaries, so the cache
+    cannot skip the final compile step. However, a warm start skips reading
+    and expanding all includes, and since the generated sources are byte
+    for byte identical across runs, the drivers own shader cache can pick
+    them up. Shaders which could not be preprocessed are loaded the regular
+    way, so that errors are reported with the proper filenames.
+
+    Loaded shaders are kept until one of their files changes. For the file
+    containing the defines, only shaders actually referencing one of the
+    changed defines are dropped, see invalidate_defines(). All other
+    shaders keep their shader object, so panda does not recompile them. """
+
+    INCLUDE_RE = re.compile(r'^\s*#pragma\s+include\s+["<]([^">]+)[">]')
+    ONCE_RE = re.compile(r"^\s*#pragma\s+once\b")
+    IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+    def __init__(self, cache_dir=None):
+        RPObject.__init__(self)
+        self._cache_dir = cache_dir.rstrip("/") + "/" if cache_dir else None
+        self._vfs = VirtualFileSystem.get_global_ptr()
+        self._file_hashes = {}
+        self._file_identifiers = {}
+        self._shaders = {}
+        self.num_hits = 0
+        self.num_misses = 0
+        if self._cache_dir is not None:
+            self._vfs.make_directory_full(self._cache_dir)
+
+    def invalidate(self, filename=None):
+        """ Re-reads the digest of the given file, or of all files if no file
+        is passed, and drops all shaders built from a file which changed.
+        This has to be called whenever a shader file might have changed.
+        Returns the set of keys of all dropped shaders. """
+        if filename is None:
+            self._file_hashes = {}
+            self._file_identifiers = {}
+        else:
+            filename = self._resolve(filename) or filename
+            self._file_hashes.pop(filename, None)
+            self._file_identifiers.pop(filename, None)
+
+        dropped = set()
+        for key, (_, deps) in list(iteritems(self._shaders)):
+            for dep, digest in deps:
+                if (filename is None or dep == filename) and self._get_file_hash(dep) != digest:
+                    dropped.add(key)
+                    del self._shaders[key]
+                    break
+        return dropped
+
+    def invalidate_defines(self, filename, changed_defines):
+        """ Like invalidate(), but for a file containing only defines. Instead
+        of dropping all shaders built from it, only those shaders referencing
+        one of the changed defines in any of their other files are dropped.
+        Returns the set of keys of all dropped shaders. """
+        filename = self._resolve(filename) or filename
+        self._file_hashes.pop(filename, None)
+        new_digest = self._get_file_hash(filename)
+        changed_defines = set(changed_defines)
+
+        dropped = set()
+        for key, (shader, deps) in list(iteritems(self._shaders)):
+            if not any(dep == filename and digest != new_digest for dep, digest in deps):
+                continue
+            identifiers = set()
+            for dep, _ in deps:
+                if dep != filename:
+                    identifiers |= self._get_file_identifiers(dep)
+            if identifiers & changed_defines:
+                dropped.add(key)
+                del self._shaders[key]
+            else:
+                # The shader does not use any of the changed defines, so its
+                # old source is still equivalent
+                deps = [(dep, new_digest if dep == filename else digest) for dep, digest in deps]
+                self._shaders[key] = (shader, deps)
+        return dropped
+
+    def load(self, *args):
+        """ Returns the shader built from the given sources, which is one
+        compute shader or vertex, fragment and optionally geometry shader.
+        Returns None if the shader could not be preprocessed. """
+        key = self.get_key(args)
+        if key not in self._shaders:
+            sources, deps, _ = self._prepare(key, args)
+            if sources is None:
+                return None
+            self._shaders[key] = (self._make_shader(sources), deps)
+        return self._shaders[key][0]
+
+    def preload(self, requests, num_threads, gsg=None):
+        """ Preprocesses the given list of shader requests on a pool of
+        threads, so that the following load() calls do not have to touch any
+        files. The resulting shaders are prepared on the gsg in one batch if
+        one is passed. Returns a dictionary mapping the owner of each request,
+        which is the plugin id or render_pipeline_internal, to a tuple of
+        the amount of shaders, the serial preprocessing time and the time
+        saved by preprocessing them in parallel, both in milliseconds. """
+        pending = {}
+        for args in requests:
+            key = self.get_key(args)
+            if key not in self._shaders:
+                pending[key] = args
+        if not pending:
+            return {}
+
+        start = time.time()
+        pool = ThreadPool(max(1, num_threads))
+        try:
+            results = pool.map(lambda item: (item, self._prepare(*item)), list(iteritems(pending)))
+        finally:
+            pool.close()
+            pool.join()
+        wall_time = (time.time() - start) * 1000.0
+
+        report = {}
+        prepared_objects = gsg.get_prepared_objects() if gsg is not None else None
+        for (key, args), (sources, deps, duration) in results:
+            if sources is not None:
+                shader = self._make_shader(sources)
+                self._shaders[key] = (shader, deps)
+                if prepared_objects is not None:
+                    shader.prepare(prepared_objects)
+            owner = self._get_owner(args)
+            count, serial_time, _ = report.get(owner, (0, 0.0, 0.0))
+            report[owner] = (count + 1, serial_time + duration, 0.0)
+
+        # Distribute the wall time over the owners, weighted by their share
+        # of the serial time
+        total_time = sum(entry[1] for entry in itervalues(report)) or 1.0
+        for owner, (count, serial_time, _) in list(iteritems(report)):
+            saved = serial_time - wall_time * serial_time / total_time
+            report[owner] = (count, serial_time, saved)
+        return report
+
+    def get_key(self, args):
+        """ Returns the cache key of a shader request """
+        return hashlib.sha1("|".join(args).encode("utf-8")).hexdigest()
+
+    def _get_owner(self, args):
+        """ Returns the id of the plugin the shader belongs to, based on
+        its path. Shaders not located in a plugin belong to the pipeline """
+        for arg in args:
+            if "rpplugins/" in arg:
+                return arg.split("rpplugins/")[1].split("/")[0]
+        return "render_pipeline_internal"
+
+    def _make_shader(self, sources):
+        """ Constructs a shader object from preprocessed sources """
+        if len(sources) == 1:
+            return Shader.make_compute(Shader.SL_GLSL, sources[0])
+        return Shader.make(Shader.SL_GLSL, *sources)
+
+    def _prepare(self, key, args):
+        """ Returns the preprocessed sources of a shader request, either from
+        disk or by processing them, the list of (filename, digest) pairs of
+        all used files and the time taken in milliseconds. The sources are
+        None if the shader could not be preprocessed. This may be called from
+        multiple threads. """
+        start = time.time()
+        sources, deps = self._load_from_disk(key)
+        if sources is None:
+            self.num_misses += 1
+            try:
+                sources, deps = self._preprocess_all(args)
+            except (IOError, UnicodeDecodeError) as msg:
+                # Files which are no valid utf-8 are left to the loader of panda
+                self.debug("Could not preprocess", args, ":", msg)
+                sources, deps = None, None
+            else:
+                self._write_to_disk(key, sources, deps)
+        else:
+            self.num_hits += 1
+        return sources, deps, (time.time() - start) * 1000.0
+
+    def _resolve(self, filename, relative_to=None):
+        """ Resolves a filename the same way the shader preprocessor of panda
+        does: First relative to the including file, then on the model path.
+        Returns None if the file could not be found. """
+        if relative_to is not None:
+            fname = Filename(Filename(relative_to).get_dirname(), filename)
+            fname.standardize()
+            if self._vfs.exists(fname):
+                return fname.get_fullpath()
+        fname = Filename(filename)
+        if fname.is_fully_qualified():
+            return fname.get_fullpath() if self._vfs.exists(fname) else None
+        if self._vfs.resolve_filename(fname, get_model_path().get_value()):
+            return fname.get_fullpath()
+        return None
+
+    def _get_file_hash(self, filename):
+        """ Returns the digest of a resolved file, reading it only once """
+        if filename not in self._file_hashes:
+            if not isfile(filename):
+                return None
+            with open(filename, "rb") as handle:
+                self._file_hashes[filename] = hashlib.sha1(handle.read()).hexdigest()
+        return self._file_hashes[filename]
+
+    def _get_file_identifiers(self, filename):
+        """ Returns the set of all identifiers used in a resolved file """
+        if filename not in self._file_identifiers:
+            identifiers = set()
+            if isfile(filename):
+                with open(filename, "r") as handle:
+                    identifiers = set(self.IDENTIFIER_RE.findall(handle.read()))
+            self._file_identifiers[filename] = identifiers
+        return self._file_identifiers[filename]
+
+    def _get_manifest_path(self, key):
+        """ Returns the path of the manifest of a cache entry """
+        return self._cache_dir + key + ".json"
+
+    def _get_source_path(self, key, index):
+        """ Returns the path of the preprocessed source of a shader stage """
+        return self._cache_dir + key + "-" + str(index) + ".glsl"
+
+    def _load_from_disk(self, key):
+        """ Returns the stored sources for the given key and the files they
+        were built from, or None, None if there are no stored sources or if
+        any of the files they were built from changed """
+        if self._cache_dir is None:
+            return None, None
+        manifest_path = self._get_manifest_path(key)
+        if not isfile(manifest_path):
+            return None, None
+        try:
+            with open(manifest_path, "r") as handle:
+                manifest = json.load(handle)
+            deps = [(filename, digest) for filename, digest in manifest["deps"]]
+            for filename, digest in deps:
+                if self._get_file_hash(filename) != digest:
+                    return None, None
+            sources = []
+            for index in range(manifest["num_sources"]):
+                with open(self._get_source_path(key, index), "r") as handle:
+                    sources.append(handle.read())
+        except (IOError, ValueError, KeyError) as msg:
+            self.debug("Discarding invalid cache entry", key, ":", msg)
+            return None, None
+        return sources, deps
+
+    def _write_to_disk(self, key, sources, deps):
+        """ Stores the preprocessed sources, writing the manifest last so
+        that incomplete entries are never picked up """
+        if self._cache_dir is None:
+            return
+        manifest_path = self._get_manifest_path(key)
+        try:
+            for index, source in enumerate(sources):
+                with open(self._get_source_path(key, index), "w") as handle:
+                    handle.write(source)
+            with open(manifest_path, "w") as handle:
+                json.dump({"num_sources": len(sources), "deps": deps}, handle)
+        except IOError as msg:
+            self.warn("Could not write shader cache entry:", msg)
+
+    def _preprocess_all(self, args):
+        """ Preprocesses all stages of a shader, returning the sources and a
+        list of (filename, digest) pairs of all used files """
+        deps = []
+        sources = []
+        for arg in args:
+            filename = self._resolve(arg)
+            if filename is None:
+                raise IOError("Shader not found: " + arg)
+            output = []
+            self._expand(filename, deps, set(), output)
+            sources.append("\n".join(output) + "\n")
+        return sources, [(dep, self._get_file_hash(dep)) for dep in deps]
+
+    def _expand(self, filename, deps, once_files, output):
+        """ Appends the lines of the given file to the output, recursively
+        inlining all included files. The #line directives use the index of
+        the file in the dependency list as source string number. """
+        if filename in once_files:
+            return
+        if filename not in deps:
+            deps.append(filename)
+        source_id = deps.index(filename)
+
+        with open(filename, "rb") as handle:
+            content = handle.read()
+        self._file_hashes[filename] = hashlib.sha1(content).hexdigest()
+        lines = content.decode("utf-8").splitlines()
+
+        for line_no, line in enumerate(lines):
+            if self.ONCE_RE.match(line):
+                once_files.add(filename)
+                output.append("")
+                continue
+            match = self.INCLUDE_RE.match(line)
+            if not match:
+                output.append(line)
+                continue
+            include = self._resolve(match.group(1), filename)
+            if include is None:
+                raise IOError("Could not resolve include " + match.group(1) + " in " + filename)
+            if include in once_files:
+                output.append("")
+                continue
+            output.append("#line 1 " + str(deps.index(include) if include in deps else len(deps)))
+            self._expand(include, deps, once_files, output)
+            output.append("#line " + str(line_no + 2) + " " + str(source_id))
@@ -23,10 +23,17 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 
 """
+import re
+import sys
+from array import array
+from collections import OrderedDict
+
 from rplibs.six import iteritems
+from rplibs.six.moves import range  # pylint: disable=import-error
 
 from panda3d.core import PTAFloat, PTALVecBase3f, PTALMatrix4f, PTALVecBase2f
 from panda3d.core import PTALVecBase4f, PTALMatrix3f, PTAInt, TypeRegistry, PTALVecBase2i
+from panda3d.core import LVecBase4f
 
 from rpcore.rpobject import RPObject
 
@@ -56,7 +63,13 @@ class GroupedInputBlock(RPObject):
 
     """ Grouped uniform buffer which either uses PointerToArray's to efficiently
     store and update the shader inputs, or in case of uniform buffer object (UBO)
-    support, uses these to pass the inputs to the shaders. """
+    support, uses these to pass the inputs to the shaders.
+
+    In packed mode, all inputs are stored in std140 order in a single array of
+    vec4's instead, which gets uploaded as one uniform. Changes are collected
+    in a cpu side copy, and the changed range gets copied on flush(). The
+    generated shader code unpacks the array into a struct, so shaders can
+    access the inputs as usual. """
 
     # Keeps track of the global allocated input blocks to be able to assign
     # a unique binding to all of them
@@ -74,12 +87,35 @@ class GroupedInputBlock(RPObject):
         PTALMatrix4f: "mat4",
     }
 
-    def __init__(self, name):
-        """ Constructs the input block with a given name """
+    # Base alignment and size in bytes of each glsl type in the std140 layout
+    STD140_LAYOUT = {
+        "int": (4, 4),
+        "float": (4, 4),
+        "vec2": (8, 8),
+        "ivec2": (8, 8),
+        "vec3": (16, 12),
+        "vec4": (16, 16),
+        "mat3": (16, 48),
+        "mat4": (16, 64),
+    }
+
+    def __init__(self, name, packed=False):
+        """ Constructs the input block with a given name. If packed is True,
+        the inputs are stored in a single buffer, see the class description. """
         RPObject.__init__(self)
         self.ptas = {}
         self._inputs = {}
+        self._types = OrderedDict()
         self.name = name
+        self.packed = packed
+
+        # Packed mode: byte offset and type of each input, the cpu side copy,
+        # the range of changed floats and the last written values
+        self._layout = None
+        self._packed_data = None
+        self._packed_pta = None
+        self._dirty_range = None
+        self._values = {}
         self.use_ubo = bool(TypeRegistry.ptr().find_type("GLUniformBufferContext"))
 
         # Acquire a unique index for each UBO to store its binding
@@ -92,6 +128,11 @@ class GroupedInputBlock(RPObject):
 
     def register_pta(self, name, input_type):
         """ Registers a new input, type should be a glsl type """
+        self._types[name] = input_type
+        if self.packed:
+            if self._layout is not None:
+                self.error("Cannot register", name, "after the block was used")
+            return
         pta = self.glsl_type_to_pta(input_type).empty_array(1)
         self.ptas[name] = pta
         if self.use_ubo:
@@ -116,63 +157,253 @@ class GroupedInputBlock(RPObject):
     def bind_to(self, target):
         """ Binds all inputs of this UBO to the given target, which may be
         either a RenderTarget or a NodePath """
-
+        if self.packed:
+            self._create_packed_buffer()
         target.set_shader_inputs(**self._inputs)
 
     def update_input(self, name, value):
         """ Updates an existing input """
-        self.ptas[name][0] = value
+        if not self.packed:
+            self.ptas[name][0] = value
+            return
+
+        self._create_packed_buffer()
+        self._values[name] = value
+        offset, glsl_type = self._layout[name]
+        start = offset // 4
+        data = array("f", self._pack_value(glsl_type, value))
+        end = start + len(data)
+        if self._packed_data[start:end] != data:
+            self._packed_data[start:end] = data
+            if self._dirty_range is None:
+                self._dirty_range = (start, end)
+            else:
+                self._dirty_range = (min(start, self._dirty_range[0]),
+                                     max(end, self._dirty_range[1]))
 
     def get_input(self, name):
         """ Returns the value of an existing input """
+        if self.packed:
+            if name not in self._values:
+                return self.glsl_type_to_pta(self._types[name]).empty_array(1)[0]
+            return self._values[name]
         return self.ptas[name][0]
 
-    def generate_shader_code(self):  # pylint: disable=too-many-branches
-        """ Generates the GLSL shader code to use the UBO """
-
-        content = "#pragma once\n\n"
-        content += "// Autogenerated by the render pipeline\n"
-        content += "// Do not edit! Your changes will be lost.\n\n"
-
+    def flush(self):
+        """ Copies all changed inputs to the packed buffer in a single write.
+        Does nothing if the block is not packed. """
+        if not self.packed or self._dirty_range is None:
+            return
+        start, end = self._dirty_range
+        self._dirty_range = None
+
+        # The buffer consists of vec4's, so copy whole vec4's
+        first_vec, last_vec = start // 4, (end + 3) // 4
+        data = self._packed_data[first_vec * 4:last_vec * 4]
+        if sys.version_info >= (3, 0):
+            memoryview(self._packed_pta).cast("B")[first_vec * 16:last_vec * 16] = data.tobytes()
+        else:
+            # Python 2 buffers can not be sliced like this, copy each vec4
+            for i in range(last_vec - first_vec):
+                self._packed_pta[first_vec + i] = LVecBase4f(*data[i * 4:i * 4 + 4])
+
+    def _pack_value(self, glsl_type, value):
+        """ Internal method to convert a value to the list of floats stored in
+        the packed buffer. Matrices are stored row by row, which matches the way
+        Panda3D passes them to glsl. """
+        if glsl_type in ("int", "float"):
+            return (value,)
+        if glsl_type == "mat3":
+            floats = []
+            for row in range(3):
+                floats += (value.get_cell(row, 0), value.get_cell(row, 1),
+                           value.get_cell(row, 2), 0.0)
+            return floats
+        if glsl_type == "mat4":
+            floats = []
+            for row in range(4):
+                floats += tuple(value.get_row(row))
+            return floats
+        return tuple(value)
+
+    def _collect_members(self):
+        """ Internal method to group the inputs into the top level members and
+        structs, in the order they get declared in the shader. Returns a list of
+        (name, glsl type, struct members) tuples, struct members is a list of
+        (name, glsl type) tuples, or None if the member is no struct. """
+        members = []
         structs = {}
-        inputs = []
 
-        for input_name, handle in iteritems(self.ptas):
+        for input_name, glsl_type in iteritems(self._types):
             parts = input_name.split(".")
 
             # Single input, simply add it to the input list
             if len(parts) == 1:
-                inputs.append(self.pta_to_glsl_type(handle) + " " + input_name + ";")
+                members.append((input_name, glsl_type, None))
 
             # Nested input, like scattering.sun_color
             elif len(parts) == 2:
                 struct_name = parts[0]
-                actual_input_name = parts[1]
-                if struct_name in structs:
-                    # Struct is already defined, add member definition
-                    structs[struct_name].append(
-                        self.pta_to_glsl_type(handle) + " " + actual_input_name + ";")
-                else:
+                if struct_name not in structs:
                     # Construct a new struct and add it to the list of inputs
-                    inputs.append(struct_name + "_UBOSTRUCT " + struct_name + ";")
-                    structs[struct_name] = [
-                        self.pta_to_glsl_type(handle) + " " + actual_input_name + ";"
-                    ]
+                    structs[struct_name] = []
+                    members.append((struct_name, struct_name + "_UBOSTRUCT", structs[struct_name]))
+                structs[struct_name].append((parts[1], glsl_type))
 
             # Nested input, like scattering.some_setting.sun_color, not supported yet
             else:
                 self.warn("Structure definition too nested, not supported (yet):", input_name)
+        return members
+
+    @classmethod
+    def compute_std140_layout(cls, members):
+        """ Computes the std140 layout of the given members, see _collect_members.
+        Returns a dictionary of input name to (byte offset, glsl type), and the
+        total size in bytes. """
+        def align(offset, alignment):
+            return (offset + alignment - 1) // alignment * alignment
+
+        layout, offset = {}, 0
+        for name, glsl_type, struct_members in members:
+            if struct_members is None:
+                alignment, size = cls.STD140_LAYOUT[glsl_type]
+                offset = align(offset, alignment)
+                layout[name] = (offset, glsl_type)
+                offset += size
+            else:
+                # Structs are aligned to a vec4, and so is their size
+                offset = align(offset, 16)
+                for member_name, member_type in struct_members:
+                    alignment, size = cls.STD140_LAYOUT[member_type]
+                    offset = align(offset, alignment)
+                    layout[name + "." + member_name] = (offset, member_type)
+                    offset += size
+                offset = align(offset, 16)
+        return layout, align(offset, 16)
+
+    def _create_packed_buffer(self):
+        """ Internal method to compute the layout and create the packed buffer,
+        once all inputs are registered """
+        if self._layout is not None:
+            return
+        self._layout, size = self.compute_std140_layout(self._collect_members())
+        num_vecs = max(1, size // 16)
+        self._packed_data = array("f", [0.0]) * (num_vecs * 4)
+        self._packed_pta = PTALVecBase4f.empty_array(num_vecs)
+        self._inputs = {self.name + "_Packed": self._packed_pta}
+
+    def _generate_unpack_expression(self, offset, glsl_type):
+        """ Internal method to generate the glsl expression to read an input at
+        the given byte offset from the packed buffer """
+        index, component = offset // 16, (offset % 16) // 4
+        vec = "{}_Packed[{{}}]".format(self.name)
+        if glsl_type == "mat4":
+            return "mat4({})".format(", ".join(vec.format(index + i) for i in range(4)))
+        if glsl_type == "mat3":
+            return "mat3({})".format(", ".join(vec.format(index + i) + ".xyz" for i in range(3)))
+        num_components = {"int": 1, "float": 1, "vec2": 2, "ivec2": 2, "vec3": 3, "vec4": 4}
+        swizzle = "xyzw"[component:component + num_components[glsl_type]]
+        expression = vec.format(index) + "." + swizzle
+        if glsl_type in ("int", "ivec2"):
+            return "{}({})".format(glsl_type, expression)
+        return expression
+
+    def _generate_packed_code(self, members):
+        """ Internal method to generate the code to declare and unpack the
+        packed buffer """
+        self._create_packed_buffer()
+        block_struct = self.name + "_PACKEDBLOCK"
+        content = "struct " + block_struct + " {\n"
+        for name, glsl_type, _ in members:
+            content += " " * 4 + glsl_type + " " + name + ";\n"
+        content += "};\n\n"
+        content += "uniform vec4 {}_Packed[{}];\n\n".format(self.name, len(self._packed_pta))
+        content += block_struct + " " + self.name + "_unpack() {\n"
+        content += " " * 4 + block_struct + " result;\n"
+        for name, (offset, glsl_type) in sorted(iteritems(self._layout), key=lambda v: v[1]):
+            content += " " * 4 + "result.{} = {};\n".format(
+                name, self._generate_unpack_expression(offset, glsl_type))
+        content += " " * 4 + "return result;\n"
+        content += "}\n\n"
+        content += "#define {} {}_unpack()\n".format(self.name, self.name)
+        return content
+
+    def validate_packed_layout(self, shader_code):
+        """ Checks the generated shader code of a packed block: Computes the
+        std140 offsets from the struct declarations in the code, and compares
+        them with the offsets which are read by the unpack function, as well as
+        with the layout used to write the buffer. Returns a list of errors. """
+        struct_defs = {}
+        for struct_name, body in re.findall(r"struct (\w+) \{(.*?)\};", shader_code, re.S):
+            struct_defs[struct_name] = re.findall(r"(\w+) (\w+);", body)
+
+        block_struct = self.name + "_PACKEDBLOCK"
+        if block_struct not in struct_defs:
+            return ["Block struct " + block_struct + " is missing"]
+
+        members = []
+        for glsl_type, name in struct_defs[block_struct]:
+            if glsl_type in struct_defs:
+                members.append((name, glsl_type, [(n, t) for t, n in struct_defs[glsl_type]]))
+            else:
+                members.append((name, glsl_type, None))
+        try:
+            declared_layout, size = self.compute_std140_layout(members)
+        except KeyError as msg:
+            return ["Unsupported type in declaration: " + str(msg)]
+
+        errors = []
+        array_size = re.search(r"uniform vec4 \w+_Packed\[(\d+)\];", shader_code)
+        if not array_size or int(array_size.group(1)) * 16 < size:
+            errors.append("Packed array is smaller than the declared block")
+
+        read_offsets = {}
+        for name, expression in re.findall(r"result\.([\w.]+) = (.*);", shader_code):
+            match = re.search(r"_Packed\[(\d+)\](?:\.(\w+))?", expression)
+            if not match:
+                errors.append("Could not parse read of " + name)
+                continue
+            component = "xyzw".index(match.group(2)[0]) if match.group(2) else 0
+            read_offsets[name] = int(match.group(1)) * 16 + component * 4
+
+        for name, (offset, glsl_type) in sorted(iteritems(declared_layout)):
+            if read_offsets.get(name) != offset:
+                errors.append("{} is declared at offset {} but read at {}".format(
+                    name, offset, read_offsets.get(name)))
+            if self._layout.get(name) != (offset, glsl_type):
+                errors.append("{} is declared as {} at offset {} but written as {}".format(
+                    name, glsl_type, offset, self._layout.get(name)))
+        for name in set(read_offsets) - set(declared_layout):
+            errors.append(name + " is read but not declared")
+        return errors
+
+    def generate_shader_code(self):  # pylint: disable=too-many-branches
+        """ Generates the GLSL shader code to use the UBO """
+
+        content = "#pragma once\n\n"
+        content += "// Autogenerated by the render pipeline\n"
+        content += "// Do not edit! Your changes will be lost.\n\n"
+
+        members = self._collect_members()
 
         # Add structures
-        for struct_name, members in iteritems(structs):
-            content += "struct " + struct_name + "_UBOSTRUCT {\n"
-            for member in members:
-                content += " " * 4 + member + "\n"
+        for _, struct_type, struct_members in members:
+            if struct_members is None:
+                continue
+            content += "struct " + struct_type + " {\n"
+            for member_name, member_type in struct_members:
+                content += " " * 4 + member_type + " " + member_name + ";\n"
             content += "};\n\n"
 
+        inputs = [glsl_type + " " + name + ";" for name, glsl_type, _ in members]
+
         # Add actual inputs
         if len(inputs) < 1:
             self.debug("No UBO inputs present for", self.name)
+        elif self.packed:
+            content += self._generate_packed_code(members)
+            for error in self.validate_packed_layout(content):
+                self.error("Invalid packed layout of", self.name + ":", error)
         else:
             if self.use_ubo:
 
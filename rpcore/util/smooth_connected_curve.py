@@ -34,8 +34,13 @@ class SmoothConnectedCurve(object):
     """ Interface to a curve which also manages connecting the end of the
     curve with the beginning. """
 
+    # Incremented whenever any curve gets rebuilt, so users caching curve
+    # values can cheaply check if they have to update
+    MODIFICATION_COUNT = 0
+
     def __init__(self):
         self._curve = None
+        self._version = 0
         self._modified = False
         self._border_points = 1
         self._color = (0, 0, 0)
@@ -47,6 +52,11 @@ class SmoothConnectedCurve(object):
         """ Returns whether the curve was modified since the creation """
         return self._modified
 
+    @property
+    def version(self):
+        """ Returns a number which changes whenever the curve gets rebuilt """
+        return self._version
+
     @property
     def control_points(self):
         """ Returns a list of all controll points """
@@ -119,6 +129,8 @@ class SmoothConnectedCurve(object):
         fitter.compute_tangents(1.0)
 
         self._curve = fitter.make_hermite()
+        self._version += 1
+        SmoothConnectedCurve.MODIFICATION_COUNT += 1
 
     def set_cv_value(self, index, x_value, y_value):
         """ Updates the cv point at the given index """
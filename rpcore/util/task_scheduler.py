@@ -24,6 +24,11 @@ THE SOFTWARE.
 
 """
 
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from rplibs.six import iteritems
 from rplibs.yaml import load_yaml_file
 from rpcore.rpobject import RPObject
 
@@ -33,38 +38,166 @@ class TaskScheduler(RPObject):
     """ This class manages the scheduled tasks and splits them over multiple
     frames. Plugins can query whether their subtasks should be executed
     or queued for later frames. Also performs analysis on the task configuration
-    to figure if tasks are distributed uniformly. """
+    to figure if tasks are distributed uniformly.
+
+    By default, the tasks of each frame are taken from the fixed frame cycles
+    of the configuration. If a frame budget is set, tasks are instead assigned
+    dynamically: Each task becomes due in the frame the configuration lists it
+    in, and due tasks are run in configuration order as long as their summed
+    cost fits into the budget. Tasks which do not fit slip to later frames.
+
+    The cost of a task is the estimated cost of the render passes it enables,
+    taken from the configuration, plus the measured cost of its work on the
+    cpu. Plugins measure that work with measure(). """
+
+    # Estimated cost in milliseconds of the render passes of tasks which have
+    # no cost in the configuration
+    DEFAULT_TASK_COST = 1.0
 
     def __init__(self, pipeline):
         RPObject.__init__(self)
         self._pipeline = pipeline
         self._tasks = []
+        self._task_sets = []
+        self._all_tasks = set()
+        self._checked_tasks = set()
+        self._task_costs = {}
+        self._measured_costs = {}
         self._frame_index = 0
+        self._frame_budget = 0.0
+        self._pending = deque()
+        self._current = frozenset()
+        self._slip_stats = {}
         self._load_config()
+        self._current = self._task_sets[self._frame_index]
+        self.frame_budget = pipeline.settings["pipeline.task_frame_budget"]
 
     def _load_config(self):
         """ Loads the tasks distribution configuration """
-        config = load_yaml_file("/$$rpconfig/task-scheduler.yaml")["frame_cycles"]
-        for frame_name, tasks in config:  # pylint: disable=unused-variable
+        config = load_yaml_file("/$$rpconfig/task-scheduler.yaml")
+        for frame_name, tasks in config["frame_cycles"]:  # pylint: disable=unused-variable
             self._tasks.append(tasks)
+            self._task_sets.append(frozenset(tasks))
+            self._all_tasks.update(tasks)
+        self._task_costs.update(config.get("task_costs") or {})
+
+    @property
+    def frame_budget(self):
+        """ Returns the per-frame budget in milliseconds, or 0 if the fixed
+        frame cycles are used """
+        return self._frame_budget
+
+    @frame_budget.setter
+    def frame_budget(self, budget):
+        """ Sets the per-frame budget in milliseconds. Setting the budget to 0
+        switches back to the fixed frame cycles of the configuration """
+        self._frame_budget = max(0.0, float(budget))
+        self._pending.clear()
+
+    def report_cost(self, task_name, duration):
+        """ Reports the measured duration in milliseconds of the cpu work of a
+        task which ran this frame. The costs are smoothed over multiple frames,
+        and used to assign tasks to frames if a frame budget is set """
+        if task_name in self._measured_costs:
+            duration = 0.9 * self._measured_costs[task_name] + 0.1 * duration
+        self._measured_costs[task_name] = duration
+
+    @contextmanager
+    def measure(self, task_name):
+        """ Context manager which measures the cpu work of a task and reports
+        it with report_cost. Only measures if a frame budget is set, since the
+        costs are not used otherwise. """
+        if self._frame_budget <= 0.0:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.report_cost(task_name, (time.time() - start) * 1000.0)
+
+    def get_task_cost(self, task_name):
+        """ Returns the estimated cost of a task in milliseconds """
+        return (self._task_costs.get(task_name, self.DEFAULT_TASK_COST) +
+                self._measured_costs.get(task_name, 0.0))
 
     def _check_missing_schedule(self, task_name):
         """ Checks whether the given task is scheduled at some point. This can
-        be used to check whether any task is missing in the task scheduler config. """
-        for tasks in self._tasks:
-            if task_name in tasks:
-                break
-        else:
+        be used to check whether any task is missing in the task scheduler config.
+        Each task is only checked once. """
+        self._checked_tasks.add(task_name)
+        if task_name not in self._all_tasks:
             self.error("Task '" + task_name + "' is never scheduled and thus will never run!")
 
     def is_scheduled(self, task_name):
         """ Returns whether a given task is supposed to run this frame """
-        self._check_missing_schedule(task_name)
-        return task_name in self._tasks[self._frame_index]
+        if task_name not in self._checked_tasks:
+            self._check_missing_schedule(task_name)
+        return task_name in self._current
 
     def step(self):
         """ Advances one frame """
         self._frame_index = (self._frame_index + 1) % len(self._tasks)
+        if self._frame_budget > 0.0:
+            self._current = self._assign_tasks()
+        else:
+            self._current = self._task_sets[self._frame_index]
+
+    def _assign_tasks(self):
+        """ Makes the tasks of the current frame of the cycle due, and returns
+        the set of due tasks which fit into the frame budget. At least one task
+        runs each frame, so expensive tasks can not stall the queue. """
+        pending_names = set(entry[0] for entry in self._pending)
+        for task_name in self._tasks[self._frame_index]:
+            if task_name in pending_names:
+                # The task did not run since the last cycle, so one run is lost
+                self._get_slip_entry(task_name)["skipped"] += 1
+            else:
+                self._pending.append((task_name, 0))
+
+        selected = set()
+        budget = self._frame_budget
+        while self._pending:
+            task_name, slip = self._pending[0]
+            cost = self.get_task_cost(task_name)
+            if selected and cost > budget:
+                break
+            budget -= cost
+            selected.add(task_name)
+            self._pending.popleft()
+            if slip > 0:
+                entry = self._get_slip_entry(task_name)
+                entry["slipped"] += 1
+                entry["total_frames"] += slip
+                entry["max_frames"] = max(entry["max_frames"], slip)
+
+        # All remaining tasks slip by one more frame
+        self._pending = deque((name, slip + 1) for name, slip in self._pending)
+        return frozenset(selected)
+
+    def _get_slip_entry(self, task_name):
+        """ Returns the slip statistics entry of a task, creating it if needed """
+        if task_name not in self._slip_stats:
+            self._slip_stats[task_name] = {
+                "slipped": 0, "total_frames": 0, "max_frames": 0, "skipped": 0}
+        return self._slip_stats[task_name]
+
+    def get_slip_stats(self):
+        """ Returns statistics on tasks which could not run in the frame they
+        were due in, because the frame budget was exceeded. This is a dictionary
+        mapping each affected task to a dictionary containing how often it
+        slipped, the total and maximum amount of frames it slipped by, and how
+        often a run was skipped entirely because it slipped for a whole cycle """
+        return dict((name, dict(entry)) for name, entry in iteritems(self._slip_stats))
+
+    def reset_slip_stats(self):
+        """ Clears the slip statistics """
+        self._slip_stats = {}
+
+    @property
+    def num_slipped_tasks(self):
+        """ Returns the amount of tasks which are currently delayed """
+        return len(self._pending)
 
     @property
     def num_tasks(self):
@@ -74,4 +207,4 @@ class TaskScheduler(RPObject):
     @property
     def num_scheduled_tasks(self):
         """ Returns the amount of scheduled tasks this frame """
-        return len(self._tasks[self._frame_index])
+        return len(self._current)
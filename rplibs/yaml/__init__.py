@@ -2,13 +2,22 @@
 
 Main PyYAML importer script. Provides functions to load YAML files as dictionaries.
 
+Parsed files are cached in-process, and optionally on disk (see
+enable_yaml_disk_cache). Entries are keyed by the path and validated with the
+modification time and a digest of the file contents. The documents are stored
+with marshal, which only supports the plain builtin types and never executes
+code when loading. Every call returns a fresh copy, so callers may modify the
+result.
+
 """
 
 from __future__ import print_function
 
 import sys
+import marshal
+import hashlib
 import collections
-from direct.stdpy.file import open
+from direct.stdpy.file import open, isfile, getmtime
 from rpcore.rpobject import RPObject
 
 # Import different PyYaml versions depending on the used python version
@@ -19,26 +28,112 @@ else:
     from .yaml_py3 import load as yaml_load
     from .yaml_py3 import YAMLError, SafeLoader
 
-__all__ = ["load_yaml_file", "load_yaml_file_flat"]
+__all__ = ["load_yaml_file", "load_yaml_file_flat", "enable_yaml_disk_cache",
+           "clear_yaml_cache"]
 
-def load_yaml_file(filename):
-    """ This method is a wrapper arround yaml_load, and provides error checking """
+# Maps the cache key of each loaded file to a tuple of its modification time,
+# the digest of its contents and the marshalled document
+_MEMORY_CACHE = {}
 
-    import time
-    start = time.clock()
+# Directory of the on-disk cache, or None if it is disabled
+_DISK_CACHE_DIR = None
 
+def enable_yaml_disk_cache(directory):
+    """ Makes parsed documents persist in the given directory, so they can be
+    reused on later runs. The directory has to exist. """
+    global _DISK_CACHE_DIR
+    _DISK_CACHE_DIR = directory.rstrip("/") + "/"
+
+def clear_yaml_cache():
+    """ Clears the in-process cache. The disk cache does not need to be
+    cleared, since it is validated with the file contents. """
+    _MEMORY_CACHE.clear()
+
+def __parse(filename, content):
+    """ Internal method to parse a yaml document, providing error checking """
     try:
-        with open(filename, "r") as handle:
-            parsed_yaml = yaml_load(handle, Loader=SafeLoader)
-    except IOError as msg:
-        RPObject.global_error("YAMLLoader", "Could not find or open file:", filename)
-        RPObject.global_error("YAMLLoader", msg)
-        raise Exception("Failed to load YAML file: File not found")
+        return yaml_load(content, Loader=SafeLoader)
     except YAMLError as msg:
         RPObject.global_error("YAMLLoader", "Invalid yaml-syntax in file:", filename)
         RPObject.global_error("YAMLLoader", msg)
         raise Exception("Failed to load YAML file: Invalid syntax")
 
+def __get_disk_cache_path(key):
+    """ Internal method to get the path of the on-disk cache entry of a key.
+    The marshal format depends on the python version, so it is part of the
+    name. """
+    return "{}{}-py{}{}.bin".format(
+        _DISK_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest(), *sys.version_info[:2])
+
+def __load_from_disk(key, digest):
+    """ Internal method to load a marshalled document from the disk cache,
+    returns None if there is no valid entry """
+    path = __get_disk_cache_path(key)
+    if not isfile(path):
+        return None
+    try:
+        with open(path, "rb") as handle:
+            stored_digest, payload = marshal.loads(handle.read())
+    except (IOError, ValueError, EOFError, TypeError):
+        return None
+    return payload if stored_digest == digest else None
+
+def __write_to_disk(key, digest, payload):
+    """ Internal method to store a marshalled document in the disk cache """
+    try:
+        with open(__get_disk_cache_path(key), "wb") as handle:
+            handle.write(marshal.dumps((digest, payload)))
+    except IOError as msg:
+        RPObject.global_warn("YAMLLoader", "Could not write yaml cache:", msg)
+
+def __load_cached(filename, flat):
+    """ Internal method to load a yaml file through the cache, optionally
+    flattening it before storing it """
+    key = filename + ("?flat" if flat else "")
+    entry = _MEMORY_CACHE.get(key)
+
+    try:
+        mtime = getmtime(filename)
+        if entry is not None and entry[0] == mtime:
+            return marshal.loads(entry[2])
+        with open(filename, "rb") as handle:
+            content = handle.read()
+    except (IOError, OSError) as msg:
+        RPObject.global_error("YAMLLoader", "Could not find or open file:", filename)
+        RPObject.global_error("YAMLLoader", msg)
+        raise Exception("Failed to load YAML file: File not found")
+
+    digest = hashlib.sha1(content).hexdigest()
+    payload = None
+    if entry is not None and entry[1] == digest:
+        payload = entry[2]
+    elif _DISK_CACHE_DIR is not None:
+        payload = __load_from_disk(key, digest)
+
+    if payload is None:
+        parsed_yaml = __parse(filename, content.decode("utf-8"))
+        if flat:
+            parsed_yaml = __flatten(parsed_yaml)
+        try:
+            payload = marshal.dumps(parsed_yaml)
+        except ValueError:
+            # The document contains types marshal can not store, like dates
+            return parsed_yaml
+        if _DISK_CACHE_DIR is not None:
+            __write_to_disk(key, digest, payload)
+
+    _MEMORY_CACHE[key] = (mtime, digest, payload)
+    return marshal.loads(payload)
+
+def load_yaml_file(filename):
+    """ This method is a wrapper arround yaml_load, and provides error checking
+    and caching """
+
+    import time
+    start = time.clock()
+
+    parsed_yaml = __load_cached(filename, flat=False)
+
     duration = (time.clock() - start) * 1000.0
 
     # Optionally print out profiling information
@@ -59,4 +154,4 @@ def __flatten(d, parent_key=''):
 def load_yaml_file_flat(filename):
     """ Behaves like load_yaml_file, but instead of creating nested dictionaries
     it connects keys via '.' """
-    return __flatten(load_yaml_file(filename))
+    return __load_cached(filename, flat=True)
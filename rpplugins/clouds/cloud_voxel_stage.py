@@ -35,6 +35,7 @@ class CloudVoxelStage(RenderStage):
     """ This stage generates the volumetric cloud voxel grid """
 
     required_pipes = ["ScatteringIBLDiffuse"]
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
@@ -31,6 +31,7 @@ class ColorCorrectionStage(RenderStage):
 
     required_inputs = []
     required_pipes = ["ShadedScene"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
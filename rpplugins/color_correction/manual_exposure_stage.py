@@ -33,6 +33,7 @@ class ManualExposureStage(RenderStage):
 
     required_pipes = ["ShadedScene"]
     required_inputs = []
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
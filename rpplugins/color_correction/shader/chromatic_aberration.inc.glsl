@@ -28,9 +28,15 @@
 
 #pragma optionNV (unroll all)
 
+// Converts a coordinate in the range -1 .. 1 to a texcoord of the screen texture
+vec2 to_aberration_texcoord(vec2 coord) {
+    return clamp_screen_texcoord(
+        screen_to_texcoord(coord * 0.5 + 0.5), 1.0 / SCREEN_TEXTURE_SIZE);
+}
+
 vec3 do_chromatic_aberration(sampler2D colortex, vec2 texcoord, float factor) {
 
-    vec2 mid_coord = texcoord * 2.0 - 1.0;
+    vec2 mid_coord = texcoord_to_screen(texcoord) * 2.0 - 1.0;
     vec3 blurred = vec3(0);
     const int num_samples = GET_SETTING(color_correction, chromatic_aberration_samples);
 
@@ -49,9 +55,9 @@ vec3 do_chromatic_aberration(sampler2D colortex, vec2 texcoord, float factor) {
         vec2 offcord_r = mid_coord_r + offset;
         vec2 offcord_g = mid_coord_g + offset;
         vec2 offcord_b = mid_coord_b + offset;
-        blurred.r += textureLod(colortex, offcord_r * 0.5 + 0.5, 0).r;
-        blurred.g += textureLod(colortex, offcord_g * 0.5 + 0.5, 0).g;
-        blurred.b += textureLod(colortex, offcord_b * 0.5 + 0.5, 0).b;
+        blurred.r += textureLod(colortex, to_aberration_texcoord(offcord_r), 0).r;
+        blurred.g += textureLod(colortex, to_aberration_texcoord(offcord_g), 0).g;
+        blurred.b += textureLod(colortex, to_aberration_texcoord(offcord_b), 0).b;
     }
 
     blurred /= fma(float(num_samples), 2.0, 1.0);
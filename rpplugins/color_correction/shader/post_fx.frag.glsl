@@ -45,7 +45,7 @@ void main() {
     #if !DEBUG_MODE
 
 
-        vec2 ccord = (texcoord - 0.5) * vec2(1.0, ASPECT_RATIO);
+        vec2 ccord = (texcoord_to_screen(texcoord) - 0.5) * vec2(1.0, ASPECT_RATIO);
         float vignette = 1 - saturate(length(ccord));
 
         // Chromatic abberation
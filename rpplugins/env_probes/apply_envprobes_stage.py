@@ -34,6 +34,7 @@ class ApplyEnvprobesStage(RenderStage):
 
     required_inputs = ["EnvProbes"]
     required_pipes = ["GBuffer", "PerCellProbes", "CellIndices"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
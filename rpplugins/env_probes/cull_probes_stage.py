@@ -37,6 +37,7 @@ class CullProbesStage(RenderStage):
 
     required_inputs = ["EnvProbes"]
     required_pipes = ["CellListBuffer"]
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
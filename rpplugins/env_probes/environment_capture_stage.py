@@ -41,6 +41,8 @@ class EnvironmentCaptureStage(RenderStage):
 
     required_inputs = ["DefaultEnvmap", "AllLightsData", "maxLightIndex", "IESDatasetTex"]
     required_pipes = []
+    allow_target_aliasing = False
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
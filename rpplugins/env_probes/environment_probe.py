@@ -25,6 +25,7 @@ THE SOFTWARE.
 """
 
 import struct
+from array import array
 from panda3d.core import TransformState, Vec3, Mat4, BoundingSphere
 
 from rpcore.rpobject import RPObject
@@ -44,6 +45,10 @@ class EnvironmentProbe(RPObject):
         self._parallax_correction = True
         self._border_smoothness = 0.1
 
+        # Optional callback which gets called with the probe whenever it gets
+        # modified, used by the probe manager to track changed probes
+        self.on_modified = None
+
     @property
     def modified(self):
         """ Returns whether the probe was modified since the last write """
@@ -63,7 +68,7 @@ class EnvironmentProbe(RPObject):
     def parallax_correction(self, value):
         """ Sets whether parallax correction is enabled for this probe """
         self._parallax_correction = value
-        self._modified = True
+        self._mark_modified()
 
     @property
     def border_smoothness(self):
@@ -74,7 +79,7 @@ class EnvironmentProbe(RPObject):
     def border_smoothness(self, value):
         """ Sets the border smoothness factor """
         self._border_smoothness = value
-        self._modified = True
+        self._mark_modified()
 
     def set_pos(self, *args):
         """ Sets the probe position """
@@ -103,15 +108,21 @@ class EnvironmentProbe(RPObject):
         max_point = mat.xform_point(Vec3(1, 1, 1))
         radius = (mid_point - max_point).length()
         self._bounds = BoundingSphere(mid_point, radius)
+        self._mark_modified()
+
+    def _mark_modified(self):
+        """ Internal method to flag the probe as modified """
         self._modified = True
+        if self.on_modified is not None:
+            self.on_modified(self)
 
     @property
     def matrix(self):
         """ Returns the matrix of the probe """
         return self._transform.get_mat()
 
-    def write_to_buffer(self, buffer_ptr):
-        """ Writes the probe to a given byte buffer """
+    def get_data(self):
+        """ Returns the 20 floats which describe the probe on the gpu """
         data, mat = [], Mat4(self._transform.get_mat())
         mat.invert_in_place()
         for i in range(4):
@@ -124,10 +135,20 @@ class EnvironmentProbe(RPObject):
         data.append(self._bounds.get_center().y)
         data.append(self._bounds.get_center().z)
         data.append(self._bounds.get_radius())
-        byte_data = struct.pack("f" * 20, *data)
+        return data
+
+    def write_to_buffer(self, buffer_ptr):
+        """ Writes the probe to a given byte buffer """
+        byte_data = struct.pack("f" * 20, *self.get_data())
 
         # 4 = sizeof float, 20 = floats per cubemap
         bytes_per_probe = 4 * 20
         buffer_ptr.set_subdata(self.index * bytes_per_probe, bytes_per_probe, byte_data)
 
         self._modified = False
+
+    def write_to_array(self, data_array):
+        """ Writes the probe to a float array mirroring the gpu buffer, at the
+        location of its slot """
+        data_array[self.index * 20:(self.index + 1) * 20] = array("f", self.get_data())
+        self._modified = False
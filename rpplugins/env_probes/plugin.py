@@ -32,6 +32,7 @@ from rpcore.pluginbase.base_plugin import BasePlugin
 from rpcore.stages.cull_lights_stage import CullLightsStage
 
 from .probe_manager import ProbeManager
+from .scalable_probe_manager import ScalableProbeManager
 from .environment_capture_stage import EnvironmentCaptureStage
 from .apply_envprobes_stage import ApplyEnvprobesStage
 from .cull_probes_stage import CullProbesStage
@@ -47,7 +48,11 @@ class Plugin(BasePlugin):
     version = "beta (!)"
 
     def on_stage_setup(self):
-        self.probe_mgr = ProbeManager()
+        if self.get_setting("scalable_scheduling"):
+            self.probe_mgr = ScalableProbeManager()
+            self.probe_mgr.rescore_per_update = self.get_setting("probe_rescore_budget")
+        else:
+            self.probe_mgr = ProbeManager()
         self.probe_mgr.resolution = self.get_setting("probe_resolution")
         self.probe_mgr.diffuse_resolution = self.get_setting("diffuse_probe_resolution")
         self.probe_mgr.max_probes = self.get_setting("max_probes")
@@ -95,17 +100,18 @@ class Plugin(BasePlugin):
 
     def on_pre_render_update(self):
         if self._pipeline.task_scheduler.is_scheduled("envprobes_select_and_cull"):
-            self.probe_mgr.update()
-            self.pta_probes[0] = self.probe_mgr.num_probes
-            probe = self.probe_mgr.find_probe_to_update()
-            if probe:
-                probe.last_update = Globals.clock.get_frame_count()
-                self.capture_stage.active = True
-                self.capture_stage.set_probe(probe)
-
-                if self.is_plugin_enabled("pssm"):
-                    self.get_plugin_instance("pssm").scene_shadow_stage.request_focus(
-                        probe.bounds.get_center(), probe.bounds.get_radius()
-                    )
-            else:
-                self.capture_stage.active = False
+            with self._pipeline.task_scheduler.measure("envprobes_select_and_cull"):
+                self.probe_mgr.update()
+                self.pta_probes[0] = self.probe_mgr.num_probes
+                probe = self.probe_mgr.find_probe_to_update()
+                if probe:
+                    probe.last_update = Globals.clock.get_frame_count()
+                    self.capture_stage.active = True
+                    self.capture_stage.set_probe(probe)
+
+                    if self.is_plugin_enabled("pssm"):
+                        self.get_plugin_instance("pssm").scene_shadow_stage.request_focus(
+                            probe.bounds.get_center(), probe.bounds.get_radius()
+                        )
+                else:
+                    self.capture_stage.active = False
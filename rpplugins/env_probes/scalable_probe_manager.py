@@ -0,0 +1,241 @@
+"""
+
+RenderPipeline
+
+Copyright (c) 2014-2016 tobspr <tobias.springer1@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import sys
+import heapq
+from array import array
+
+from panda3d.core import BoundingVolume
+
+from rpcore.globals import Globals
+
+from .probe_manager import ProbeManager
+
+
+class ScalableProbeManager(ProbeManager):
+
+    """ Probe manager for scenes with a large amount of probes. Any amount of
+    probes can be registered, but only max_probes of them are resident on the
+    gpu at a time. The probes are kept in a priority queue, which is only
+    updated for modified probes and a bounded amount of other probes per
+    update, so there is no per-frame cost which grows with n log n.
+
+    The priority of a probe combines its distance to the camera, its
+    approximate screen coverage and the amount of frames since it was last
+    captured. When a non-resident probe gets captured, it takes over the slot
+    of the least relevant resident probe. """
+
+    def __init__(self):
+        """ Initializes a new probe manager """
+        ProbeManager.__init__(self)
+
+        # Amount of probes which get re-prioritized per update, in addition
+        # to the modified probes
+        self.rescore_per_update = 64
+
+        # Maximum amount of probes which get checked against the view frustum
+        # when searching for a probe to update
+        self.max_candidates = 16
+
+        # Weights of the priority terms. The staleness is measured in frames,
+        # the distance in world units and the coverage is in the range 0 .. 1
+        self.staleness_weight = 1.0
+        self.distance_weight = 1.0
+        self.coverage_weight = 50.0
+
+        self._heap = []
+        self._entries = {}
+        self._relevance = {}
+        self._deferred = {}
+        self._pending = set()
+        self._changed = set()
+        self._slots = []
+        self._rescore_offset = 0
+        self._entry_counter = 0
+        self._data = None
+        self._dirty_range = None
+
+    def init(self):
+        """ Creates the cubemap storage and the cpu copy of the probe data """
+        ProbeManager.init(self)
+        self._data = array("f", [0.0]) * (self.max_probes * 20)
+
+    def add_probe(self, probe):
+        """ Adds a new probe. The probe gets a slot once it gets captured. """
+        probe.last_update = -1
+        probe.index = -1
+        probe.on_modified = self._changed.add
+        self.probes.append(probe)
+        self._changed.add(probe)
+        return True
+
+    @property
+    def num_probes(self):
+        """ Returns the amount of probes which are resident on the gpu """
+        return len(self._slots)
+
+    def update(self):
+        """ Updates the priority of all modified probes and a window of the
+        other probes, and uploads the changed probe data in one write """
+        if not self.probes:
+            return
+        cam_pos = Globals.base.cam.get_pos(Globals.base.render)
+
+        count = min(self.rescore_per_update, len(self.probes))
+        for i in range(count):
+            self._pending.add(self.probes[(self._rescore_offset + i) % len(self.probes)])
+        self._rescore_offset = (self._rescore_offset + count) % len(self.probes)
+
+        self._pending.update(self._changed)
+        for probe in self._pending:
+            self._push(probe, cam_pos)
+        self._pending.clear()
+
+        for probe in self._changed:
+            if probe.index >= 0:
+                probe.write_to_array(self._data)
+                self._mark_dirty(probe.index)
+        self._changed.clear()
+
+        self._compact_heap()
+        self._upload_data()
+
+    def find_probe_to_update(self):
+        """ Finds the next probe which requires an update, or returns None.
+        At most max_candidates probes are examined, probes which were examined
+        but can not be updated are treated as if they were just updated. """
+        if not self.probes:
+            return None
+
+        view_frustum = Globals.base.camLens.make_bounds()
+        view_frustum.xform(Globals.base.cam.get_transform(Globals.base.render).get_mat())
+        frame = Globals.clock.get_frame_count()
+
+        for _ in range(self.max_candidates):
+            probe = self._pop()
+            if probe is None:
+                break
+
+            # The probe gets a new priority on the next update in any case
+            self._pending.add(probe)
+            if view_frustum.contains(probe.bounds) == BoundingVolume.IF_no_intersection:
+                self._deferred[probe] = frame
+                continue
+            if probe.index < 0 and not self._assign_slot(probe):
+                self._deferred[probe] = frame
+                continue
+            self._upload_data()
+            return probe
+        return None
+
+    def _compute_priority(self, probe, cam_pos):
+        """ Internal method to compute the queue key and the relevance of a
+        probe, lower values are more important """
+        center = probe.bounds.get_center()
+        radius = probe.bounds.get_radius()
+        distance = (center - cam_pos).length()
+        coverage = radius / max(distance, radius, 1e-5)
+        relevance = self.distance_weight * distance - self.coverage_weight * coverage
+
+        # Weighting the frame of the last update instead of the amount of
+        # frames since then keeps the keys constant while time passes
+        last_update = max(probe.last_update, self._deferred.get(probe, -1))
+        return self.staleness_weight * last_update + relevance, relevance
+
+    def _push(self, probe, cam_pos):
+        """ Internal method to (re-)insert a probe into the queue. A previous
+        entry of the probe gets invalidated and is skipped when popping. """
+        key, relevance = self._compute_priority(probe, cam_pos)
+        old_entry = self._entries.get(probe)
+        if old_entry is not None:
+            old_entry[2] = None
+        self._entry_counter += 1
+        entry = [key, self._entry_counter, probe]
+        self._entries[probe] = entry
+        self._relevance[probe] = relevance
+        heapq.heappush(self._heap, entry)
+
+    def _pop(self):
+        """ Internal method to remove the most important probe from the queue """
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            probe = entry[2]
+            if probe is not None:
+                del self._entries[probe]
+                return probe
+        return None
+
+    def _compact_heap(self):
+        """ Internal method to drop invalidated entries once they make up the
+        majority of the queue """
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if entry[2] is not None]
+            heapq.heapify(self._heap)
+
+    def _assign_slot(self, probe):
+        """ Internal method to make a probe resident. Takes a free slot, or the
+        slot of the least relevant resident probe if it is less relevant than
+        the given probe. Returns whether a slot was assigned. """
+        if len(self._slots) < self.max_probes:
+            probe.index = len(self._slots)
+            self._slots.append(probe)
+        else:
+            evicted = max(self._slots, key=self._relevance.__getitem__)
+            if self._relevance[evicted] <= self._relevance[probe]:
+                return False
+            probe.index = evicted.index
+            self._slots[probe.index] = probe
+            evicted.index = -1
+            evicted.last_update = -1
+            self._pending.add(evicted)
+
+        probe.write_to_array(self._data)
+        self._mark_dirty(probe.index)
+        return True
+
+    def _mark_dirty(self, slot):
+        """ Internal method to extend the range of slots which get uploaded """
+        if self._dirty_range is None:
+            self._dirty_range = (slot, slot + 1)
+        else:
+            self._dirty_range = (min(self._dirty_range[0], slot),
+                                 max(self._dirty_range[1], slot + 1))
+
+    def _upload_data(self):
+        """ Internal method to upload the changed slots with a single write """
+        if self._dirty_range is None:
+            return
+        start, end = self._dirty_range
+        self._dirty_range = None
+
+        # 4 = sizeof float, 20 = floats per cubemap
+        offset, size = start * 4 * 20, (end - start) * 4 * 20
+        data = self._data[start * 20:end * 20]
+        ram_image = self.dataset_storage.modify_ram_image()
+        if sys.version_info >= (3, 0):
+            memoryview(ram_image)[offset:offset + size] = data.tobytes()
+        else:
+            ram_image.set_subdata(offset, size, data.tostring())
@@ -37,6 +37,7 @@ class ForwardStage(RenderStage):
 
     required_inputs = ["DefaultEnvmap", "PrefilteredBRDF", "PrefilteredCoatBRDF"]
     required_pipes = ["SceneDepth", "ShadedScene", "CellIndices"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
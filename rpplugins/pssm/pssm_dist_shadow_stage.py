@@ -39,6 +39,8 @@ class PSSMDistShadowStage(RenderStage):
     distant objects. """
 
     required_inputs = []
+    allow_target_aliasing = False
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
@@ -72,13 +74,14 @@ class PSSMDistShadowStage(RenderStage):
 
             self.target.active = True
 
-            # Reposition camera before we capture the scene
-            cam_pos = Globals.base.cam.get_pos(Globals.base.render)
-            self.cam_node.set_pos(cam_pos + self.sun_vector * self.sun_distance)
-            self.cam_node.look_at(cam_pos)
-            self.cam_lens.set_film_size(self.clip_size, self.clip_size)
+            with self._pipeline.task_scheduler.measure("pssm_distant_shadows"):
+                # Reposition camera before we capture the scene
+                cam_pos = Globals.base.cam.get_pos(Globals.base.render)
+                self.cam_node.set_pos(cam_pos + self.sun_vector * self.sun_distance)
+                self.cam_node.look_at(cam_pos)
+                self.cam_lens.set_film_size(self.clip_size, self.clip_size)
 
-            snap_shadow_map(self.mvp, self.cam_node, self.resolution)
+                snap_shadow_map(self.mvp, self.cam_node, self.resolution)
 
         if self._pipeline.task_scheduler.is_scheduled("pssm_convert_distant_to_esm"):
             self.target_convert.active = True
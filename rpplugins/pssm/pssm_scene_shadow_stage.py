@@ -40,6 +40,8 @@ class PSSMSceneShadowStage(RenderStage):
 
     required_inputs = []
     required_pipes = []
+    allow_target_aliasing = False
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
@@ -78,23 +80,24 @@ class PSSMSceneShadowStage(RenderStage):
 
     def update(self):
         if self._pipeline.task_scheduler.is_scheduled("pssm_scene_shadows"):
-            if self.focus is None:
-                # When no focus is set, there is no point in rendering the shadow map
-                self.target.active = False
-            else:
-                focus_point, focus_size = self.focus
-
-                self.cam_lens.set_near_far(0.0, 2 * (focus_size + self.sun_distance))
-                self.cam_lens.set_film_size(2 * focus_size, 2 * focus_size)
-                self.cam_node.set_pos(
-                    focus_point + self.sun_vector * (self.sun_distance + focus_size))
-                self.cam_node.look_at(focus_point)
-
-                snap_shadow_map(self.mvp, self.cam_node, self.resolution)
-                self.target.active = True
-                self.pta_mvp[0] = self.mvp
-
-                self.focus = None
+            with self._pipeline.task_scheduler.measure("pssm_scene_shadows"):
+                if self.focus is None:
+                    # When no focus is set, there is no point in rendering the shadow map
+                    self.target.active = False
+                else:
+                    focus_point, focus_size = self.focus
+
+                    self.cam_lens.set_near_far(0.0, 2 * (focus_size + self.sun_distance))
+                    self.cam_lens.set_film_size(2 * focus_size, 2 * focus_size)
+                    self.cam_node.set_pos(
+                        focus_point + self.sun_vector * (self.sun_distance + focus_size))
+                    self.cam_node.look_at(focus_point)
+
+                    snap_shadow_map(self.mvp, self.cam_node, self.resolution)
+                    self.target.active = True
+                    self.pta_mvp[0] = self.mvp
+
+                    self.focus = None
         else:
             self.target.active = False
 
@@ -37,6 +37,8 @@ class PSSMShadowStage(RenderStage):
     """ This stage generates the depth-maps used for rendering PSSM """
 
     required_inputs = []
+    allow_target_aliasing = False
+    supports_size_classes = True
 
     def __init__(self, pipeline):
         RenderStage.__init__(self, pipeline)
@@ -34,6 +34,7 @@ class PSSMStage(RenderStage):
 
     required_inputs = []
     required_pipes = ["ShadedScene", "PSSMShadowAtlas", "GBuffer", "PSSMShadowAtlasPCF"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
@@ -40,6 +40,8 @@ class ScatteringEnvmapStage(RenderStage):
 
     required_pipes = []
     required_inputs = ["DefaultSkydome", "DefaultEnvmap"]
+    allow_target_aliasing = False
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
@@ -35,6 +35,7 @@ class ScatteringStage(RenderStage):
 
     required_pipes = ["ShadedScene", "GBuffer"]
     required_inputs = ["DefaultSkydome"]
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
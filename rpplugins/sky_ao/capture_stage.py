@@ -38,6 +38,7 @@ class SkyAOCaptureStage(RenderStage):
 
     required_inputs = []
     required_pipes = []
+    supports_size_classes = True
 
     @property
     def produced_pipes(self):
@@ -41,6 +41,8 @@ class VoxelizationStage(RenderStage):
 
     required_inputs = ["DefaultEnvmap", "AllLightsData", "maxLightIndex"]
     required_pipes = []
+    allow_target_aliasing = False
+    supports_size_classes = True
 
     # The different states of voxelization
     S_disabled = 0
@@ -2,12 +2,21 @@
 
 Precomputed GI using spherical harmonics.
 
+The probe grid is split into blocks, which get baked by multiple worker
+processes, each rendering offscreen. Every baked block is stored as checkpoint,
+so an interrupted bake continues where it stopped when started again. While
+baking, the tiled output file and raw-bake.png get refined progressively.
+
 """
 
 from __future__ import division, print_function
 
 import os
 import sys
+import time
+import argparse
+import multiprocessing
+from array import array
 
 os.chdir(os.path.realpath(os.path.dirname(__file__)))
 sys.path.insert(0, "../../")
@@ -19,10 +28,30 @@ from direct.showbase.ShowBase import ShowBase
 from rpcore.globals import Globals
 from rpcore.render_target import RenderTarget
 from rplibs.progressbar import ETA, ProgressBar, Percentage, Bar, Counter, Rate
+from rplibs.six.moves.queue import Empty  # pylint: disable=import-error
+
+from bake_engine import ProbeGrid, CheckpointStore, TiledBakeFile, FLOATS_PER_PROBE
+from bake_engine import array_to_bytes, array_from_bytes
+
+SCENE = "scene/scene.bam"
+SUN_VECTOR = (0.2, 0.5, 1.2)
+CAPTURE_RESOLUTION = 32
+SUN_SHADOW_MAP_RESOLUTION = 2048
+NUM_PROBES = (64, 64, 64)
+DIVISOR = 128
+NUM_BAKERS = 8
+PADDING = 0.5
+
+CHECKPOINT_DIR = "checkpoints"
+OUTPUT_FILE = "gi-bake.rpgi"
+TILE_ROWS = 16
 
-class Application(ShowBase):
 
-    def __init__(self):
+class ProbeBaker(ShowBase):
+
+    """ Renders the probes of a block. Each worker process runs one baker. """
+
+    def __init__(self, block_size):
 
         # Load settings
         load_prc_file_data("", """
@@ -43,30 +72,26 @@ class Application(ShowBase):
         ShowBase.__init__(self)
         Globals.load(self)
         Globals.resolution = LVecBase2i(1600, 900)
-        sun_vector = Vec3(0.2, 0.5, 1.2).normalized()
-        capture_resolution = 32
-        sun_shadow_map_resolution = 2048
-        num_probes = LVecBase3i(64)
-        divisor = 128
-        num_bakers = 8
-        padding = 0.5
+        sun_vector = Vec3(*SUN_VECTOR).normalized()
 
         for region in self.win.get_display_regions():
             region.set_active(False)
 
         print("Loading scene ...")
         # model = loader.load_model("resources/test-scene.bam")
-        model = loader.load_model("scene/scene.bam")
+        model = loader.load_model(SCENE)
         # model = loader.load_model("scene/LivingRoom.egg")
         model.reparent_to(render)
         model.flatten_strong()
 
         start_point, end_point = model.get_tight_bounds()
-        start_point -= padding
-        end_point += padding
+        start_point -= PADDING
+        end_point += PADDING
         diameter = (start_point - end_point).length() * 0.5
         model_center = (start_point + end_point) * 0.5
-        model_size = end_point - start_point
+        self.start_point = start_point
+        self.end_point = end_point
+        self.model_size = end_point - start_point
 
         print("Rendering sun shadow map ..")
         sun_shadow_cam = Camera("SunShadowCamera")
@@ -79,7 +104,7 @@ class Application(ShowBase):
         sun_shadow_cam_np.look_at(model_center)
 
         sun_shadow_target = RenderTarget()
-        sun_shadow_target.size = sun_shadow_map_resolution
+        sun_shadow_target.size = SUN_SHADOW_MAP_RESOLUTION
         sun_shadow_target.add_depth_attachment(bits=32)
         sun_shadow_target.prepare_render(sun_shadow_cam_np)
 
@@ -87,28 +112,22 @@ class Application(ShowBase):
         sun_shadow_target.active = False
         shadow_mvp = self.get_mvp(sun_shadow_cam_np)
 
-        print("Computing first bounce ..")
-
-        # Target to store all results
-        max_probes = num_probes.x * num_probes.y * num_probes.z
+        # Target to store the results of a block, uses the same layout as
+        # the final data, so the probes of a block are stored consecutively
+        num_rows = (block_size + DIVISOR - 1) // DIVISOR
+        self.block_data = Texture("BlockProbeResult")
+        self.block_data.setup_2d_texture(6 * DIVISOR, num_rows, Texture.T_float, Texture.F_rgba16)
+        self.block_data.set_clear_color(Vec4(1.0, 0.6, 0.2, 1.0))
 
-        if max_probes % divisor != 0:
-            print("WARNING: Bad divisor:", divisor, "for", max_probes)
-
-        num_rows = (max_probes + divisor - 1) // divisor
-        final_data = Texture("FinalProbeResult")
-        final_data.setup_2d_texture(6 * divisor, num_rows, Texture.T_float, Texture.F_rgba16)
-        final_data.set_clear_color(Vec4(1.0, 0.6, 0.2, 1.0))
-
-        worker_handles = []
+        self.bakers = []
 
         store_shader = Shader.load(Shader.SL_GLSL, "resources/default.vert.glsl", "resources/copy_cubemap.frag.glsl")
         convolute_shader = Shader.load(Shader.SL_GLSL, "resources/default.vert.glsl", "resources/convolute.frag.glsl")
 
-        for worked_id in range(num_bakers):
+        for worked_id in range(NUM_BAKERS):
             probe_position = Vec3(0, 0, 4)
             capture_target = RenderTarget()
-            capture_target.size = capture_resolution * 6, capture_resolution
+            capture_target.size = CAPTURE_RESOLUTION * 6, CAPTURE_RESOLUTION
             capture_target.add_depth_attachment(bits=16)
             capture_target.add_color_attachment(bits=16, alpha=True)
             capture_target.prepare_render(None)
@@ -157,11 +176,11 @@ class Application(ShowBase):
             capture_cams[5].set_r(180)
 
             destination_cubemap = Texture("TemporaryCubemap")
-            destination_cubemap.setup_cube_map(capture_resolution, Texture.T_float, Texture.F_rgba16)
+            destination_cubemap.setup_cube_map(CAPTURE_RESOLUTION, Texture.T_float, Texture.F_rgba16)
 
             # Target to convert the FBO to a cubemap
             target_store_cubemap = RenderTarget()
-            target_store_cubemap.size = capture_resolution * 6, capture_resolution
+            target_store_cubemap.size = CAPTURE_RESOLUTION * 6, CAPTURE_RESOLUTION
             target_store_cubemap.prepare_buffer()
             target_store_cubemap.set_shader_inputs(
                 SourceTex=capture_target.color_tex,
@@ -177,78 +196,44 @@ class Application(ShowBase):
             target_convolute.prepare_buffer()
             target_convolute.set_shader_inputs(
                 SourceTex=destination_cubemap,
-                DestTex=final_data,
+                DestTex=self.block_data,
                 storeCoord=store_pta)
             target_convolute.shader = convolute_shader
 
-            # Set initial shader
-            shader = Shader.load(Shader.SL_GLSL,
-                "resources/first-bounce.vert.glsl", "resources/first-bounce.frag.glsl")
-            render.set_shader(shader)
-            render.set_shader_inputs(
-                ShadowMap=sun_shadow_target.depth_tex,
-                shadowMVP=shadow_mvp,
-                sunVector=sun_vector)
-
-            worker_handles.append((capture_rig, store_pta))
-
-        print("Preparing to render", max_probes, "probes ..")
-        widgets = [Counter(), "  ", Bar(), "  ", Percentage(), "  ", ETA(), " ", Rate()]
-        progressbar = ProgressBar(widgets=widgets, maxval=max_probes).start()
-        progressbar.update(0)
-
-        work_queue = []
-
-        for z_pos in range(num_probes.z):
-            for y_pos in range(num_probes.y):
-                for x_pos in range(num_probes.x):
-                    index = x_pos + y_pos * num_probes.x + z_pos * num_probes.y * num_probes.x
-                    #     print("Baking", index, "out of", max_probes)
-                    offs_x = start_point.x + x_pos / (num_probes.x + 0.5) * model_size.x
-                    offs_y = start_point.y + y_pos / (num_probes.y + 0.5) * model_size.y
-                    offs_z = start_point.z + z_pos / (num_probes.z + 0.5) * model_size.z
-
-                    store_x = index % divisor
-                    store_y = index // divisor
-
-                    work_queue.append((Vec3(offs_x, offs_y, offs_z), LVecBase2i(store_x, store_y)))
-
-        for i, (pos, store) in enumerate(work_queue):
-            worker_handles[i%num_bakers][0].set_pos(pos)
-            worker_handles[i%num_bakers][1][0] = store
-            if i % num_bakers == num_bakers - 1:
-                self.render_frame()
-                progressbar.update(i)
-
-
-        progressbar.finish()
-        self.render_frame()
-
-
-        print("Writing out data ..")
-        self.graphicsEngine.extract_texture_data(final_data, self.win.gsg)
-        final_data.write("raw-bake.png")
-
-        print("Writing out configuration")
-        with open("_bake_params.py", "w") as handle:
-            handle.write("#Autogenerated\n")
-            handle.write("from panda3d.core import LPoint3f, LVecBase3i, LVector3f\n")
-            handle.write("BAKE_MESH_START = " + str(start_point) + "\n")
-            handle.write("BAKE_MESH_END = " + str(end_point) + "\n")
-            handle.write("BAKE_MESH_PROBECOUNT = " + str(num_probes) + "\n")
-            handle.write("BAKE_DIVISOR = " + str(divisor) + "\n")
-            handle.write("BAKE_SUN_VECTOR = " + str(sun_vector) + "\n")
-
-        with open("_bake_params.glsl", "w") as handle:
-            handle.write("// Autogenerated\n")
-            handle.write("#define LPoint3f vec3\n")
-            handle.write("#define LVector3f vec3\n")
-            handle.write("#define LVecBase3i ivec3\n")
-            handle.write("const vec3 bake_mesh_start = " + str(start_point) + ";\n")
-            handle.write("const vec3 bake_mesh_end = " + str(end_point) + ";\n")
-            handle.write("const ivec3 bake_mesh_probecount = " + str(num_probes) + ";\n")
-            handle.write("const int bake_divisor = " + str(divisor) + ";\n")
-            handle.write("const vec3 sun_vector = " + str(sun_vector) + ";\n")
+            self.bakers.append((capture_rig, store_pta))
+
+        # Set initial shader
+        shader = Shader.load(Shader.SL_GLSL,
+            "resources/first-bounce.vert.glsl", "resources/first-bounce.frag.glsl")
+        render.set_shader(shader)
+        render.set_shader_inputs(
+            ShadowMap=sun_shadow_target.depth_tex,
+            shadowMVP=shadow_mvp,
+            sunVector=sun_vector)
+
+    def get_probe_position(self, grid, index):
+        """ Returns the world space position of a probe """
+        x_pos, y_pos, z_pos = grid.get_coordinate(index)
+        return Vec3(
+            self.start_point.x + x_pos / (NUM_PROBES[0] + 0.5) * self.model_size.x,
+            self.start_point.y + y_pos / (NUM_PROBES[1] + 0.5) * self.model_size.y,
+            self.start_point.z + z_pos / (NUM_PROBES[2] + 0.5) * self.model_size.z)
+
+    def bake_block(self, grid, indices):
+        """ Bakes the probes of a block, returns their data """
+        for offset in range(0, len(indices), NUM_BAKERS):
+            num_batch = min(NUM_BAKERS, len(indices) - offset)
+            for i, (capture_rig, store_pta) in enumerate(self.bakers):
+                # Unused bakers of the last batch render the last probe again,
+                # so they never write to a slot of a different probe
+                slot = offset + min(i, num_batch - 1)
+                capture_rig.set_pos(self.get_probe_position(grid, indices[slot]))
+                store_pta[0] = LVecBase2i(slot % DIVISOR, slot // DIVISOR)
+            self.render_frame()
+
+        self.graphicsEngine.extract_texture_data(self.block_data, self.win.gsg)
+        data = array_from_bytes(bytes(memoryview(self.block_data.get_ram_image_as("RGBA"))))
+        return data[:len(indices) * FLOATS_PER_PROBE]
 
     def render_frame(self):
         """ Convenience function to render a frame """
@@ -259,6 +244,225 @@ class Application(ShowBase):
         return render.get_transform(cam_node).get_mat() * cam_node.node().get_lens().get_projection_mat()
 
 
-Application()
-
+def worker_main(worker_id, block_size, task_queue, result_queue):
+    """ Main loop of a worker process, bakes blocks until it receives None """
+    baker = ProbeBaker(block_size)
+    result_queue.put(("ready", worker_id, (tuple(baker.start_point), tuple(baker.end_point))))
+
+    grid = ProbeGrid(NUM_PROBES)
+    checkpoints = CheckpointStore(CHECKPOINT_DIR)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        block_id, indices = task
+        checkpoints.store(block_id, baker.bake_block(grid, indices))
+        result_queue.put(("done", worker_id, block_id))
+
+
+def write_bake_params(start_point, end_point):
+    """ Writes the bake parameters for the display script and the shaders """
+    start_point, end_point = LPoint3f(*start_point), LPoint3f(*end_point)
+    num_probes = LVecBase3i(*NUM_PROBES)
+    sun_vector = Vec3(*SUN_VECTOR).normalized()
+
+    with open("_bake_params.py", "w") as handle:
+        handle.write("#Autogenerated\n")
+        handle.write("from panda3d.core import LPoint3f, LVecBase3i, LVector3f\n")
+        handle.write("BAKE_MESH_START = " + str(start_point) + "\n")
+        handle.write("BAKE_MESH_END = " + str(end_point) + "\n")
+        handle.write("BAKE_MESH_PROBECOUNT = " + str(num_probes) + "\n")
+        handle.write("BAKE_DIVISOR = " + str(DIVISOR) + "\n")
+        handle.write("BAKE_SUN_VECTOR = " + str(sun_vector) + "\n")
+
+    with open("_bake_params.glsl", "w") as handle:
+        handle.write("// Autogenerated\n")
+        handle.write("#define LPoint3f vec3\n")
+        handle.write("#define LVector3f vec3\n")
+        handle.write("#define LVecBase3i ivec3\n")
+        handle.write("const vec3 bake_mesh_start = " + str(start_point) + ";\n")
+        handle.write("const vec3 bake_mesh_end = " + str(end_point) + ";\n")
+        handle.write("const ivec3 bake_mesh_probecount = " + str(num_probes) + ";\n")
+        handle.write("const int bake_divisor = " + str(DIVISOR) + ";\n")
+        handle.write("const vec3 sun_vector = " + str(sun_vector) + ";\n")
+
+
+def write_raw_bake(data, num_probes):
+    """ Writes the probe data as texture, as read by the display script """
+    num_rows = (num_probes + DIVISOR - 1) // DIVISOR
+    padding = num_rows * DIVISOR - num_probes
+    final_data = Texture("FinalProbeResult")
+    final_data.setup_2d_texture(6 * DIVISOR, num_rows, Texture.T_float, Texture.F_rgba16)
+    final_data.set_ram_image_as(
+        array_to_bytes(data) + b"\0" * (padding * FLOATS_PER_PROBE * 4), "RGBA")
+    final_data.write("raw-bake.png")
+
+
+class BakeJob(object):
+
+    """ Distributes the blocks of the bake to the worker processes, collects
+    the results and writes the output """
+
+    def __init__(self, num_workers, block_size, restart, output_interval):
+        self.num_workers = num_workers
+        self.block_size = block_size
+        self.output_interval = output_interval
+        self.grid = ProbeGrid(NUM_PROBES)
+        self.blocks = self.grid.make_blocks(block_size)
+        self.checkpoints = CheckpointStore(CHECKPOINT_DIR)
+        self.data = array("f", [0.0]) * (self.grid.count * FLOATS_PER_PROBE)
+        self.done = bytearray(self.grid.count)
+        self.output = None
+
+        if self.grid.count % DIVISOR != 0:
+            print("WARNING: Bad divisor:", DIVISOR, "for", self.grid.count)
+
+        settings = {
+            "scene": SCENE,
+            "scene_size": os.path.getsize(SCENE),
+            "scene_mtime": os.path.getmtime(SCENE),
+            "sun_vector": SUN_VECTOR,
+            "capture_resolution": CAPTURE_RESOLUTION,
+            "sun_shadow_map_resolution": SUN_SHADOW_MAP_RESOLUTION,
+            "num_probes": NUM_PROBES,
+            "divisor": DIVISOR,
+            "num_bakers": NUM_BAKERS,
+            "padding": PADDING,
+            "block_size": block_size,
+        }
+        # Compare the settings as they are stored in json
+        settings = dict((key, list(val) if isinstance(val, tuple) else val)
+                        for key, val in settings.items())
+        self.manifest = self.checkpoints.open(settings, restart)
+
+    def apply_block(self, block_id, block_data):
+        """ Copies the data of a baked block into the probe data """
+        for i, index in enumerate(self.blocks[block_id]):
+            self.data[index * FLOATS_PER_PROBE:(index + 1) * FLOATS_PER_PROBE] = \
+                block_data[i * FLOATS_PER_PROBE:(i + 1) * FLOATS_PER_PROBE]
+            self.done[index] = 1
+
+    def load_block(self, block_id):
+        """ Loads a block from its checkpoint, returns whether it exists """
+        block_data = self.checkpoints.load(block_id, len(self.blocks[block_id]))
+        if block_data is None:
+            return False
+        self.apply_block(block_id, block_data)
+        return True
+
+    def set_bounds(self, bounds):
+        """ Stores the bounds of the scene and creates the output file """
+        self.manifest["bounds"] = bounds
+        self.checkpoints.save_manifest(self.manifest)
+        write_bake_params(*bounds)
+        self.output = TiledBakeFile(OUTPUT_FILE, self.grid, DIVISOR, TILE_ROWS, {
+            "bake_mesh_start": bounds[0],
+            "bake_mesh_end": bounds[1],
+            "bake_mesh_probecount": NUM_PROBES,
+            "sun_vector": SUN_VECTOR,
+        })
+
+    def write_output(self):
+        """ Writes the current state of the bake to the output files """
+        if self.output:
+            write_raw_bake(self.output.update(self.data, self.done), self.grid.count)
+
+    def run(self):
+        """ Runs the bake, returns whether all blocks were baked """
+        pending = [block_id for block_id in range(len(self.blocks)) if not self.load_block(block_id)]
+        num_done = sum(self.done)
+        if num_done:
+            print("Resuming bake,", num_done, "of", self.grid.count, "probes were already baked")
+
+        if not pending:
+            self.set_bounds(self.manifest["bounds"])
+            self.write_output()
+            return True
+
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue()
+        for block_id in pending:
+            task_queue.put((block_id, self.blocks[block_id]))
+
+        num_workers = min(self.num_workers, len(pending))
+        workers = []
+        for worker_id in range(num_workers):
+            task_queue.put(None)
+            worker = multiprocessing.Process(
+                target=worker_main, name="BakeWorker-" + str(worker_id),
+                args=(worker_id, self.block_size, task_queue, result_queue))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        print("Baking", len(pending), "blocks with", num_workers, "workers ..")
+        widgets = [Counter(), "  ", Bar(), "  ", Percentage(), "  ", ETA(), " ", Rate()]
+        progressbar = ProgressBar(widgets=widgets, maxval=self.grid.count).start()
+        progressbar.update(num_done)
+
+        num_remaining = len(pending)
+        level_pending = [0] * self.grid.num_levels
+        for block_id in pending:
+            level_pending[self.grid.get_level(self.blocks[block_id][0])] += 1
+        last_output = time.time()
+        try:
+            while num_remaining > 0:
+                try:
+                    message = result_queue.get(timeout=1.0)
+                except Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        print("\nAll workers stopped, run the bake again to resume.")
+                        return False
+                    continue
+
+                if message[0] == "ready":
+                    if self.output is None:
+                        self.set_bounds(message[2])
+                        self.write_output()
+                    continue
+
+                block_id = message[2]
+                self.load_block(block_id)
+                num_remaining -= 1
+                progressbar.update(sum(self.done))
+
+                # Refine the output once in a while, and whenever a level completed
+                level = self.grid.get_level(self.blocks[block_id][0])
+                level_pending[level] -= 1
+                if level_pending[level] == 0 or time.time() - last_output > self.output_interval:
+                    self.write_output()
+                    last_output = time.time()
+
+        except KeyboardInterrupt:
+            print("\nInterrupted, run the bake again to resume.")
+            return False
+
+        finally:
+            for worker in workers:
+                worker.terminate()
+            self.write_output()
 
+        progressbar.finish()
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bakes the GI probes of the scene")
+    parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() // 2),
+                        help="Amount of worker processes, each rendering offscreen")
+    parser.add_argument("--block-size", type=int, default=512,
+                        help="Amount of probes per block, each block gets stored as checkpoint")
+    parser.add_argument("--output-interval", type=float, default=60.0,
+                        help="Seconds between refinements of the output while baking")
+    parser.add_argument("--restart", action="store_true",
+                        help="Discard existing checkpoints and start from scratch")
+    args = parser.parse_args()
+
+    try:
+        job = BakeJob(args.workers, args.block_size, args.restart, args.output_interval)
+    except ValueError as msg:
+        print("ERROR:", msg, "- use --restart to start a new bake")
+        sys.exit(1)
+
+    if job.run():
+        print("Bake finished, written", OUTPUT_FILE, "and raw-bake.png")
@@ -0,0 +1,263 @@
+"""
+
+Chunked bake engine for the GI bake. Splits the probe grid into blocks,
+stores each baked block as checkpoint, and writes the tiled output file.
+
+Probes are baked coarse to fine: Refinement level 0 contains every 8th probe
+on each axis, each following level halves the spacing. Probes which are not
+baked yet take the value of the closest baked probe of a coarser level, so the
+output is usable early on and gets refined while baking.
+
+The data of each probe are 6 rgba texels, one per direction, stored as 32 bit
+floats. Probes are stored in the order of their index, which matches the
+layout of the texture the display shader reads (divisor probes per row).
+
+"""
+
+from __future__ import division, print_function
+
+import os
+import json
+import struct
+import hashlib
+from array import array
+
+FLOATS_PER_PROBE = 6 * 4
+
+
+def array_to_bytes(data):
+    """ Converts a float array to bytes, python 2 and 3 compatible """
+    return data.tobytes() if hasattr(data, "tobytes") else data.tostring()
+
+
+def array_from_bytes(data):
+    """ Converts bytes to a float array, python 2 and 3 compatible """
+    result = array("f")
+    if hasattr(result, "frombytes"):
+        result.frombytes(data)
+    else:
+        result.fromstring(data)
+    return result
+
+
+def write_atomic(path, data):
+    """ Writes a file via a temporary file, so a crash while writing never
+    leaves a partially written file behind """
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as handle:
+        handle.write(data)
+    if os.path.isfile(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+
+class ProbeGrid(object):
+
+    """ Probe grid, splits the probes into refinement levels and blocks """
+
+    def __init__(self, num_probes, num_levels=4):
+        self.num_probes = tuple(num_probes)
+        self.num_levels = num_levels
+        self.max_step = 2 ** (num_levels - 1)
+        self.count = num_probes[0] * num_probes[1] * num_probes[2]
+
+    def get_coordinate(self, index):
+        """ Returns the grid position of a probe index """
+        num_x, num_y = self.num_probes[0], self.num_probes[1]
+        return index % num_x, (index // num_x) % num_y, index // (num_x * num_y)
+
+    def get_index(self, x, y, z):
+        """ Returns the probe index of a grid position """
+        return x + y * self.num_probes[0] + z * self.num_probes[0] * self.num_probes[1]
+
+    def get_level(self, index):
+        """ Returns the refinement level of a probe """
+        x, y, z = self.get_coordinate(index)
+        step = self.max_step
+        for level in range(self.num_levels):
+            if x % step == 0 and y % step == 0 and z % step == 0:
+                return level
+            step //= 2
+        return self.num_levels - 1
+
+    def make_blocks(self, block_size):
+        """ Splits the probes into blocks of up to block_size probes. Blocks
+        are ordered coarse to fine, and never contain multiple levels. """
+        levels = [[] for i in range(self.num_levels)]
+        for index in range(self.count):
+            levels[self.get_level(index)].append(index)
+        blocks = []
+        for indices in levels:
+            for offset in range(0, len(indices), block_size):
+                blocks.append(indices[offset:offset + block_size])
+        return blocks
+
+    def get_fill_sources(self, done):
+        """ Returns for each probe the index of the probe whose data it should
+        use, and the step to that probe (0 if the probe itself is baked). The
+        source is the closest baked coarser probe, or -1 if there is none. """
+        sources = array("i", [-1]) * self.count
+        steps = array("i", [0]) * self.count
+        for index in range(self.count):
+            if done[index]:
+                sources[index] = index
+                continue
+            x, y, z = self.get_coordinate(index)
+            step = 2
+            while step <= self.max_step:
+                source = self.get_index(x - x % step, y - y % step, z - z % step)
+                if done[source]:
+                    sources[index] = source
+                    steps[index] = step
+                    break
+                step *= 2
+        return sources, steps
+
+
+class CheckpointStore(object):
+
+    """ Stores baked blocks as files in a directory. The directory also
+    contains a manifest with the bake settings, so checkpoints of a bake with
+    different settings are never mixed up. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+
+    def get_block_path(self, block_id):
+        return os.path.join(self.directory, "block-{:05d}.bin".format(block_id))
+
+    def open(self, settings, restart=False):
+        """ Prepares the directory for a bake with the given settings. Returns
+        the stored manifest, or raises a ValueError if the existing
+        checkpoints were created with different settings. """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        manifest = None
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "r") as handle:
+                manifest = json.load(handle)
+            if restart or manifest.get("settings") != settings:
+                if not restart:
+                    raise ValueError("The checkpoints were created with different bake settings")
+                manifest = None
+
+        if manifest is None:
+            self.clear()
+            manifest = {"settings": settings}
+            self.save_manifest(manifest)
+        return manifest
+
+    def save_manifest(self, manifest):
+        write_atomic(self.manifest_path, json.dumps(manifest, indent=4).encode("utf-8"))
+
+    def clear(self):
+        """ Removes all checkpoints """
+        for filename in os.listdir(self.directory):
+            if filename.startswith("block-") or filename == "manifest.json":
+                os.remove(os.path.join(self.directory, filename))
+
+    def store(self, block_id, data):
+        """ Stores the float data of a baked block """
+        write_atomic(self.get_block_path(block_id), array_to_bytes(data))
+
+    def load(self, block_id, num_probes):
+        """ Loads the data of a block, returns None if the block was not baked
+        yet or the checkpoint is damaged """
+        path = self.get_block_path(block_id)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as handle:
+            data = array_from_bytes(handle.read())
+        if len(data) != num_probes * FLOATS_PER_PROBE:
+            return None
+        return data
+
+
+class TiledBakeFile(object):
+
+    """ Writes the bake result as tiled file. The file starts with the magic
+    bytes, the format version, the length of the json metadata and the
+    metadata itself. It is followed by the tile table, with one byte per tile
+    storing the coarsest fill step used in the tile as power of two (0 if all
+    probes of the tile are baked, 255 if the tile contains no data yet), and
+    the rgba float data of the tiles. Each tile covers tile_rows rows of the
+    texture. Only tiles whose data changed get rewritten. """
+
+    MAGIC = b"RPGI"
+    VERSION = 1
+    NO_DATA = 255
+
+    def __init__(self, path, grid, divisor, tile_rows, metadata):
+        self.path = path
+        self.grid = grid
+        self.probes_per_tile = divisor * tile_rows
+        self.num_tiles = (grid.count + self.probes_per_tile - 1) // self.probes_per_tile
+        self.tile_size = self.probes_per_tile * FLOATS_PER_PROBE * 4
+
+        metadata = dict(metadata)
+        metadata.update({
+            "format": "rgba32f",
+            "width": 6 * divisor,
+            "height": (grid.count + divisor - 1) // divisor,
+            "divisor": divisor,
+            "tile_rows": tile_rows,
+            "num_tiles": self.num_tiles,
+            "num_levels": grid.num_levels,
+        })
+        header = json.dumps(metadata, sort_keys=True).encode("utf-8")
+        self.header = self.MAGIC + struct.pack("<HI", self.VERSION, len(header)) + header
+        self.table_offset = len(self.header)
+        self.data_offset = self.table_offset + self.num_tiles
+        self._tile_states = [None] * self.num_tiles
+
+        with open(self.path, "wb") as handle:
+            handle.write(self.header)
+            handle.write(bytearray([self.NO_DATA] * self.num_tiles))
+            handle.write(b"\0" * (self.tile_size * self.num_tiles))
+
+    def update(self, data, done):
+        """ Writes the tiles which changed since the last update. Missing
+        probes get filled from coarser levels. Returns the filled data. """
+        sources, steps = self.grid.get_fill_sources(done)
+        filled = array("f", data)
+        for index in range(self.grid.count):
+            source = sources[index]
+            if source != index and source >= 0:
+                offset, source_offset = index * FLOATS_PER_PROBE, source * FLOATS_PER_PROBE
+                filled[offset:offset + FLOATS_PER_PROBE] = data[source_offset:source_offset + FLOATS_PER_PROBE]
+
+        with open(self.path, "r+b") as handle:
+            for tile in range(self.num_tiles):
+                start = tile * self.probes_per_tile
+                end = min(start + self.probes_per_tile, self.grid.count)
+                max_step = max(steps[start:end])
+                if min(sources[start:end]) < 0:
+                    state = self.NO_DATA
+                else:
+                    state = max_step.bit_length() - 1 if max_step else 0
+                tile_data = array_to_bytes(filled[start * FLOATS_PER_PROBE:end * FLOATS_PER_PROBE])
+                tile_hash = (state, hashlib.sha1(tile_data).digest())
+                if self._tile_states[tile] == tile_hash:
+                    continue
+                self._tile_states[tile] = tile_hash
+                handle.seek(self.table_offset + tile)
+                handle.write(bytearray([state]))
+                handle.seek(self.data_offset + tile * self.tile_size)
+                handle.write(tile_data)
+        return filled
+
+    @classmethod
+    def read_header(cls, path):
+        """ Reads the metadata and the tile table of a bake file """
+        with open(path, "rb") as handle:
+            magic = handle.read(4)
+            if magic != cls.MAGIC:
+                raise ValueError("Not a bake file: " + path)
+            version, header_size = struct.unpack("<HI", handle.read(6))
+            if version != cls.VERSION:
+                raise ValueError("Unsupported bake file version: " + str(version))
+            metadata = json.loads(handle.read(header_size).decode("utf-8"))
+            tile_table = bytearray(handle.read(metadata["num_tiles"]))
+        return metadata, tile_table
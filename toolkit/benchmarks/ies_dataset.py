@@ -0,0 +1,86 @@
+"""
+
+Micro-benchmark comparing the scalar and the numpy implementation of the
+python IESDataset LUT generation.
+
+It generates synthetic profiles with only vertical angles, with a symmetric
+quarter and with a full asymmetric horizontal distribution, and writes them
+into a layer of a 512x512 texture, like the IESProfileLoader does. Both
+implementations must produce identical texture data.
+
+(c) 2016 tobpsr
+
+"""
+
+from __future__ import print_function, division
+
+import sys
+import time
+import random
+
+sys.path.insert(0, "../../")
+
+from panda3d.core import Texture, PTAFloat  # noqa
+
+from rplibs.six.moves import range  # noqa # pylint: disable=import-error
+from rpcore.pynative.ies_dataset import IESDataset  # noqa
+
+RESOLUTION = 512
+NUM_LAYERS = 2
+
+PROFILES = (
+    ("vertical only", [0, 5, 15, 30, 45, 60, 75, 90], [0]),
+    ("quarter", [i * 2.5 for i in range(73)], [0, 22.5, 45, 67.5, 90]),
+    ("asymmetric", [i * 5.0 for i in range(37)], [i * 15.0 for i in range(25)]),
+)
+
+
+def to_pta(values):
+    """ Converts a list to a PTAFloat """
+    pta = PTAFloat.empty_array(len(values))
+    for i, value in enumerate(values):
+        pta[i] = value
+    return pta
+
+
+def make_dataset(vertical_angles, horizontal_angles):
+    """ Constructs a dataset with random normalized candela values """
+    dataset = IESDataset()
+    dataset.set_vertical_angles(to_pta(vertical_angles))
+    dataset.set_horizontal_angles(to_pta(horizontal_angles))
+    dataset.set_candela_values(to_pta(
+        [random.random() for i in range(len(vertical_angles) * len(horizontal_angles))]))
+    return dataset
+
+
+def make_texture():
+    """ Constructs a texture like the IESDatasets storage """
+    tex = Texture("IESDatasets")
+    tex.setup_3d_texture(RESOLUTION, RESOLUTION, NUM_LAYERS, Texture.T_float, Texture.F_r16)
+    return tex
+
+
+def run(generate):
+    """ Generates the dataset into the second layer, after the first layer was
+    loaded, and returns the time spent in seconds as well as the layer data """
+    tex = make_texture()
+    generate(tex, 0)
+    start = time.time()
+    generate(tex, 1)
+    duration = time.time() - start
+    page_size = tex.get_expected_ram_page_size()
+    return duration, bytes(tex.get_ram_image())[page_size:2 * page_size]
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    print("Resolution:", RESOLUTION, "x", RESOLUTION)
+    print("{:<16} {:>12} {:>12} {:>10} {:>10}".format(
+        "Profile", "scalar", "numpy", "speedup", "identical"))
+    for name, vertical_angles, horizontal_angles in PROFILES:
+        dataset = make_dataset(vertical_angles, horizontal_angles)
+        scalar_time, scalar_data = run(dataset.generate_dataset_texture_into_scalar)
+        numpy_time, numpy_data = run(dataset.generate_dataset_texture_into_vectorized)
+        print("{:<16} {:>10.2f}ms {:>10.2f}ms {:>9.1f}x {:>10}".format(
+            name, scalar_time * 1000.0, numpy_time * 1000.0,
+            scalar_time / max(numpy_time, 1e-6), str(scalar_data == numpy_data)))
@@ -0,0 +1,144 @@
+"""
+
+Loopback benchmark for the NetworkCommunication wire protocol.
+
+It sends material updates to a local test port, once as plain text with one
+datagram per command, once framed with one command per datagram and once
+framed with batches of commands. The receiving side uses the same bounded
+CommandQueue as the pipeline, drained at 60 fps. Two workloads are measured:
+updates of many different materials, and a slider drag which updates the same
+few materials over and over.
+
+The commands are sent from a separate process at full speed. For each run the
+sent messages per second, the datagrams lost on the socket, the commands
+dropped from the full queue and the resulting drop rate are printed. Commands
+replaced by newer ones with the same key are not counted as dropped. The last
+column shows whether the final state of every material arrived, which is what
+last-write-wins coalescing guarantees as long as no datagram is lost.
+
+(c) 2016 tobpsr
+
+"""
+
+from __future__ import print_function, division
+
+import sys
+import time
+import socket
+import multiprocessing
+
+sys.path.insert(0, "../../")
+
+from rplibs.six.moves import range  # noqa # pylint: disable=import-error
+from rpcore.util.network_communication import NetworkCommunication, CommandQueue  # noqa
+
+TEST_PORT = 63399
+NUM_COMMANDS = 20000
+BATCH_SIZE = 64
+FRAME_TIME = 1.0 / 60.0
+SETTLE_TIME = 0.5
+MODES = ("plain text", "framed", "batched")
+
+WORKLOADS = (
+    ("unique keys", NUM_COMMANDS),
+    ("slider drag", 8),
+)
+
+
+class Receiver(object):
+
+    """ Listens on the test port and drains the queue like the pipeline would,
+    once per frame """
+
+    def __init__(self):
+        self.queue = CommandQueue(NetworkCommunication.MAX_QUEUE_SIZE)
+        self.applied = {}
+        NetworkCommunication.listen_threaded(TEST_PORT, self._on_datagram)
+        time.sleep(0.1)
+
+    def _on_datagram(self, data):
+        self.queue.receive(data)
+
+    def reset(self):
+        self.queue = CommandQueue(NetworkCommunication.MAX_QUEUE_SIZE)
+        self.applied = {}
+
+    def drain(self):
+        for cmd in self.queue.pop_all():
+            self.applied[NetworkCommunication.get_command_key(cmd)] = cmd
+
+
+def make_commands(num_keys):
+    """ Generates serialized material updates, cycling through num_keys materials """
+    return ["update_material mat{} 0.6 0.6 0.6 {:.4f} 1.51 0.0 0 0.5 0.0 0.0".format(
+        i % num_keys, (i % 1000) / 1000.0) for i in range(NUM_COMMANDS)]
+
+
+def make_datagrams(mode, commands):
+    """ Encodes the commands for the given mode, returns the datagrams and the
+    amount of commands they contain """
+    if mode == "plain text":
+        return [cmd.encode("utf-8") for cmd in commands], len(commands)
+    if mode == "framed":
+        datagrams = [NetworkCommunication.encode_batch(TEST_PORT, [cmd])[0] for cmd in commands]
+        return datagrams, len(commands)
+    datagrams, num_entries = [], 0
+    for offset in range(0, len(commands), BATCH_SIZE):
+        batch = commands[offset:offset + BATCH_SIZE]
+        datagrams += NetworkCommunication.encode_batch(TEST_PORT, batch)
+        num_entries += len(set(NetworkCommunication.get_command_key(cmd) for cmd in batch))
+    return datagrams, num_entries
+
+
+def send(mode, num_keys, results):
+    """ Encodes and sends the commands, runs in the sender process """
+    commands = make_commands(num_keys)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.time()
+    datagrams, num_entries = make_datagrams(mode, commands)
+    for datagram in datagrams:
+        sock.sendto(datagram, ("127.0.0.1", TEST_PORT))
+    results.put((time.time() - start, len(datagrams), num_entries))
+    sock.close()
+
+
+def run(receiver, mode, num_keys):
+    """ Sends the commands from a separate process while draining the
+    receiver each frame, returns the measured statistics """
+    receiver.reset()
+    results = multiprocessing.Queue()
+    sender = multiprocessing.Process(target=send, args=(mode, num_keys, results))
+    sender.start()
+    while sender.is_alive():
+        receiver.drain()
+        time.sleep(FRAME_TIME)
+    sender.join()
+    duration, num_datagrams, num_entries = results.get()
+
+    time.sleep(SETTLE_TIME)
+    receiver.drain()
+
+    queue = receiver.queue
+    num_lost = num_entries - queue.num_received - queue.num_stale
+    drop_rate = (num_lost + queue.num_stale + queue.num_dropped) / num_entries
+
+    final_state = {}
+    for cmd in make_commands(num_keys):
+        final_state[NetworkCommunication.get_command_key(cmd)] = cmd
+    final_ok = receiver.applied == final_state
+    return NUM_COMMANDS / duration, num_datagrams, num_lost, queue.num_dropped, drop_rate, final_ok
+
+
+if __name__ == "__main__":
+    receiver = Receiver()
+    print("Commands:", NUM_COMMANDS, " Batch size:", BATCH_SIZE,
+          " Queue size:", NetworkCommunication.MAX_QUEUE_SIZE)
+    print("{:<12} {:<11} {:>10} {:>10} {:>8} {:>8} {:>10} {:>8}".format(
+        "Workload", "Mode", "msgs/s", "datagrams", "lost", "dropped", "drop rate", "final"))
+    for workload, num_keys in WORKLOADS:
+        for mode in MODES:
+            rate, num_datagrams, num_lost, num_dropped, drop_rate, final_ok = run(
+                receiver, mode, num_keys)
+            print("{:<12} {:<11} {:>10.0f} {:>10} {:>8} {:>8} {:>9.2f}% {:>8}".format(
+                workload, mode, rate, num_datagrams, num_lost, num_dropped,
+                drop_rate * 100.0, str(final_ok)))
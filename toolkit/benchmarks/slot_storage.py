@@ -0,0 +1,65 @@
+"""
+
+Micro-benchmark comparing the allocator modes of the python PointerSlotStorage.
+
+It simulates a streamed level: lights are added until the storage holds
+NUM_LIGHTS entries, then a fraction of them gets removed and re-added in
+random order, as it happens when chunks get loaded and unloaded.
+
+(c) 2016 tobpsr
+
+"""
+
+from __future__ import print_function, division
+
+import sys
+import time
+import random
+
+sys.path.insert(0, "../../")
+
+from rplibs.six.moves import range  # noqa # pylint: disable=import-error
+from rpcore.pynative.pointer_slot_storage import PointerSlotStorage  # noqa
+
+MAX_LIGHT_COUNT = 65535
+NUM_LIGHTS = 10000
+NUM_CHURN = 2000
+SOURCES_PER_LIGHT = 6
+
+
+def run(allocator):
+    """ Runs the benchmark with the given allocator mode and returns the
+    time spent in seconds for filling, churning and allocating runs """
+    random.seed(42)
+    storage = PointerSlotStorage(MAX_LIGHT_COUNT, allocator)
+    timings = []
+
+    start = time.time()
+    for i in range(NUM_LIGHTS):
+        storage.reserve_slot(storage.find_slot(), True)
+    timings.append(time.time() - start)
+
+    start = time.time()
+    for i in range(NUM_CHURN):
+        slot = random.randrange(NUM_LIGHTS)
+        if storage._data[slot]:  # pylint: disable=protected-access
+            storage.free_slot(slot)
+        storage.reserve_slot(storage.find_slot(), True)
+    timings.append(time.time() - start)
+
+    start = time.time()
+    for i in range(NUM_CHURN // 10):
+        slot = storage.find_consecutive_slots(SOURCES_PER_LIGHT)
+        for k in range(SOURCES_PER_LIGHT):
+            storage.reserve_slot(slot + k, True)
+    timings.append(time.time() - start)
+    return timings
+
+
+if __name__ == "__main__":
+    print("Lights:", NUM_LIGHTS, "Churn:", NUM_CHURN)
+    print("{:<10} {:>12} {:>12} {:>12}".format("Allocator", "fill", "churn", "runs"))
+    for name, mode in (("scan", PointerSlotStorage.ALLOC_scan),
+                       ("bitmap", PointerSlotStorage.ALLOC_bitmap)):
+        print("{:<10} {:>10.2f}ms {:>10.2f}ms {:>10.2f}ms".format(
+            name, *[i * 1000.0 for i in run(mode)]))
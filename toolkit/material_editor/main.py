@@ -46,7 +46,7 @@ from rplibs.six import iteritems  # noqa
 from rplibs.pyqt_imports import *  # noqa
 
 from ui.main_window_generated import Ui_MainWindow  # noqa
-from rpcore.util.network_communication import NetworkCommunication  # noqa
+from rpcore.util.network_communication import NetworkCommunication, CommandBatcher  # noqa
 
 # Allow working with an older version of the material DB.
 # ONLY for debugging the viewer.
@@ -90,6 +90,10 @@ class MaterialEditor(QMainWindow, Ui_MainWindow):
         self.materials = []
         self.material = MaterialData()
 
+        # Updates are sent while dragging the sliders, so batch them and only
+        # send the latest state of each material
+        self.update_batcher = CommandBatcher(NetworkCommunication.MATERIAL_PORT)
+
         self.setupUi(self)
         self.init_shading_models()
         self.init_bindings()
@@ -286,7 +290,7 @@ class MaterialEditor(QMainWindow, Ui_MainWindow):
             self.material.shading_model_param1,
             self.material.shading_model_param2,
         )
-        NetworkCommunication.send_async(NetworkCommunication.MATERIAL_PORT, "update_material " + serialized)
+        self.update_batcher.send("update_material " + serialized)
 
     def _update_shading_model(self):
         name, val, optional_param = self.SHADING_MODELS[self.cb_shading_model.currentIndex()]
@@ -0,0 +1,83 @@
+"""
+
+Client for the render service. Sends json requests over UDP and waits for
+the responses.
+
+"""
+
+from __future__ import print_function
+
+import json
+import time
+import socket
+
+
+class RenderServiceError(Exception):
+    """ Raised when the render service rejects a request or does not respond """
+    pass
+
+
+class RenderServiceClient(object):
+
+    """ Submits jobs to the render service and retrieves their results """
+
+    def __init__(self, address=("127.0.0.1", 62360), timeout=1.0, retries=3):
+        self.address = address
+        self.timeout = timeout
+        self.retries = retries
+
+    def request(self, message):
+        """ Sends a request and returns the response. Requests are idempotent,
+        so they get resent when no response arrives within the timeout. """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(self.timeout)
+        try:
+            for _ in range(self.retries):
+                sock.sendto(json.dumps(message).encode("utf-8"), self.address)
+                try:
+                    data, _ = sock.recvfrom(65507)
+                except socket.timeout:
+                    continue
+                response = json.loads(data.decode("utf-8"))
+                if not response.get("ok"):
+                    raise RenderServiceError(response.get("error", "Unknown error"))
+                return response
+        finally:
+            sock.close()
+        raise RenderServiceError("No response from the render service, make sure it is running")
+
+    def submit(self, scene, dest, priority=0, frames=8, view_size=(512, 512), pingback_port=None):
+        """ Submits a render job and returns its id. Identical requests
+        return the same id. """
+        message = {
+            "cmd": "submit",
+            "scene": scene,
+            "dest": dest,
+            "priority": priority,
+            "frames": frames,
+            "view_size_x": view_size[0],
+            "view_size_y": view_size[1],
+        }
+        if pingback_port is not None:
+            message["pingback_port"] = pingback_port
+        return self.request(message)["job_id"]
+
+    def get_job(self, job_id):
+        """ Returns the state of a job, including its status, duration and error """
+        return self.request({"cmd": "status", "job_id": job_id})["job"]
+
+    def get_stats(self):
+        """ Returns the amount of jobs per status and the amount of workers """
+        return self.request({"cmd": "stats"})
+
+    def wait(self, job_id, timeout=None, poll_interval=0.05):
+        """ Waits until a job finished and returns its state. Raises a
+        RenderServiceError on timeout. """
+        start = time.time()
+        while True:
+            job = self.get_job(job_id)
+            if job["status"] in ("done", "failed"):
+                return job
+            if timeout is not None and time.time() - start > timeout:
+                raise RenderServiceError("Timeout while waiting for job " + job_id)
+            time.sleep(poll_interval)
@@ -5,54 +5,31 @@ The render service should be running.
 
 """
 
-import sys
-import pickle
-import socket
+from __future__ import print_function
 
-# Address of the render service
-renderer_ip = ("127.0.0.1", 62360)
+import sys
 
-# Port which the render service will ping when its done.
-pingback_port = 62500
+from client import RenderServiceClient, RenderServiceError
 
-# Scene data
-payload = pickle.dumps({
-    "scene": "resources/preview.bam",
-    "dest": "demo-render.png",
-    "view_size_x": 512,
-    "view_size_y": 512,
-    "pingback_port": pingback_port
-}, protocol=0)
+client = RenderServiceClient()
 
 # Start rendering
 print("Sending payload ...")
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-try:
-    sock.sendto(payload, renderer_ip)
-except Exception as msg:
-    sock.close()
-    raise msg
-
-# Wait until the renderer finished
-print("Waiting for response ...")
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-sock.settimeout(3.0)
-
 try:
-    sock.bind(("localhost", pingback_port))
-except Exception as msg:
-    print("Could not connect to pingback_port - maybe a render result is still waiting?")
-    print("Error message:", msg)
+    job_id = client.submit("resources/preview.bam", "demo-render.png")
+except RenderServiceError as msg:
+    print("Could not submit the job:", msg)
     sys.exit(1)
 
-sock.listen(1)
-
+# Wait until the renderer finished
+print("Waiting for job", job_id, "...")
 try:
-    conn, addr = sock.accept()
-except socket.timeout:
-    print("No render pipeline response within timeout! Make sure the service is running.")
-    sock.close()
+    job = client.wait(job_id, timeout=30.0)
+except RenderServiceError as msg:
+    print(msg)
     sys.exit(1)
 
-print("Rendering was done!")
+if job["status"] == "done":
+    print("Rendering was done in", round(job["duration"], 2), "seconds!")
+else:
+    print("Rendering failed:", job["error"])
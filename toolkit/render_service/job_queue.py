@@ -0,0 +1,205 @@
+"""
+
+Persistent priority queue of render jobs, used by the render service.
+
+Each job gets an id derived from its render parameters, so identical requests
+map to the same job and only get rendered once. The queue is stored as json,
+so pending jobs survive a restart of the service.
+
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import heapq
+import hashlib
+
+from rplibs.six import string_types
+
+
+class JobQueue(object):
+
+    """ Priority queue of render jobs. Jobs with a higher priority are taken
+    first, jobs with the same priority in the order they were submitted. """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    # Parameters which define the result of a render, and thus the job id
+    RENDER_PARAMETERS = ("scene", "dest", "view_size_x", "view_size_y", "frames")
+
+    DEFAULT_FRAMES = 8
+    MAX_FRAMES = 256
+
+    # The pipeline requires view sizes to be a multiple of 4
+    MIN_VIEW_SIZE = 16
+    MAX_VIEW_SIZE = 4096
+
+    def __init__(self, path=None, max_finished=1000):
+        self.path = path
+        self.max_finished = max_finished
+        self.jobs = {}
+        self._heap = []
+        self._counter = 0
+        if path and os.path.isfile(path):
+            self.load()
+
+    @classmethod
+    def make_job_id(cls, params):
+        """ Returns the id of a job with the given render parameters """
+        key = json.dumps([params[name] for name in cls.RENDER_PARAMETERS])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def parse_request(cls, request):
+        """ Validates a submit request and returns its render parameters, the
+        priority and the pingback port. Raises a ValueError on invalid requests. """
+        for name in ("scene", "dest"):
+            if not isinstance(request.get(name), string_types):
+                raise ValueError("Missing or invalid field: " + name)
+        try:
+            params = {
+                "scene": request["scene"],
+                "dest": request["dest"],
+                "view_size_x": int(request.get("view_size_x", 512)),
+                "view_size_y": int(request.get("view_size_y", 512)),
+                "frames": int(request.get("frames", cls.DEFAULT_FRAMES)),
+            }
+            priority = int(request.get("priority", 0))
+            pingback_port = request.get("pingback_port")
+            if pingback_port is not None:
+                pingback_port = int(pingback_port)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid numeric field")
+        if not 1 <= params["frames"] <= cls.MAX_FRAMES:
+            raise ValueError("Frames must be between 1 and " + str(cls.MAX_FRAMES))
+        for name in ("view_size_x", "view_size_y"):
+            if not cls.MIN_VIEW_SIZE <= params[name] <= cls.MAX_VIEW_SIZE or params[name] % 4:
+                raise ValueError("View size must be a multiple of 4 between " +
+                                 str(cls.MIN_VIEW_SIZE) + " and " + str(cls.MAX_VIEW_SIZE))
+        return params, priority, pingback_port
+
+    def submit(self, params, priority=0, pingback_port=None):
+        """ Adds a job, returns the job and whether it is a duplicate of an
+        existing job. Duplicates of pending jobs raise their priority if
+        required, duplicates of finished jobs only get rendered again if the
+        result is missing or the job failed. """
+        job_id = self.make_job_id(params)
+        job = self.jobs.get(job_id)
+        duplicate = job is not None
+
+        if job is None or job["status"] == self.FAILED or (
+                job["status"] == self.DONE and not os.path.isfile(job["dest"])):
+            job = dict(params)
+            job.update({
+                "id": job_id,
+                "status": self.PENDING,
+                "priority": priority,
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "duration": None,
+                "worker": None,
+                "error": None,
+                "pingback_ports": [],
+            })
+            self.jobs[job_id] = job
+            self._push(job)
+        elif job["status"] == self.PENDING and priority > job["priority"]:
+            job["priority"] = priority
+            self._push(job)
+
+        if pingback_port is not None:
+            if job["status"] in (self.PENDING, self.RUNNING):
+                job["pingback_ports"].append(pingback_port)
+        return job, duplicate
+
+    def _push(self, job):
+        """ Internal method to add a job to the heap. Outdated heap entries are
+        skipped when popping. """
+        self._counter += 1
+        job["order"] = self._counter
+        heapq.heappush(self._heap, (-job["priority"], self._counter, job["id"]))
+
+    def pop(self):
+        """ Takes the pending job with the highest priority and marks it as
+        running, returns None if there is no pending job """
+        while self._heap:
+            _, order, job_id = heapq.heappop(self._heap)
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != self.PENDING or job["order"] != order:
+                continue
+            job["status"] = self.RUNNING
+            job["started"] = time.time()
+            return job
+        return None
+
+    def finish(self, job_id, worker, duration, error=None):
+        """ Marks a running job as done or failed, returns the job """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job["status"] = self.FAILED if error else self.DONE
+        job["finished"] = time.time()
+        job["duration"] = duration
+        job["worker"] = worker
+        job["error"] = error
+        self._prune()
+        return job
+
+    def fail_pending(self, error):
+        """ Marks all pending jobs as failed, returns the failed jobs """
+        failed = []
+        job = self.pop()
+        while job is not None:
+            failed.append(self.finish(job["id"], None, None, error))
+            job = self.pop()
+        return failed
+
+    def get(self, job_id):
+        """ Returns the job with the given id, or None """
+        return self.jobs.get(job_id)
+
+    def get_stats(self):
+        """ Returns the amount of jobs per status """
+        stats = dict((status, 0) for status in (self.PENDING, self.RUNNING, self.DONE, self.FAILED))
+        for job in self.jobs.values():
+            stats[job["status"]] += 1
+        return stats
+
+    def _prune(self):
+        """ Internal method to forget the oldest finished jobs """
+        finished = [job for job in self.jobs.values() if job["status"] in (self.DONE, self.FAILED)]
+        if len(finished) > self.max_finished:
+            finished.sort(key=lambda job: job["finished"])
+            for job in finished[:len(finished) - self.max_finished]:
+                del self.jobs[job["id"]]
+
+    def load(self):
+        """ Loads the queue from disk. Jobs which were running when the service
+        stopped get rendered again. """
+        with open(self.path, "r") as handle:
+            jobs = json.load(handle)
+        self.jobs, self._heap = {}, []
+        for job in sorted(jobs, key=lambda job: job.get("order", 0)):
+            if job["status"] == self.RUNNING:
+                job["status"] = self.PENDING
+            self.jobs[job["id"]] = job
+            if job["status"] == self.PENDING:
+                self._push(job)
+
+    def save(self):
+        """ Writes the queue to disk. A temporary file is used, so the queue
+        does not get corrupted when the service stops while writing. """
+        if not self.path:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as handle:
+            json.dump(list(self.jobs.values()), handle, indent=1)
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
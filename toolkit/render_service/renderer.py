@@ -0,0 +1,113 @@
+"""
+
+Offscreen renderer used by the workers of the render service. Each worker
+process runs its own instance of the render pipeline.
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+from panda3d.core import load_prc_file_data, Filename, Mat4
+from panda3d.core import CS_zup_right, CS_yup_right, BamCache
+from direct.showbase.ShowBase import ShowBase
+
+sys.path.insert(0, "../../")
+from rpcore import RenderPipeline, PointLight  # noqa
+
+
+class Renderer(ShowBase):
+
+    def __init__(self):
+        load_prc_file_data("", "win-size 512 512")
+        load_prc_file_data("", "window-type offscreen")
+        load_prc_file_data("", "model-cache-dir")
+        load_prc_file_data("", "model-cache-textures #f")
+        load_prc_file_data("", "textures-power-2 none")
+        load_prc_file_data("", "alpha-bits 0")
+        load_prc_file_data("", "print-pipe-types #f")
+
+        # Construct render pipeline
+        self.render_pipeline = RenderPipeline()
+        self.render_pipeline.mount_mgr.config_dir = "config/"
+        self.render_pipeline.create(self)
+
+        self.setup_scene()
+
+        # Disable model caching
+        BamCache.get_global_ptr().cache_models = False
+
+        # Render initial frames
+        for i in range(10):
+            self.taskMgr.step()
+
+    def set_view_size(self, width, height):
+        """ Resizes the offscreen buffer, and the render targets of the pipeline """
+        if width == self.win.get_x_size() and height == self.win.get_y_size():
+            return
+        self.win.set_size(width, height)
+        self.render_pipeline.handle_window_resize()
+
+    def render_job(self, job):
+        """ Renders the scene of a job and saves the result """
+        self.set_view_size(job["view_size_x"], job["view_size_y"])
+        scene = self.loader.loadModel(Filename.from_os_specific(job["scene"]))
+
+        for light in scene.find_all_matches("**/+PointLight"):
+            light.remove_node()
+        for light in scene.find_all_matches("**/+Spotlight"):
+            light.remove_node()
+
+        # Find camera
+        main_cam = scene.find("**/Camera")
+        if main_cam:
+            transform_mat = main_cam.get_transform(self.render).get_mat()
+            transform_mat = Mat4.convert_mat(CS_zup_right, CS_yup_right) * transform_mat
+            self.camera.set_mat(transform_mat)
+        else:
+            print("WARNING: No camera found")
+            self.camera.set_pos(0, -3.5, 0)
+            self.camera.look_at(0, -2.5, 0)
+
+        self.camLens.set_fov(64.0)
+        self.camLens.set_aspect_ratio(float(job["view_size_x"]) / job["view_size_y"])
+
+        scene.reparent_to(self.render)
+
+        try:
+            # Render scene
+            for i in range(job["frames"]):
+                self.taskMgr.step()
+
+            dest_path = Filename.from_os_specific(job["dest"])
+            print("Saving screenshot to", dest_path)
+            if not self.win.save_screenshot(dest_path):
+                raise IOError("Could not save screenshot to " + job["dest"])
+        finally:
+            scene.remove_node()
+
+    def setup_scene(self):
+        """ Setups the basic scene geometry """
+        self.disableMouse()
+        self.render2d.hide()
+        self.aspect2d.hide()
+
+        light = PointLight()
+        light.pos = 20.0, -0.85, -1.31
+        light.radius = 100.0
+        light.energy = 2500
+        light.set_color_from_temperature(8000)
+        # self.render_pipeline.add_light(light)
+
+        light = PointLight()
+        light.pos = -11.2, -13.84, -9.24
+        light.radius = 1e20
+        light.set_color_from_temperature(8000)
+        light.energy = 2500
+        # self.render_pipeline.add_light(light)
+
+        # envprobe = self.render_pipeline.add_environment_probe()
+        # envprobe.set_pos(0, -16.2, 4.4)
+        # envprobe.set_scale(40, 40, 40)
+        # envprobe.parallax_correction = False
@@ -2,173 +2,292 @@
 
 Render service to render previews of materials
 
+The service keeps a pool of worker processes, each running the render pipeline
+offscreen, and distributes the queued jobs to them. Requests are json objects
+sent over UDP, each request gets a json response:
+
+    {"cmd": "submit", "scene": ..., "dest": ..., "priority": 0, "frames": 8}
+        -> {"ok": true, "job_id": ..., "status": ..., "duplicate": false}
+    {"cmd": "status", "job_id": ...}
+        -> {"ok": true, "job": {...}}
+    {"cmd": "stats"}
+        -> {"ok": true, "stats": {...}, "workers": 4}
+
+Identical submit requests map to the same job id. Optionally a pingback_port
+can be passed, which gets notified over TCP when the job finished.
+
 """
 
 from __future__ import print_function
 
 import sys
-import socket
+import json
 import time
-import pickle
-
-from threading import Thread
-
-from panda3d.core import load_prc_file_data, Filename, Mat4
-from panda3d.core import CS_zup_right, CS_yup_right, BamCache
-from direct.showbase.ShowBase import ShowBase
+import socket
+import argparse
+import multiprocessing
 
 sys.path.insert(0, "../../")
-from rpcore import RenderPipeline, PointLight  # noqa
-
-
-class Application(ShowBase):
-
-    ICOMING_PORT = 62360
+from rplibs.six.moves.queue import Empty  # noqa  # pylint: disable=import-error
+from job_queue import JobQueue  # noqa
 
-    def __init__(self):
-        load_prc_file_data("", "win-size 512 512")
-        load_prc_file_data("", "window-type offscreen")
-        load_prc_file_data("", "model-cache-dir")
-        load_prc_file_data("", "model-cache-textures #f")
-        load_prc_file_data("", "textures-power-2 none")
-        load_prc_file_data("", "alpha-bits 0")
-        load_prc_file_data("", "print-pipe-types #f")
 
-        # Construct render pipeline
-        self.render_pipeline = RenderPipeline()
-        self.render_pipeline.mount_mgr.config_dir = "config/"
-        self.render_pipeline.create(self)
-
-        self.setup_scene()
-
-        # Disable model caching
-        BamCache.get_global_ptr().cache_models = False
-
-        self.update_queue = []
-        self.start_listen()
-
-        # Render initial frames
-        for i in range(10):
-            self.taskMgr.step()
-
-        last_update = 0.0
-        self.scene_node = None
-
-        # Wait for updates
-        while True:
+def worker_main(index, task_queue, result_queue, dry_run):
+    """ Main loop of a worker process, renders jobs until it receives None.
+    Reports whether the renderer could be started with a result without job id. """
+    renderer = None
+    if not dry_run:
+        try:
+            from renderer import Renderer
+            renderer = Renderer()
+        except Exception as msg:
+            result_queue.put((None, index, None, "Could not start the renderer: " + str(msg)))
+            return
+    result_queue.put((None, index, None, None))
 
+    while True:
+        try:
+            job = task_queue.get(timeout=1.0)
+        except Empty:
             # Update once in a while
-            curr_time = time.time()
-            if curr_time > last_update + 1.0:
-                last_update = curr_time
-                self.taskMgr.step()
-
-            if self.update_queue:
-                if self.scene_node:
-                    self.scene_node.remove_node()
-
-                # Only take the latest packet
-                payload = self.update_queue.pop(0)
-                print("RENDERING:", payload)
-
-                scene = self.loader.loadModel(Filename.from_os_specific(payload["scene"]))
-
-                for light in scene.find_all_matches("**/+PointLight"):
-                    light.remove_node()
-                for light in scene.find_all_matches("**/+Spotlight"):
-                    light.remove_node()
-
-                # Find camera
-                main_cam = scene.find("**/Camera")
-                if main_cam:
-                    transform_mat = main_cam.get_transform(self.render).get_mat()
-                    transform_mat = Mat4.convert_mat(CS_zup_right, CS_yup_right) * transform_mat
-                    self.camera.set_mat(transform_mat)
-                else:
-                    print("WARNING: No camera found")
-                    self.camera.set_pos(0, -3.5, 0)
-                    self.camera.look_at(0, -2.5, 0)
-
-                self.camLens.set_fov(64.0)
-
-                self.scene_node = scene
-                scene.reparent_to(self.render)
+            if renderer:
+                renderer.taskMgr.step()
+            continue
 
-                # Render scene
-                for i in range(8):
-                    self.taskMgr.step()
+        if job is None:
+            break
 
-                dest_path = Filename.from_os_specific(payload["dest"])
-                print("Saving screenshot to", dest_path)
-                self.win.save_screenshot(dest_path)
-                self.notify_about_finish(int(payload["pingback_port"]))
-
-    def start_listen(self):
-        """ Starts the listener thread """
-        thread = Thread(target=self.listener_thread, args=(), name="ListenerThread")
-        thread.setDaemon(True)
-        thread.start()
-        return thread
-
-    def listener_thread(self):
-        """ Thread which listens to incoming updates """
+        print("Worker", index, "rendering:", job["scene"], "->", job["dest"])
+        start = time.time()
+        error = None
+        try:
+            if renderer:
+                renderer.render_job(job)
+            else:
+                time.sleep(0.005 * job["frames"])
+        except Exception as msg:
+            error = str(msg)
+        result_queue.put((job["id"], index, time.time() - start, error))
+
+
+class RenderService(object):
+
+    """ Receives requests, keeps the job queue and distributes the jobs to the
+    worker processes """
+
+    INCOMING_PORT = 62360
+    MAX_MESSAGE_SIZE = 65507
+
+    # Workers which fail to start get restarted with a delay, which doubles
+    # with each consecutive failure. After too many failures the slot is
+    # given up, and if no worker is left, the service stops.
+    RESTART_DELAY = 1.0
+    MAX_RESTART_DELAY = 60.0
+    MAX_STARTUP_FAILURES = 5
+
+    def __init__(self, num_workers, queue_path=None, dry_run=False):
+        self.num_workers = num_workers
+        self.dry_run = dry_run
+        self.queue = JobQueue(queue_path)
+        self.result_queue = multiprocessing.Queue()
+        self.workers = [None] * num_workers
+        self.task_queues = [None] * num_workers
+        self.assigned_jobs = [None] * num_workers
+        self.ready = [False] * num_workers
+        self.startup_errors = [None] * num_workers
+        self.startup_failures = [0] * num_workers
+        self.restart_times = [None] * num_workers
+        for index in range(num_workers):
+            self.start_worker(index)
+
+    def start_worker(self, index):
+        """ Starts the worker process with the given index """
+        self.ready[index] = False
+        self.startup_errors[index] = None
+        self.task_queues[index] = multiprocessing.Queue()
+        self.workers[index] = multiprocessing.Process(
+            target=worker_main, name="RenderWorker-" + str(index),
+            args=(index, self.task_queues[index], self.result_queue, self.dry_run))
+        self.workers[index].daemon = True
+        self.workers[index].start()
+
+    def run(self):
+        """ Listens to requests and dispatches jobs, never returns """
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        print("Listening on 127.0.0.1:" + str(self.ICOMING_PORT))
+        sock.bind(("127.0.0.1", self.INCOMING_PORT))
+        sock.settimeout(0.01)
+        print("Listening on 127.0.0.1:" + str(self.INCOMING_PORT), "with",
+              self.num_workers, "workers")
+
         try:
-            sock.bind(("127.0.0.1", self.ICOMING_PORT))
             while True:
-                data, addr = sock.recvfrom(8192)
-                self.handle_data(data)
-        except Exception as msg:
-            print("Failed to bind to address! Reason:", msg)
+                changed = False
+                try:
+                    data, addr = sock.recvfrom(self.MAX_MESSAGE_SIZE)
+                    response, changed = self.handle_request(data)
+                    sock.sendto(json.dumps(response).encode("utf-8"), addr)
+                except socket.timeout:
+                    pass
+                changed = self.collect_results() or changed
+                changed = self.check_workers() or changed
+                changed = self.dispatch_jobs() or changed
+                if changed:
+                    self.queue.save()
         finally:
             sock.close()
 
-    def handle_data(self, data):
-        """ Handles a new update """
-        # print("Got:", data)
-        unpacked_data = pickle.loads(data)
-        # print("Data = ", unpacked_data)
-        self.update_queue.append(unpacked_data)
+    def handle_request(self, data):
+        """ Handles a request, returns the response and whether the job queue
+        changed. Only submits change the queue, status and stats polls do not. """
+        try:
+            request = json.loads(data.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError()
+        except ValueError:
+            return {"ok": False, "error": "Invalid message, expected a json object"}, False
+
+        cmd = request.get("cmd", "submit")
+        if cmd == "submit":
+            try:
+                params, priority, pingback_port = JobQueue.parse_request(request)
+            except ValueError as msg:
+                return {"ok": False, "error": str(msg)}, False
+            job, duplicate = self.queue.submit(params, priority, pingback_port)
+            if pingback_port is not None and job["status"] == JobQueue.DONE:
+                self.notify_about_finish(pingback_port)
+            return ({"ok": True, "job_id": job["id"], "status": job["status"],
+                     "duplicate": duplicate}, True)
+
+        elif cmd == "status":
+            job = self.queue.get(request.get("job_id"))
+            if job is None:
+                return {"ok": False, "error": "Unknown job id"}, False
+            return {"ok": True, "job": job}, False
+
+        elif cmd == "stats":
+            stats = self.queue.get_stats()
+            return {"ok": True, "stats": stats, "workers": self.num_workers}, False
+
+        return {"ok": False, "error": "Unknown command: " + str(cmd)}, False
+
+    def collect_results(self):
+        """ Processes the results of finished jobs """
+        changed = False
+        while True:
+            try:
+                job_id, index, duration, error = self.result_queue.get_nowait()
+            except Empty:
+                return changed
+            if job_id is None:
+                # Startup report of a worker
+                if error:
+                    self.startup_errors[index] = error
+                else:
+                    self.ready[index] = True
+                    self.startup_failures[index] = 0
+                continue
+            self.assigned_jobs[index] = None
+            job = self.queue.finish(job_id, index, duration, error)
+            if job is not None:
+                if error:
+                    print("Job", job_id, "failed:", error)
+                for port in job["pingback_ports"]:
+                    self.notify_about_finish(port)
+                job["pingback_ports"] = []
+            changed = True
+
+    def check_workers(self):
+        """ Restarts crashed workers, failing the job they were rendering.
+        Workers which fail to start are restarted with a growing delay. """
+        changed = False
+        now = time.time()
+        for index, worker in enumerate(self.workers):
+            if self.restart_times[index] is not None:
+                if now >= self.restart_times[index]:
+                    self.restart_times[index] = None
+                    self.start_worker(index)
+                continue
+            if worker is None or worker.is_alive():
+                continue
+
+            if not self.ready[index]:
+                self.startup_failures[index] += 1
+                error = self.startup_errors[index] or "Exited with code " + str(worker.exitcode)
+                if self.startup_failures[index] >= self.MAX_STARTUP_FAILURES:
+                    print("Worker", index, "failed to start", self.startup_failures[index],
+                          "times, giving up:", error)
+                    self.workers[index] = None
+                    continue
+                delay = min(self.MAX_RESTART_DELAY,
+                            self.RESTART_DELAY * 2 ** (self.startup_failures[index] - 1))
+                print("Worker", index, "failed to start:", error)
+                print("Restarting it in", delay, "seconds")
+                self.restart_times[index] = now + delay
+                continue
+
+            print("Worker", index, "stopped unexpectedly, restarting it")
+            job_id = self.assigned_jobs[index]
+            if job_id is not None:
+                self.queue.finish(job_id, index, None, "Worker stopped unexpectedly")
+                self.assigned_jobs[index] = None
+            self.start_worker(index)
+            changed = True
+
+        if all(worker is None for worker in self.workers):
+            self.stop_without_workers()
+        return changed
+
+    def stop_without_workers(self):
+        """ Fails all pending jobs with the error of the workers and stops the
+        service, called when no worker could be started """
+        errors = [error for error in self.startup_errors if error] or ["Unknown error"]
+        error = "No worker could be started: " + errors[0]
+        for job in self.queue.fail_pending(error):
+            for port in job["pingback_ports"]:
+                self.notify_about_finish(port)
+            job["pingback_ports"] = []
+        self.queue.save()
+        raise SystemExit(error)
+
+    def dispatch_jobs(self):
+        """ Hands pending jobs to idle workers. Jobs are only handed out when a
+        started worker is idle, so later jobs with a higher priority still get taken first. """
+        changed = False
+        for index, job_id in enumerate(self.assigned_jobs):
+            if job_id is not None or not self.ready[index]:
+                continue
+            job = self.queue.pop()
+            if job is None:
+                break
+            self.assigned_jobs[index] = job["id"]
+            self.task_queues[index].put(job)
+            changed = True
+        return changed
 
     def notify_about_finish(self, port):
         """ Notifies the caller that the result finished """
         print("Sending finish result to localhost:" + str(port))
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(1.0)
         try:
             sock.connect(("localhost", port))
+            sock.sendall(b"done")
         except Exception as msg:
             print("Could not send finish result: ", msg)
-            return
-        sock.sendall(b"done")
-        print("Sent done flag.")
-        sock.close()
-
-    def setup_scene(self):
-        """ Setups the basic scene geometry """
-        self.disableMouse()
-        self.render2d.hide()
-        self.aspect2d.hide()
-
-        light = PointLight()
-        light.pos = 20.0, -0.85, -1.31
-        light.radius = 100.0
-        light.energy = 2500
-        light.set_color_from_temperature(8000)
-        # self.render_pipeline.add_light(light)
-
-        light = PointLight()
-        light.pos = -11.2, -13.84, -9.24
-        light.radius = 1e20
-        light.set_color_from_temperature(8000)
-        light.energy = 2500
-        # self.render_pipeline.add_light(light)
-
-        # envprobe = self.render_pipeline.add_environment_probe()
-        # envprobe.set_pos(0, -16.2, 4.4)
-        # envprobe.set_scale(40, 40, 40)
-        # envprobe.parallax_correction = False
-
-Application()
+        finally:
+            sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render service for material previews")
+    parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1),
+                        help="Amount of worker processes, each running the pipeline")
+    parser.add_argument("--queue", default="job_queue.json",
+                        help="File to store the job queue in, so it persists across restarts")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Do not render, only simulate the render time. "
+                             "Useful to test clients.")
+    args = parser.parse_args()
+    RenderService(args.workers, args.queue, args.dry_run).run()
@@ -0,0 +1,102 @@
+"""
+
+Test client for the render service. Submits a batch of jobs with different
+priorities, including duplicate requests, waits for all results and prints
+the throughput. The render service should be running, for testing without
+rendering it can be started with --dry-run.
+
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import random
+import argparse
+
+from client import RenderServiceClient, RenderServiceError
+
+
+def run_test(client, num_jobs, num_duplicates, output_dir):
+    """ Runs the test and returns the amount of failures """
+    failures = 0
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # Use a unique destination per run, so no results of previous runs get reused
+    run_id = str(int(time.time()))
+    requests = []
+    for i in range(num_jobs):
+        dest = os.path.join(output_dir, "render-{}-{}.png".format(run_id, i))
+        requests.append((dest, random.randint(0, 10)))
+
+    start = time.time()
+    job_ids = {}
+    for dest, priority in requests:
+        job_ids[dest] = client.submit("resources/preview.bam", dest, priority=priority)
+
+    # Identical requests have to map to the same job
+    for dest, priority in random.sample(requests, min(num_duplicates, num_jobs)):
+        job_id = client.submit("resources/preview.bam", dest, priority=priority)
+        if job_id != job_ids[dest]:
+            print("FAIL: Duplicate request got a different job id:", dest)
+            failures += 1
+
+    submit_duration = time.time() - start
+    print("Submitted", num_jobs, "jobs and", num_duplicates, "duplicates in",
+          round(submit_duration * 1000.0, 1), "ms")
+
+    # Retrieve the results by id
+    durations = []
+    for dest, job_id in job_ids.items():
+        job = client.wait(job_id, timeout=600.0)
+        if job["status"] != "done":
+            print("FAIL: Job", job_id, "failed:", job["error"])
+            failures += 1
+        elif job["dest"] != dest:
+            print("FAIL: Job", job_id, "has the wrong destination:", job["dest"])
+            failures += 1
+        else:
+            durations.append(job["duration"])
+
+    total_duration = time.time() - start
+    stats = client.get_stats()
+    print("Finished", len(durations), "jobs in", round(total_duration, 2), "seconds with",
+          stats["workers"], "workers")
+    print("Throughput:", round(len(durations) / total_duration, 2), "jobs/s, average job time:",
+          round(sum(durations) / max(1, len(durations)) * 1000.0, 1), "ms")
+    print("Queue:", stats["stats"])
+
+    # Invalid requests have to be rejected
+    try:
+        client.request({"cmd": "submit", "scene": 42})
+        print("FAIL: Invalid request was accepted")
+        failures += 1
+    except RenderServiceError:
+        pass
+    try:
+        client.submit("resources/preview.bam", "invalid.png", view_size=(510, 512))
+        print("FAIL: Invalid view size was accepted")
+        failures += 1
+    except RenderServiceError:
+        pass
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test client for the render service")
+    parser.add_argument("--jobs", type=int, default=32, help="Amount of jobs to submit")
+    parser.add_argument("--duplicates", type=int, default=8, help="Amount of duplicate requests")
+    parser.add_argument("--output", default="test-renders", help="Directory for the renders")
+    args = parser.parse_args()
+
+    try:
+        failures = run_test(RenderServiceClient(), args.jobs, args.duplicates, args.output)
+    except RenderServiceError as msg:
+        print("Error:", msg)
+        sys.exit(1)
+
+    print("All checks passed." if not failures else "{} checks failed.".format(failures))
+    sys.exit(1 if failures else 0)